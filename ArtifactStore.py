@@ -0,0 +1,183 @@
+from constants import *
+from typing import Callable, Any
+import numpy as np
+import threading
+import tempfile
+import shutil
+import uuid
+import os
+
+
+def default_spill_root() -> str:
+    """tmpfs when the platform has one, otherwise the system temp directory."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+class Artifact:
+    """
+    One intermediate output of a run. Its content lives in memory as bytes or an array,
+    in a file, or both once a path has been requested for an in-memory artifact.
+    """
+
+    def __init__(self, key : str, suffix : str, data : bytes | None = None, array : np.ndarray | None = None,
+                 path : str | None = None, owned : bool = True):
+        self.key = key
+        self.suffix = suffix
+        self.data = data
+        self.array = array
+        self.path = path
+        # owned files are deleted with the artifact, files registered from elsewhere are left alone
+        self.owned = owned
+        self.decoded : Any = None
+        self.refcount = 1
+
+
+class ArtifactStore:
+    """
+    Holds the artifacts passed between pipeline stages (narrations, images, clips, audio).
+    Small artifacts stay in memory, large ones spill to a private directory on tmpfs, and
+    a file is only written for an in-memory artifact when a consumer needs a path (ffmpeg).
+    Artifacts are reference counted and everything left is removed when the store closes.
+    """
+
+    def __init__(self, spill_threshold_bytes : int = ARTIFACT_SPILL_THRESHOLD_BYTES, spill_root : str | None = None):
+        """
+        :param spill_threshold_bytes: Artifacts larger than this are written to the spill directory.
+        :param spill_root: Directory the private spill directory is created in, tmpfs by default.
+        """
+        self.spill_threshold_bytes = spill_threshold_bytes
+        self.spill_dir = tempfile.mkdtemp(prefix="content_engine_", dir=spill_root or default_spill_root())
+        self.artifacts : dict[str, Artifact] = {}
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def new_path(self, suffix : str) -> tuple[str, str]:
+        """Reserves an owned file in the spill directory for a producer that can only write to a path
+
+        Returns:
+            tuple[str, str]: the artifact key and the path to write to
+        """
+        key = str(uuid.uuid4())
+        path = os.path.join(self.spill_dir, key + suffix)
+        with self.lock:
+            self.artifacts[key] = Artifact(key, suffix, path=path)
+        return key, path
+
+    def put_bytes(self, data : bytes, suffix : str) -> str:
+        """Stores encoded bytes (an mp3, a png...) and returns the artifact key."""
+        if len(data) > self.spill_threshold_bytes:
+            key, path = self.new_path(suffix)
+            with open(path, "wb") as f:
+                f.write(data)
+            return key
+        key = str(uuid.uuid4())
+        with self.lock:
+            self.artifacts[key] = Artifact(key, suffix, data=data)
+        return key
+
+    def put_array(self, array : np.ndarray) -> str:
+        """Stores a decoded array (audio samples, a frame...) and returns the artifact key."""
+        if array.nbytes > self.spill_threshold_bytes:
+            key, path = self.new_path(".npy")
+            np.save(path, array)
+            return key
+        key = str(uuid.uuid4())
+        with self.lock:
+            self.artifacts[key] = Artifact(key, ".npy", array=array)
+        return key
+
+    def put_file(self, path : str, owned : bool = False) -> str:
+        """Registers an existing file, deleted with the artifact only if owned."""
+        key = str(uuid.uuid4())
+        with self.lock:
+            self.artifacts[key] = Artifact(key, os.path.splitext(path)[1], path=path, owned=owned)
+        return key
+
+    def get(self, key : str) -> Artifact:
+        with self.lock:
+            if key not in self.artifacts:
+                raise KeyError(f"Unknown or released artifact '{key}'.")
+            return self.artifacts[key]
+
+    def get_bytes(self, key : str) -> bytes:
+        artifact = self.get(key)
+        if artifact.data is not None:
+            return artifact.data
+        if artifact.array is not None:
+            return artifact.array.tobytes()
+        with open(artifact.path, "rb") as f: #type: ignore
+            return f.read()
+
+    def get_array(self, key : str) -> np.ndarray:
+        artifact = self.get(key)
+        if artifact.array is not None:
+            return artifact.array
+        # spilled arrays are memory mapped rather than read back in
+        return np.load(artifact.path, mmap_mode="r") #type: ignore
+
+    def get_decoded(self, key : str, decode : Callable[[bytes], Any]) -> Any:
+        """Decodes an artifact's bytes once and keeps the result for later consumers."""
+        artifact = self.get(key)
+        with self.lock:
+            if artifact.decoded is None:
+                artifact.decoded = decode(self.get_bytes(key))
+            return artifact.decoded
+
+    def get_path(self, key : str) -> str:
+        """Returns a file path for the artifact, writing in-memory content to the spill directory on first use."""
+        artifact = self.get(key)
+        with self.lock:
+            if artifact.path is None:
+                path = os.path.join(self.spill_dir, key + artifact.suffix)
+                if artifact.array is not None:
+                    np.save(path, artifact.array)
+                else:
+                    with open(path, "wb") as f:
+                        f.write(artifact.data) #type: ignore
+                artifact.path = path
+            return artifact.path
+
+    def size(self, key : str) -> int:
+        artifact = self.get(key)
+        if artifact.data is not None:
+            return len(artifact.data)
+        if artifact.array is not None:
+            return artifact.array.nbytes
+        return os.path.getsize(artifact.path) #type: ignore
+
+    def incref(self, key : str) -> str:
+        with self.lock:
+            self.get(key).refcount += 1
+        return key
+
+    def release(self, key : str) -> None:
+        """Drops one reference, deleting the artifact and any owned file once none are left."""
+        with self.lock:
+            artifact = self.get(key)
+            artifact.refcount -= 1
+            if artifact.refcount > 0:
+                return
+            del self.artifacts[key]
+        if artifact.path and artifact.owned and os.path.exists(artifact.path):
+            os.remove(artifact.path)
+        elif artifact.path and artifact.path.startswith(self.spill_dir) and os.path.exists(artifact.path):
+            # a copy materialised for a path consumer
+            os.remove(artifact.path)
+
+    def close(self) -> None:
+        """Deletes every remaining artifact and the spill directory."""
+        with self.lock:
+            keys = list(self.artifacts)
+        for key in keys:
+            artifact = self.artifacts.get(key)
+            if artifact:
+                artifact.refcount = 1
+                self.release(key)
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
@@ -0,0 +1,218 @@
+from constants import *
+from moviepy.editor import AudioFileClip
+from moviepy.audio.AudioClip import AudioClip, AudioArrayClip
+from scipy.signal import resample_poly
+from ffmpeg_tools import get_ffmpeg_binary, FFmpegError
+from math import gcd
+import numpy as np
+import subprocess
+import threading
+
+# decoded background music keyed by (track filename, sample rate), shared by every AudioEngine
+_music_cache : dict[tuple[str, int], np.ndarray] = {}
+_music_cache_lock = threading.Lock()
+
+
+def to_stereo(samples : np.ndarray) -> np.ndarray:
+    """Returns a float32 (n_samples, 2) view of a mono or stereo sample buffer."""
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    if samples.shape[1] == 1:
+        samples = np.repeat(samples, 2, axis=1)
+    return samples
+
+
+def resample(samples : np.ndarray, from_fps : int, to_fps : int) -> np.ndarray:
+    """Polyphase resampling of a sample buffer along its first axis."""
+    if from_fps == to_fps:
+        return samples.astype(np.float32)
+    divisor = gcd(from_fps, to_fps)
+    return resample_poly(samples, to_fps // divisor, from_fps // divisor, axis=0).astype(np.float32)
+
+
+def decode_audio_file(path : str, fps : int = AUDIO_FPS) -> np.ndarray:
+    """Decodes an audio file into a float32 stereo PCM array in [-1, 1]
+
+    Args:
+        path (str): path to an audio file readable by ffmpeg
+        fps (int): sample rate to decode at
+
+    Returns:
+        np.ndarray: (n_samples, 2) float32 array
+    """
+    clip = AudioFileClip(path, fps=fps)
+    try:
+        samples = clip.to_soundarray(fps=fps)
+    finally:
+        clip.close()
+    return to_stereo(samples)
+
+
+def load_music_track(music : BACKGROUND_MUSIC, fps : int = AUDIO_FPS) -> np.ndarray:
+    """Decodes a background music track once per process and caches the PCM array
+
+    Args:
+        music (BACKGROUND_MUSIC): track to load
+        fps (int): sample rate to decode at
+
+    Returns:
+        np.ndarray: (n_samples, 2) float32 array, shared between callers so treat it as read only
+    """
+    key = (music.value, fps)
+    with _music_cache_lock:
+        if key not in _music_cache:
+            samples = decode_audio_file("{}/{}".format(BACKGROUND_MUSIC_FILEPATH, music.value), fps)
+            samples.setflags(write=False)
+            _music_cache[key] = samples
+        return _music_cache[key]
+
+
+class AudioEngine:
+    """
+    Mixes narration and background music as NumPy sample buffers so the encoder
+    receives a single pre-mixed audio stream instead of a tree of lazy moviepy clips.
+    """
+
+    def __init__(self, fps : int = AUDIO_FPS,
+                 music_gain : float = BACKGROUND_MUSIC_GAIN,
+                 duck_music : bool = False,
+                 duck_gain : float = BACKGROUND_MUSIC_DUCK_GAIN):
+        """
+        :param fps: Sample rate used for every buffer handled by this engine.
+        :param music_gain: Linear gain applied to the background music.
+        :param duck_music: Whether to lower the music further while narration is speaking.
+        :param duck_gain: Extra music gain multiplier applied under speech when ducking.
+        """
+        self.fps = fps
+        self.music_gain = music_gain
+        self.duck_music = duck_music
+        self.duck_gain = duck_gain
+
+    def decode_clip_audio(self, audio : AudioClip) -> np.ndarray:
+        """Renders a moviepy audio clip into a stereo sample buffer."""
+        return to_stereo(audio.to_soundarray(fps=self.fps))
+
+    def concatenate_narrations(self, narrations : list[str | np.ndarray]) -> np.ndarray:
+        """Joins narrations into one sample buffer, decoding the ones given as files
+
+        Args:
+            narrations (list[str | np.ndarray]): narration audio files, or samples at this engine's fps, in playback order
+
+        Returns:
+            np.ndarray: (n_samples, 2) float32 array
+        """
+        buffers = [to_stereo(n) if isinstance(n, np.ndarray) else decode_audio_file(n, self.fps) for n in narrations]
+        if not buffers:
+            return np.zeros((0, 2), dtype=np.float32)
+        return np.concatenate(buffers, axis=0)
+
+    def fit_to_length(self, samples : np.ndarray, n_samples : int) -> np.ndarray:
+        """Trims or zero pads a buffer to exactly n_samples."""
+        if len(samples) >= n_samples:
+            return samples[:n_samples]
+        padding = np.zeros((n_samples - len(samples), samples.shape[1]), dtype=samples.dtype)
+        return np.concatenate([samples, padding], axis=0)
+
+    def loop_to_length(self, track : np.ndarray, n_samples : int) -> np.ndarray:
+        """Repeats a track end to end until it covers n_samples."""
+        if len(track) == 0:
+            return np.zeros((n_samples, 2), dtype=np.float32)
+        repeats = -(-n_samples // len(track))
+        return np.tile(track, (repeats, 1))[:n_samples]
+
+    def speech_gain_envelope(self, narration : np.ndarray,
+                             window_seconds : float = .05,
+                             threshold : float = .02,
+                             release_seconds : float = .3) -> np.ndarray:
+        """Computes a per-sample music gain curve that dips to duck_gain while narration is audible
+
+        Args:
+            narration (np.ndarray): narration sample buffer
+            window_seconds (float): length of the RMS analysis window
+            threshold (float): RMS level above which a window counts as speech
+            release_seconds (float): smoothing applied to the gain so ducking fades in and out
+
+        Returns:
+            np.ndarray: (n_samples,) float32 gain multiplier
+        """
+        n_samples = len(narration)
+        window = max(1, int(window_seconds * self.fps))
+        n_windows = -(-n_samples // window)
+        energy = self.fit_to_length(narration, n_windows * window).mean(axis=1) ** 2
+        rms = np.sqrt(energy.reshape(n_windows, window).mean(axis=1))
+        speech = (rms > threshold).astype(np.float32)
+
+        smoothing = max(1, int(release_seconds / window_seconds))
+        kernel = np.ones(smoothing, dtype=np.float32) / smoothing
+        speech = np.clip(np.convolve(speech, kernel, mode="same") * 2, 0, 1)
+
+        gain = 1 - (1 - self.duck_gain) * speech
+        return np.repeat(gain, window)[:n_samples].astype(np.float32)
+
+    def mix(self, narration : np.ndarray, music : BACKGROUND_MUSIC | None) -> np.ndarray:
+        """Layers the background music under the narration
+
+        Args:
+            narration (np.ndarray): narration sample buffer, defines the output length
+            music (BACKGROUND_MUSIC | None): track to mix in, or None for narration only
+
+        Returns:
+            np.ndarray: (n_samples, 2) float32 mixed buffer clipped to [-1, 1]
+        """
+        narration = to_stereo(narration)
+        if not music:
+            return narration
+        music_track = self.loop_to_length(load_music_track(music, self.fps), len(narration)) * self.music_gain
+        if self.duck_music:
+            music_track *= self.speech_gain_envelope(narration)[:, None]
+        return np.clip(narration + music_track, -1, 1)
+
+    def encode_for_transcription(self, samples : np.ndarray, output_path : str,
+                                 fps : int = TRANSCRIPTION_AUDIO_FPS, bitrate : str = TRANSCRIPTION_AUDIO_BITRATE) -> str:
+        """Encodes a buffer straight to a small mono mp3 for speech recognition
+
+        Args:
+            samples (np.ndarray): buffer at this engine's fps
+            output_path (str): where to write the mp3
+            fps (int): sample rate of the encode
+            bitrate (str): mp3 bitrate of the encode
+
+        Returns:
+            str: output_path
+        """
+        samples = to_stereo(samples)
+        process = subprocess.run(
+            [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+             "-f", "f32le", "-ar", str(self.fps), "-ac", "2", "-i", "-",
+             "-ac", "1", "-ar", str(fps), "-codec:a", "libmp3lame", "-b:a", bitrate, output_path],
+            input=np.ascontiguousarray(samples).tobytes(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise FFmpegError(process.stderr.decode("utf-8", errors="replace"))
+        return output_path
+
+    def mux_with_video(self, samples : np.ndarray, video_path : str, output_path : str, bitrate : str = "192k") -> str:
+        """Adds a buffer as the audio track of an encoded video, copying the video stream
+
+        Args:
+            samples (np.ndarray): buffer at this engine's fps, the length of the video
+            video_path (str): video to add the audio to, its own audio is dropped
+            output_path (str): where to write the muxed file
+            bitrate (str): aac bitrate of the audio track
+
+        Returns:
+            str: output_path
+        """
+        samples = to_stereo(samples)
+        process = subprocess.run(
+            [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+             "-i", video_path, "-f", "f32le", "-ar", str(self.fps), "-ac", "2", "-i", "-",
+             "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-b:a", bitrate, output_path],
+            input=np.ascontiguousarray(samples).tobytes(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise FFmpegError(process.stderr.decode("utf-8", errors="replace"))
+        return output_path
+
+    def to_audio_clip(self, samples : np.ndarray) -> AudioArrayClip:
+        """Wraps a sample buffer as a single moviepy audio stream for the encoder."""
+        return AudioArrayClip(samples, fps=self.fps)
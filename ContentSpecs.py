@@ -1,5 +1,5 @@
 from constants import *
-from typing import Literal
+from typing import Literal, TypedDict
 
 class ContentSpec:
 
@@ -60,15 +60,43 @@ class VideoSpec(ContentSpec):
     It performs basic checks on the input values to ensure they are valid.
     """
 
-    def __init__(self, type, tone, output_format, duration, visual_art_style, image_model_name = None, background_music = None):
+    def __init__(self, type, tone, output_format, duration, visual_art_style, image_model_name = None, background_music = None,
+                 output_formats : list[OUTPUT_FORMATS] | None = None):
+        """
+        :param output_formats: Formats to render from a single pass, defaults to [output_format].
+                               When several are given images are generated at MASTER_ASPECT_RATIO
+                               and cropped or padded for each format.
+        """
         super().__init__(type, tone, output_format, duration, visual_art_style, image_model_name, background_music)
 
+        output_formats = output_formats or [output_format]
+        for f in output_formats:
+            if f not in OUTPUT_FORMATS:
+                raise ValueError(f"output_formats must only contain {OUTPUT_FORMATS}, got '{f}'.")
+        self.output_formats = list(dict.fromkeys(output_formats))
+
     def get_aspect_ratio(self):
         return ASPECT_RATIOS[self.output_format]
 
+    def get_image_aspect_ratio(self):
+        """Aspect ratio images should be generated at to serve every requested output format."""
+        if len(self.output_formats) > 1:
+            return MASTER_ASPECT_RATIO
+        return ASPECT_RATIOS[self.output_formats[0]]
+
     def __repr__(self):
         return (
             f"VideoSpec(type={self.type!r}, "
             f"tone={self.tone!r}, output_format={self.output_format!r}, "
-            f"duration={self.duration})"
+            f"duration={self.duration}, output_formats={self.output_formats!r})"
         )
+
+
+class VideoVariant(TypedDict, total=False):
+    """
+    One variant of a video rendered from a shared script, for A/B tests of the art style,
+    image model, output format, background music and caption style.
+    """
+    video_spec : VideoSpec # required
+    caption_style : dict # overrides of the default caption style, as for add_captions_helper
+    output_path : str
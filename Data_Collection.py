@@ -0,0 +1,193 @@
+from constants import *
+from data_collectors.Collector import Collector, CollectorError
+from data_collectors.Wikipedia import Wikipedia
+from data_collectors.LocalText import LocalText
+from data_collectors.LocalHtml import LocalHtml
+from typing import TypedDict, Literal, Callable
+import hashlib
+import asyncio
+import time
+import re
+
+
+class CollectorRegistration(TypedDict):
+    collector : Callable[[str], Collector]
+    matches : Callable[[str], bool] # whether a source given without a kind is of this kind
+
+
+# every kind of source a topic can be collected from
+COLLECTOR_REGISTRY : dict[COLLECTOR_KINDS, CollectorRegistration] = {}
+
+def register_collector(kind : COLLECTOR_KINDS, collector : Callable[[str], Collector], matches : Callable[[str], bool]):
+    """Adds a kind of source, or replaces the collector of an existing one."""
+    COLLECTOR_REGISTRY[kind] = {"collector" : collector, "matches" : matches}
+
+register_collector(COLLECTOR_KINDS.wikipedia, Wikipedia, lambda source: "wikipedia.org/wiki/" in source)
+register_collector(COLLECTOR_KINDS.text, LocalText, lambda source: source.lower().endswith((".txt", ".md", ".markdown")))
+register_collector(COLLECTOR_KINDS.html, LocalHtml, lambda source: source.lower().endswith((".html", ".htm")))
+
+
+def collector_for_source(source : str, kind : COLLECTOR_KINDS | None = None) -> Collector:
+    """The collector for a source, of the given kind or the first registered kind that matches it
+
+    Raises:
+        CollectorError: if no registered kind matches the source
+    """
+    if kind is not None:
+        return COLLECTOR_REGISTRY[COLLECTOR_KINDS(kind)]["collector"](source)
+    for registration in COLLECTOR_REGISTRY.values():
+        if registration["matches"](source):
+            return registration["collector"](source)
+    raise CollectorError(f"no collector for source {source}")
+
+
+class SourceReport(TypedDict):
+    source : str
+    status : Literal["ok", "timeout", "failed"]
+    seconds : float
+    chars : int # of the source's text kept in the corpus
+    paragraphs : int # kept in the corpus
+    duplicate_paragraphs : int # dropped as overlapping paragraphs already kept
+    error : str | None
+
+
+class CollectedCorpus(TypedDict):
+    text : str
+    sources : list[SourceReport]
+    truncated : bool # whether paragraphs were left out to stay within max_chars
+
+
+def split_paragraphs(text : str) -> list[str]:
+    """Paragraphs of a source's text, one per line as collectors give them (Wikipedia's page content
+    separates paragraphs with single newlines), with Wikipedia's == Heading == lines dropped."""
+    paragraphs = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not re.fullmatch(r"=+[^=]+=+", line):
+            paragraphs.append(line)
+    return paragraphs
+
+
+def shingle_hashes(paragraph : str, size : int = DEDUPE_SHINGLE_WORDS) -> set[int]:
+    """Hashes of every run of size consecutive words, or of the whole paragraph when it is shorter."""
+    words = re.findall(r"\w+", paragraph.lower())
+    runs = [" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))]
+    return {int.from_bytes(hashlib.blake2b(run.encode("utf-8"), digest_size=8).digest(), "big") for run in runs}
+
+
+def merge_paragraphs(texts : list[str | None], max_chars : int | None = COLLECTED_CORPUS_MAX_CHARS,
+                     threshold : float = DEDUPE_OVERLAP_THRESHOLD) -> tuple[str, list[tuple[int, int, int]], bool]:
+    """Joins the paragraphs of several texts in order, dropping any paragraph whose shingles mostly
+    appeared in a paragraph kept before it and stopping once max_chars would be exceeded
+
+    Args:
+        texts (list[str | None]): the texts in priority order, None for a source that failed
+        max_chars (int | None): size bound of the merged text, None for no bound
+        threshold (float): fraction of a paragraph's shingles already seen from which it is a duplicate
+
+    Returns:
+        str: the merged text
+        list[tuple[int, int, int]]: characters and paragraphs kept, and paragraphs dropped as duplicates, per text
+        bool: whether paragraphs were left out to stay within max_chars
+    """
+    seen : set[int] = set()
+    kept : list[str] = []
+    size = 0
+    counts = []
+    truncated = False
+    for text in texts:
+        chars, n_kept, n_duplicate = 0, 0, 0
+        for paragraph in split_paragraphs(text or ""):
+            shingles = shingle_hashes(paragraph)
+            if len(shingles & seen) >= threshold * len(shingles):
+                n_duplicate += 1
+                continue
+            if max_chars is not None and size + len(paragraph) + 2 > max_chars:
+                truncated = True
+                continue
+            seen |= shingles
+            kept.append(paragraph)
+            size += len(paragraph) + 2
+            chars += len(paragraph)
+            n_kept += 1
+        counts.append((chars, n_kept, n_duplicate))
+    return "\n\n".join(kept), counts, truncated
+
+
+async def fetch_with_timeout(collector : Collector, timeout : float) -> tuple[str | None, SourceReport]:
+    started = time.perf_counter()
+    report : SourceReport = {
+        "source" : collector.source,
+        "status" : "ok",
+        "seconds" : 0.0,
+        "chars" : 0,
+        "paragraphs" : 0,
+        "duplicate_paragraphs" : 0,
+        "error" : None
+    }
+    text = None
+    try:
+        text = await asyncio.wait_for(collector.fetch(), timeout)
+    except asyncio.TimeoutError:
+        report["status"], report["error"] = "timeout", f"no response after {timeout}s"
+    except Exception as e:
+        report["status"], report["error"] = "failed", f"{type(e).__name__}: {e}"
+    report["seconds"] = time.perf_counter() - started
+    return text, report
+
+
+async def collect_async(sources : list[str | tuple[str, COLLECTOR_KINDS]], timeout : float = COLLECTOR_TIMEOUT_SECONDS,
+                        max_chars : int | None = COLLECTED_CORPUS_MAX_CHARS) -> CollectedCorpus:
+    """Fetches every source about a topic concurrently and merges them into one corpus
+
+    A source that fails or is still fetching after timeout seconds is left out, so one slow source
+    never holds up the rest. The texts are merged in the order the sources are given, which is also
+    their priority when the corpus reaches max_chars, and paragraphs overlapping ones already
+    merged are dropped.
+
+    Args:
+        sources (list[str | tuple[str, COLLECTOR_KINDS]]): URLs and file paths, with their kind when it cannot be told from the source
+        timeout (float): seconds each source may take
+        max_chars (int | None): size bound of the corpus, None for no bound
+
+    Returns:
+        CollectedCorpus: the merged text and what each source contributed
+
+    Raises:
+        CollectorError: if no source could be collected
+    """
+    collectors = [collector_for_source(*source) if isinstance(source, tuple) else collector_for_source(source)
+                  for source in sources]
+    results = await asyncio.gather(*[fetch_with_timeout(collector, timeout) for collector in collectors])
+    texts = [text for text, _ in results]
+    reports = [report for _, report in results]
+    if not any(texts):
+        raise CollectorError("no source could be collected: " + "; ".join(f"{r['source']}: {r['error']}" for r in reports))
+
+    text, counts, truncated = merge_paragraphs(texts, max_chars)
+    for report, (chars, n_kept, n_duplicate) in zip(reports, counts):
+        report["chars"], report["paragraphs"], report["duplicate_paragraphs"] = chars, n_kept, n_duplicate
+    return {"text" : text, "sources" : reports, "truncated" : truncated}
+
+
+def collect(sources : list[str | tuple[str, COLLECTOR_KINDS]], timeout : float = COLLECTOR_TIMEOUT_SECONDS,
+            max_chars : int | None = COLLECTED_CORPUS_MAX_CHARS) -> CollectedCorpus:
+    """Same as collect_async, for callers outside an event loop."""
+    return asyncio.run(collect_async(sources, timeout, max_chars))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Collects and merges the source text of a topic.")
+    parser.add_argument("sources", nargs="+", help="Wikipedia URLs and .txt, .md or .html files")
+    parser.add_argument("--timeout", type=float, default=COLLECTOR_TIMEOUT_SECONDS)
+    parser.add_argument("--max-chars", type=int, default=COLLECTED_CORPUS_MAX_CHARS)
+    args = parser.parse_args()
+
+    corpus = collect(args.sources, args.timeout, args.max_chars)
+    for report in corpus["sources"]:
+        print(f"{report['source']}: {report['status']} in {report['seconds']:.1f}s, {report['paragraphs']} paragraphs "
+              f"({report['chars']} chars) kept, {report['duplicate_paragraphs']} duplicates"
+              + (f", {report['error']}" if report["error"] else ""))
+    print(f"{len(corpus['text'])} chars" + (", truncated" if corpus["truncated"] else ""))
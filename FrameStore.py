@@ -0,0 +1,77 @@
+from ArtifactStore import default_spill_root
+from typing import Callable
+from PIL import Image
+import numpy as np
+import tempfile
+import hashlib
+import shutil
+import uuid
+import os
+
+
+class FrameStore:
+    """
+    Decoded frames and sprites shared between worker processes. Each array is decoded once,
+    keyed by a hash of its content, and saved raw as a .npy file on tmpfs. Processes attach by
+    memory mapping the file read only, so every worker reads the same pages of the page cache
+    rather than holding a private decoded copy.
+    """
+
+    def __init__(self, root : str | None = None):
+        """
+        :param root: Directory holding the frames, a private directory on tmpfs by default (removed on close).
+        """
+        self.owned = root is None
+        self.root = root or tempfile.mkdtemp(prefix="content_engine_frames_", dir=default_spill_root())
+        os.makedirs(self.root, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def content_key(self, *parts : bytes | str) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8") if isinstance(part, str) else part)
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path_for(self, key : str) -> str:
+        return os.path.join(self.root, key + ".npy")
+
+    def get_or_create(self, key : str, create : Callable[[], np.ndarray]) -> np.ndarray:
+        """Attaches to the array stored under key, creating and storing it first if no process has yet."""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            # written under a unique name and renamed, so concurrent creators never expose a partial file
+            temp_path = os.path.join(self.root, f"{key}.{uuid.uuid4()}.tmp.npy")
+            np.save(temp_path, np.ascontiguousarray(create()))
+            os.replace(temp_path, path)
+        return attach_frame(path)
+
+    def put_image(self, image_path : str, size : tuple[int, int] | None = None) -> str:
+        """Decodes an image file to RGB uint8, resized to size if given, and returns the path of the stored frame."""
+        with open(image_path, "rb") as f:
+            key = self.content_key(f.read(), repr(size))
+
+        def decode() -> np.ndarray:
+            with Image.open(image_path) as image:
+                image = image.convert("RGB")
+                if size and image.size != tuple(size):
+                    image = image.resize(size, Image.LANCZOS)
+                return np.asarray(image)
+
+        self.get_or_create(key, decode)
+        return self.path_for(key)
+
+    def close(self) -> None:
+        """Removes the frames if this store created its directory."""
+        if self.owned:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+def attach_frame(path : str) -> np.ndarray:
+    """Memory maps a stored frame read only, without copying it into the process."""
+    return np.load(path, mmap_mode="r")
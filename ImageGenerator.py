@@ -1,9 +1,17 @@
 from dotenv import load_dotenv
 from constants import *
-import requests
 import uuid
+import time
+import math
 import os
+import threading
+import contextvars
+import requests
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 from typing import TypedDict, Literal
+from rate_limits import get_rate_limiter, rate_limit_key, RateLimitTimeout
+from clients import get_http_session
+from RunStore import record_api_call, get_run_store
 
 class StabilityRequestData(TypedDict, total=False):
     """
@@ -25,12 +33,52 @@ class StabilityRequestData(TypedDict, total=False):
     # Additional fields like model, cfg_scale, style_preset, etc. can also be added
     # as NotRequired keys if needed.
 
+class ImageGenerationTimeout(Exception):
+    """
+    Raised when an image request does not complete before its deadline.
+    """
+
+    def __init__(self, message: str):
+        """
+        :param message: A human-readable error message describing the issue.
+        """
+        super().__init__(message)
+
+
+class HedgeBudget:
+    """
+    What one job may spend on duplicate (hedge) image requests, shared by all of its image requests.
+    """
+
+    def __init__(self, cap : float = IMAGE_HEDGE_COST_CAP):
+        """
+        :param cap: USD the job may spend on hedges, 0 disables hedging.
+        """
+        self.cap = cap
+        self.spent = 0.0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def try_spend(self, cost : float) -> bool:
+        """Takes cost from the budget if it fits, returning whether a hedge may be sent."""
+        with self.lock:
+            if self.spent + cost > self.cap + 1e-9:
+                return False
+            self.spent += cost
+            self.hedges += 1
+            return True
+
+
+# requests overtaken by a hedge finish here in the background instead of holding up the caller
+_request_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="stability-request")
+
+
 class ImageGenerator:
 
     def __init__(self, test = False):
         self.test = test
 
-    def generate_image(self, prompt : str, aspect_ratio : str,  model_name : IMAGE_MODEL_NAMES, style_preset : VISUAL_ART_STYLES, image : str | None = None,) -> tuple[str, float]:
+    def generate_image(self, prompt : str, aspect_ratio : str,  model_name : IMAGE_MODEL_NAMES, style_preset : VISUAL_ART_STYLES, image : str | bytes | None = None,) -> tuple[str, float]:
         """Given a text prompt returns the link to ai rendering of the text
 
         Args:
@@ -38,44 +86,146 @@ class ImageGenerator:
             aspect_ratio (str): 16:9 1:1 21:9 2:3 3:2 4:5 5:4 9:16 9:21
             model_name (str): valid model name,
             style_preset (str) : vailid style_preset
-            image (str): starting point for the image (optional)
+            image (str | bytes): starting point for the image, as a filepath or encoded bytes (optional)
         
         Retrurns: tuple of the filepath to completed image and float of the cost in USD
         """
+        image_bytes, cost = self.generate_image_bytes(prompt, aspect_ratio, model_name, style_preset, image)
+        output_file = IMAGE_FILEPATH + str(uuid.uuid4()) + "." + DEFAULT_IMAGE_FORMAT
+        with open(output_file, 'wb') as file:
+            file.write(image_bytes)
+        return output_file, cost
+
+    def generate_image_bytes(self, prompt : str, aspect_ratio : str,  model_name : IMAGE_MODEL_NAMES, style_preset : VISUAL_ART_STYLES, image : str | bytes | None = None,) -> tuple[bytes, float]:
+        """Same as generate_image but returns the encoded image instead of writing it to disk
+
+        Retrurns: tuple of the encoded image and float of the cost in USD
+        """
         raise NotImplementedError("Subclasses must implement this method")
     
 class StabilityImageGenerator(ImageGenerator):
-    def __init__(self, test = False) -> None:
+    def __init__(self, test = False, hedge_budget : HedgeBudget | None = None,
+                 timeout : float = STABILITY_REQUEST_TIMEOUT_SECONDS) -> None:
+        """
+        :param hedge_budget: Budget of the job for duplicate requests, no hedging without one.
+        :param timeout: Seconds an image request, including retries after 429s, may take.
+        """
         super().__init__(test)
+        self.hedge_budget = hedge_budget
+        self.timeout = timeout
 
     def get_stability_cost(self, model : str) -> float:
         credits = STABILITY_PRICING_MAP[model]
         return credits / 100
 
     def make_stability_request(self, data, files, model : str) -> tuple[str, float]:
-        cost = 0.0
-        response = requests.post(
-            f"https://api.stability.ai/v2beta/stable-image/generate/" + model,
-            headers={
-                "authorization": "Bearer {}".format(os.getenv("STABILITY_API_KEY")),
-                "accept": "image/*"
-            },
-            files=files,
-            data=data,
-         )
+        image_bytes, cost = self.request_stability_image(data, files, model)
         output_file = IMAGE_FILEPATH + str(uuid.uuid4()) + ".png"
-        if response.status_code == 200:
-            cost = self.get_stability_cost(model)
-            with open(output_file, 'wb') as file:
-                file.write(response.content)
-        else:
-            raise Exception(str(response.json()))
-        
+        with open(output_file, 'wb') as file:
+            file.write(image_bytes)
         return output_file, cost
 
-    def generate_image(self, prompt : str, aspect_ratio : str,  
+    def hedge_delay(self, model : str) -> float | None:
+        """Seconds after which a request to model gets a duplicate: the IMAGE_HEDGE_PERCENTILE of its
+        recent latencies recorded in the run store. None when hedging is off or there are too few samples."""
+        if self.hedge_budget is None or self.hedge_budget.cap <= 0:
+            return None
+        latencies = get_run_store().latency("stability", model, limit=IMAGE_HEDGE_LATENCY_WINDOW)
+        if len(latencies) < IMAGE_HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(IMAGE_HEDGE_PERCENTILE / 100 * len(latencies)) - 1)]
+
+    def post_stability_request(self, data, files, model : str, deadline : float, max_attempts : int = 3) -> requests.Response:
+        """Sends one image request, retrying after 429s, giving up at deadline (a time.monotonic() value)
+
+        Raises:
+            ImageGenerationTimeout: if no response arrived before the deadline
+        """
+        rate_limiter = get_rate_limiter()
+        key = rate_limit_key("stability", model)
+        for _ in range(max_attempts):
+            try:
+                rate_limiter.acquire(key, timeout=max(0.0, deadline - time.monotonic()))
+            except RateLimitTimeout:
+                raise ImageGenerationTimeout(f"Timed out waiting to send a stability {model} request.")
+            # rewind attached images so a retry uploads them again
+            for value in files.values():
+                if isinstance(value, tuple) and hasattr(value[1], "seek"):
+                    value[1].seek(0)
+            started = time.perf_counter()
+            try:
+                response = get_http_session().post(
+                    f"https://api.stability.ai/v2beta/stable-image/generate/" + model,
+                    headers={
+                        "authorization": "Bearer {}".format(os.getenv("STABILITY_API_KEY")),
+                        "accept": "image/*"
+                    },
+                    files=files,
+                    data=data,
+                    # the image is only sent once generated, so the read timeout bounds the whole wait
+                    timeout=max(.1, deadline - time.monotonic()),
+                 )
+            except requests.Timeout:
+                record_api_call("stability", model, model, time.perf_counter() - started, 0.0, "timeout")
+                raise ImageGenerationTimeout(f"Stability {model} request timed out.")
+            rate_limiter.update_from_response(key, response.headers, response.status_code)
+            record_api_call("stability", model, model, time.perf_counter() - started,
+                            self.get_stability_cost(model) if response.status_code == 200 else 0.0,
+                            "ok" if response.status_code == 200 else str(response.status_code))
+            # throttled, the bucket now blocks until the provider's reset so just try again
+            if response.status_code != 429:
+                break
+        return response
+
+    def request_stability_image(self, data, files, model : str, max_attempts : int = 3) -> tuple[bytes, float]:
+        """Requests an image within this generator's timeout. When the request runs past the hedge
+        delay and the job's hedge budget allows, a duplicate is sent and the first image back is used.
+        A hedge is counted as billed once sent, whichever request wins.
+
+        Returns:
+            bytes: the encoded image
+            float: cost of the request and of any hedge, in USD
+
+        Raises:
+            ImageGenerationTimeout: if no image arrived before the deadline
+        """
+        deadline = time.monotonic() + self.timeout
+        cost = self.get_stability_cost(model)
+        def submit() -> Future:
+            # a copy of this context per request so its API calls are recorded against the current run
+            return _request_executor.submit(contextvars.copy_context().run, self.post_stability_request,
+                                            data, files, model, deadline, max_attempts)
+
+        pending = {submit()}
+        total_cost = cost
+        hedge_delay = self.hedge_delay(model)
+        if hedge_delay is not None:
+            done, _ = wait(pending, timeout=min(hedge_delay, max(0.0, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline and self.hedge_budget.try_spend(cost): #type: ignore
+                print(f"image request slower than p{IMAGE_HEDGE_PERCENTILE} ({hedge_delay:.1f}s), sending a hedge...")
+                pending.add(submit())
+                total_cost += cost
+
+        error : Exception = ImageGenerationTimeout(f"No stability {model} image within {self.timeout}s.")
+        while pending:
+            # the requests time out by themselves at the deadline, the margin lets them report it
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()) + 5, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if response.status_code == 200:
+                    return response.content, total_cost
+                error = Exception(str(response.json()))
+        raise error
+
+    def generate_image_bytes(self, prompt : str, aspect_ratio : str,  
                        model_name : IMAGE_MODEL_NAMES, 
-                       style_preset : VISUAL_ART_STYLES, image : str | None = None,) -> tuple[str, float]:
+                       style_preset : VISUAL_ART_STYLES, image : str | bytes | None = None,) -> tuple[bytes, float]:
         load_dotenv()
         model = model_name.split("-")[1]
         data = {
@@ -89,21 +239,20 @@ class StabilityImageGenerator(ImageGenerator):
                 if style_preset:
                     data["style_preset"] = style_preset.value
             
-            if model_name == "stability-ultra":
-                if image:
-                    data["strength"] = .9 #type: ignore
-                if image:
+            if model_name == "stability-ultra" and image:
+                data["strength"] = .9 #type: ignore
+                if isinstance(image, str):
                     with open(image, "rb") as f:
-                        files = {
-                            "image": (image, f, "image/png")
-                        }
-                        output_file, cost = self.make_stability_request(data, files,model)
+                        image = f.read()
+                files = {
+                    "image": ("image.png", image, "image/png")
+                }
             else:
                 files = {"none": ''}
-                output_file, cost = self.make_stability_request(data, files, model)
+            image_bytes, cost = self.request_stability_image(data, files, model)
         else:
             raise Exception("Model {} unsupported".format(model_name))
-        return output_file, cost
+        return image_bytes, cost
 
 if __name__ == "__main__":
     # generator = OpenAIImageGenerator()
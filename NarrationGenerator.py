@@ -1,8 +1,16 @@
 
-from openai import OpenAI
 from dotenv import load_dotenv
 import uuid
+import hashlib
+import time
+import os
+import numpy as np
+import re
 from constants import *
+from AudioEngine import resample
+from rate_limits import rate_limit_key
+from clients import get_openai_client, send_rate_limited
+from RunStore import record_api_call
 load_dotenv()
 
 
@@ -14,14 +22,199 @@ def calculate_narration_cost(narration : str) -> float:
     return num_chars * cost_per_1m / (10**6)
 
 
-def generate_narration_audio(narration : str) -> tuple[str, float]:
-    cost = 0
-    output_path = NARRATION_FILEPATH + "/" + str(uuid.uuid4()) + ".mp3"
-    client = OpenAI()
-    response = client.audio.speech.create(
+def narration_cache_path(narration : str, response_format : str = "mp3") -> str:
+    """Where the synthesized audio for a narration text is cached, keyed by the text and TTS settings."""
+    key = hashlib.sha256(f"tts-1|echo|{response_format}|{narration}".encode("utf-8")).hexdigest()
+    return os.path.join(NARRATION_CACHE_FILEPATH, f"{key}.{response_format}")
+
+
+def load_cached_narration(narration : str, response_format : str = "mp3") -> bytes | None:
+    path = narration_cache_path(narration, response_format)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def generate_narration_bytes(narration : str, response_format : str = "mp3", use_cache : bool = False) -> tuple[bytes, float]:
+    """Synthesizes a narration and returns the encoded audio along with its cost. With use_cache,
+    narrations synthesized before are read from NARRATION_CACHE_FILEPATH at no cost and new ones
+    are kept there, e.g. for previews of the same script."""
+    if use_cache:
+        cached = load_cached_narration(narration, response_format)
+        if cached is not None:
+            return cached, 0.0
+    audio, cost = request_speech(narration, response_format)
+    if use_cache:
+        cache_narration(narration, audio, response_format)
+    return audio, cost
+
+
+def cache_narration(narration : str, audio : bytes, response_format : str = "mp3"):
+    os.makedirs(NARRATION_CACHE_FILEPATH, exist_ok=True)
+    with open(narration_cache_path(narration, response_format), "wb") as f:
+        f.write(audio)
+
+
+def request_speech(text : str, response_format : str = "mp3") -> tuple[bytes, float]:
+    """One call to the TTS endpoint, returning the encoded audio and its cost."""
+    client = get_openai_client()
+    key = rate_limit_key(TEXT_MODEL_COMPANY.openai.value, "tts")
+    started = time.perf_counter()
+    raw_response = send_rate_limited(key, lambda: client.audio.speech.with_raw_response.create(
         model="tts-1",
         voice="echo",
-        input=narration,
-    )
-    response.stream_to_file(output_path)
-    return output_path, calculate_narration_cost(narration)
\ No newline at end of file
+        input=text,
+        response_format=response_format, #type: ignore
+    ))
+    response = raw_response.parse()
+    cost = calculate_narration_cost(text)
+    record_api_call(TEXT_MODEL_COMPANY.openai.value, "tts", "tts-1", time.perf_counter() - started, cost)
+    return response.content, cost
+
+
+def generate_narration_pcm(narration : str, fps : int = AUDIO_FPS, use_cache : bool = False) -> tuple[np.ndarray, float]:
+    """Synthesizes a narration as raw PCM so it is never lossily encoded before the final mux
+
+    Returns:
+        np.ndarray: mono float32 samples in [-1, 1] at fps
+        float: cost of the narration
+    """
+    audio, cost = generate_narration_bytes(narration, response_format="pcm", use_cache=use_cache)
+    return decode_pcm_narration(audio, fps), cost
+
+
+def decode_pcm_narration(audio : bytes, fps : int = AUDIO_FPS) -> np.ndarray:
+    """Converts the TTS endpoint's 16-bit mono PCM to float32 samples at fps."""
+    samples = np.frombuffer(audio, dtype="<i2").astype(np.float32) / 32768
+    return resample(samples, TTS_PCM_FPS, fps)
+
+
+def generate_narration_audio(narration : str) -> tuple[str, float]:
+    output_path = NARRATION_FILEPATH + "/" + str(uuid.uuid4()) + ".mp3"
+    audio, cost = generate_narration_bytes(narration)
+    with open(output_path, "wb") as f:
+        f.write(audio)
+    return output_path, cost
+
+
+def pack_narration_batches(narrations : list[str], max_chars : int = TTS_MAX_INPUT_CHARS) -> list[list[int]]:
+    """Groups consecutive narrations into batches whose joined text fits one TTS request
+
+    Returns:
+        list[list[int]]: indices of the narrations in each batch, in order
+    """
+    batches : list[list[int]] = []
+    size = 0
+    for i, narration in enumerate(narrations):
+        length = len(batch_text([narration]))
+        if batches and size + len(TTS_BATCH_SEPARATOR) + length <= max_chars:
+            batches[-1].append(i)
+            size += len(TTS_BATCH_SEPARATOR) + length
+        else:
+            batches.append([i])
+            size = length
+    return batches
+
+
+def batch_text(narrations : list[str]) -> str:
+    """The text of one TTS request for several narrations. Each narration is ended as a sentence and
+    set in its own paragraph so the voice pauses between scenes, where the audio is split again."""
+    return TTS_BATCH_SEPARATOR.join(n.strip() if re.search(r"[.!?…]['\"”’)]*$", n.strip()) else n.strip() + "."
+                                    for n in narrations)
+
+
+def silent_runs(samples : np.ndarray, fps : int, min_seconds : float = TTS_SPLIT_MIN_SILENCE_SECONDS) -> list[tuple[float, float]]:
+    """(start, end) seconds of every pause in speech at least min_seconds long, not counting the
+    silence before the first and after the last word."""
+    frame = max(1, int(fps * .01))
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return []
+    rms = np.sqrt(np.mean(samples[:n_frames * frame].reshape(n_frames, frame) ** 2, axis=1))
+    silent = rms < max(rms.max() * 10 ** (TTS_SPLIT_SILENCE_DB / 20), 1e-4)
+    voiced = np.flatnonzero(~silent)
+    if len(voiced) == 0:
+        return []
+    runs = []
+    # runs of silent frames between the first and last voiced frame
+    edges = np.flatnonzero(np.diff(silent[voiced[0]:voiced[-1] + 1].astype(np.int8))) + 1 + voiced[0]
+    for start, end in zip(edges[::2], edges[1::2]):
+        if (end - start) * frame / fps >= min_seconds:
+            runs.append((start * frame / fps, end * frame / fps))
+    return runs
+
+
+def split_batched_narration(samples : np.ndarray, fps : int, narrations : list[str]) -> list[np.ndarray] | None:
+    """Splits the audio of a batch back into one segment per narration, cutting in the middle of
+    pauses. Each cut is placed at the pause closest to where the narration's share of the batch's
+    characters ends, favouring longer pauses as the voice pauses longest between paragraphs.
+
+    Returns:
+        list[np.ndarray] | None: samples of each narration, or None if there are fewer pauses than cuts needed
+    """
+    if len(narrations) == 1:
+        return [samples]
+    pauses = silent_runs(samples, fps)
+    n_cuts = len(narrations) - 1
+    if len(pauses) < n_cuts:
+        return None
+    duration = len(samples) / fps
+    lengths = np.array([len(n) for n in narrations], dtype=np.float64)
+    expected = np.cumsum(lengths)[:-1] / lengths.sum() * duration
+    centers = np.array([(start + end) / 2 for start, end in pauses])
+    widths = np.array([min(end - start, TTS_SPLIT_PAUSE_CAP_SECONDS) for start, end in pauses])
+
+    # cost[i, j] of making cut i in pause j, pauses taken in order by a dynamic program
+    cost = np.abs(centers[None, :] - expected[:, None]) - TTS_SPLIT_PAUSE_WEIGHT * widths[None, :]
+    best = np.full((n_cuts, len(pauses)), np.inf)
+    previous = np.zeros((n_cuts, len(pauses)), dtype=np.int64)
+    best[0] = cost[0]
+    for i in range(1, n_cuts):
+        # the best placement of cut i - 1 up to each pause, and which pause it is in
+        running = np.minimum.accumulate(best[i - 1])
+        arg = np.maximum.accumulate(np.where(best[i - 1] == running, np.arange(len(pauses)), 0))
+        best[i, 1:] = running[:-1] + cost[i, 1:]
+        previous[i, 1:] = arg[:-1]
+    cuts = [int(np.argmin(best[-1]))]
+    for i in range(n_cuts - 1, 0, -1):
+        cuts.append(int(previous[i, cuts[-1]]))
+    bounds = [0, *[int(round(centers[j] * fps)) for j in reversed(cuts)], len(samples)]
+    return [samples[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def generate_narration_batch(narrations : list[str], fps : int = AUDIO_FPS, use_cache : bool = False) -> tuple[list[np.ndarray], float]:
+    """Synthesizes several narrations in one TTS request and splits the audio back per narration.
+    With use_cache, narrations already cached are read from the cache. A batch that cannot be
+    split is synthesized narration by narration instead.
+
+    Returns:
+        list[np.ndarray]: mono float32 samples of each narration at fps
+        float: cost of the requests made
+    """
+    out : list[np.ndarray | None] = [None] * len(narrations)
+    if use_cache:
+        for i, narration in enumerate(narrations):
+            cached = load_cached_narration(narration, "pcm")
+            if cached is not None:
+                out[i] = decode_pcm_narration(cached, fps)
+    missing = [i for i, samples in enumerate(out) if samples is None]
+    total_cost = 0.0
+    if len(missing) > 1:
+        texts = [narrations[i] for i in missing]
+        audio, total_cost = request_speech(batch_text(texts), "pcm")
+        samples = np.frombuffer(audio, dtype="<i2")
+        segments = split_batched_narration(samples.astype(np.float32) / 32768, TTS_PCM_FPS, texts)
+        if segments is not None:
+            for i, segment in zip(missing, segments):
+                pcm = (segment * 32768).round().astype("<i2").tobytes()
+                if use_cache:
+                    cache_narration(narrations[i], pcm, "pcm")
+                out[i] = decode_pcm_narration(pcm, fps)
+            missing = []
+        else:
+            print(f"could not split a batch of {len(texts)} narrations, synthesizing them one by one")
+    for i in missing:
+        out[i], cost = generate_narration_pcm(narrations[i], fps, use_cache)
+        total_cost += cost
+    return out, total_cost #type: ignore
@@ -0,0 +1,229 @@
+from constants import *
+from pipeline import JobSpec, JobResult, validate_job, run_montage_job
+from progress import ProgressReporter, ProgressEvent
+from captions import load_font
+from AudioEngine import load_music_track
+from clients import get_openai_client, get_http_session
+from rate_limits import get_rate_limiter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import TypedDict, Literal, TYPE_CHECKING
+import threading
+import argparse
+import queue
+import time
+import uuid
+import json
+import os
+
+if TYPE_CHECKING:
+    from Uploader import UploadQueue
+
+
+class RenderJob(TypedDict):
+    id : str
+    spec : JobSpec
+    status : Literal["queued", "running", "done", "failed"]
+    stage : str | None
+    # the latest progress event of each stage, with its throughput and ETA
+    progress : dict[str, ProgressEvent]
+    result : JobResult | None
+    error : str | None
+    submitted_at : float
+    started_at : float | None
+    finished_at : float | None
+
+
+class RenderService:
+    """
+    A long running process that renders queued jobs, so the imports, API clients, fonts, decoded
+    background music and caches are loaded once and every job only pays for its own work.
+    Jobs are submitted and followed through a small local JSON HTTP API:
+
+        POST /jobs          submit a JobSpec, returns {"id": ...}
+        GET  /jobs          every job
+        GET  /jobs/<id>     one job, with its stage, progress, result or error
+        GET  /health        queue depth and worker count
+    """
+
+    def __init__(self, host : str = RENDER_SERVICE_HOST, port : int = RENDER_SERVICE_PORT,
+                 workers : int = 1, upload_queue : "UploadQueue | None" = None):
+        """
+        :param host: Interface the API listens on, local only by default.
+        :param port: Port the API listens on.
+        :param workers: Jobs rendered at the same time.
+        :param upload_queue: If given, completed videos are submitted to it for upload.
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.upload_queue = upload_queue
+        self.jobs : dict[str, RenderJob] = {}
+        self.lock = threading.Lock()
+        self.queue : queue.Queue[str | None] = queue.Queue()
+        self.threads : list[threading.Thread] = []
+        self.server : ThreadingHTTPServer | None = None
+
+    def warm_up(self):
+        """Loads the state every job shares before the first job arrives."""
+        print("warming up render service...")
+        load_font(CAPTION_FONT_FILEPATH, CAPTION_FONT_SIZE)
+        for music in BACKGROUND_MUSIC:
+            if os.path.isfile(f"{BACKGROUND_MUSIC_FILEPATH}/{music.value}"):
+                load_music_track(music)
+        for company in TEXT_MODEL_COMPANY:
+            if os.environ.get(TEXT_GEN_API_KEY_NAME[company]):
+                get_openai_client(company)
+        get_http_session()
+        get_rate_limiter()
+
+    def submit(self, spec : JobSpec) -> str:
+        """Validates and queues a job, raising ValueError for an invalid spec."""
+        validate_job(spec)
+        job : RenderJob = {
+            "id" : str(uuid.uuid4()),
+            "spec" : spec,
+            "status" : "queued",
+            "stage" : None,
+            "progress" : {},
+            "result" : None,
+            "error" : None,
+            "submitted_at" : time.time(),
+            "started_at" : None,
+            "finished_at" : None
+        }
+        with self.lock:
+            self.jobs[job["id"]] = job
+        self.queue.put(job["id"])
+        return job["id"]
+
+    def get_job(self, job_id : str) -> RenderJob | None:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None #type: ignore
+
+    def list_jobs(self) -> list[RenderJob]:
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()] #type: ignore
+
+    def update_job(self, job_id : str, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields) #type: ignore
+
+    def record_progress(self, job_id : str, event : ProgressEvent):
+        with self.lock:
+            self.jobs[job_id]["progress"] = {**self.jobs[job_id]["progress"], event["stage"] : event}
+
+    def run_worker(self):
+        while True:
+            job_id = self.queue.get()
+            if job_id is None:
+                return
+            spec = self.jobs[job_id]["spec"]
+            self.update_job(job_id, status="running", started_at=time.time())
+            try:
+                progress = ProgressReporter([lambda event: self.record_progress(job_id, event)], job=job_id)
+                result = run_montage_job(spec, on_stage=lambda stage: self.update_job(job_id, stage=stage), progress=progress)
+                self.update_job(job_id, status="done", result=result, finished_at=time.time())
+                if self.upload_queue and not spec.get("preview"):
+                    self.upload_queue.submit(result["video_filepath"], spec.get("description", ""))
+            except Exception as e:
+                self.update_job(job_id, status="failed", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+
+    def start(self):
+        """Warms up, starts the render workers and the API server on background threads."""
+        self.warm_up()
+        if self.upload_queue:
+            self.upload_queue.start()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run_worker, name=f"render-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.server = ThreadingHTTPServer((self.host, self.port), make_request_handler(self))
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever, name="render-api", daemon=True)
+        thread.start()
+        print(f"render service listening on http://{self.host}:{self.port}")
+
+    def close(self):
+        """Stops accepting requests and waits for the jobs already queued to finish."""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.upload_queue:
+            self.upload_queue.join()
+            self.upload_queue.close()
+
+
+def make_request_handler(service : RenderService) -> type[BaseHTTPRequestHandler]:
+
+    class RenderRequestHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, status : int, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            if parts == ["health"]:
+                self.send_json(200, {"status" : "ok", "queued" : service.queue.qsize(), "workers" : service.workers})
+            elif parts == ["jobs"]:
+                self.send_json(200, service.list_jobs())
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = service.get_job(parts[1])
+                if job:
+                    self.send_json(200, job)
+                else:
+                    self.send_json(404, {"error" : f"unknown job {parts[1]}"})
+            else:
+                self.send_json(404, {"error" : "not found"})
+
+        def do_POST(self):
+            if [p for p in self.path.split("/") if p] != ["jobs"]:
+                self.send_json(404, {"error" : "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                spec = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(spec, dict):
+                    raise ValueError("job spec must be a JSON object")
+                job_id = service.submit(spec) #type: ignore
+            except (ValueError, json.JSONDecodeError) as e:
+                self.send_json(400, {"error" : str(e)})
+                return
+            self.send_json(202, {"id" : job_id})
+
+        def log_message(self, format, *args):
+            pass
+
+    return RenderRequestHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the render worker service.")
+    parser.add_argument("--host", default=RENDER_SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=RENDER_SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=1, help="jobs rendered at the same time")
+    parser.add_argument("--upload", action="store_true", help="upload completed videos to TikTok")
+    args = parser.parse_args()
+
+    upload_queue = None
+    if args.upload:
+        from Uploader import TikTokUploader, UploadQueue
+        upload_queue = UploadQueue(TikTokUploader())
+    service = RenderService(args.host, args.port, args.workers, upload_queue)
+    service.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("shutting down, waiting for queued jobs...")
+        service.close()
@@ -0,0 +1,455 @@
+from constants import *
+from ffmpeg_tools import probe_duration
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Literal
+from enum import Enum
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import uuid
+import os
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    topic TEXT,
+    spec_hash TEXT NOT NULL,
+    spec_json TEXT NOT NULL,
+    content_type TEXT,
+    tone TEXT,
+    output_format TEXT,
+    visual_art_style TEXT,
+    image_model TEXT,
+    background_music TEXT,
+    script_model TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    cost_json TEXT,
+    total_cost REAL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS runs_topic ON runs (topic, created_at);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created_at);
+CREATE INDEX IF NOT EXISTS runs_spec ON runs (spec_hash, created_at);
+CREATE INDEX IF NOT EXISTS runs_style ON runs (visual_art_style, created_at);
+
+CREATE TABLE IF NOT EXISTS stages (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS stages_run ON stages (run_id);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT REFERENCES runs (id) ON DELETE CASCADE,
+    stage_id INTEGER REFERENCES stages (id) ON DELETE SET NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    duration REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_run ON artifacts (run_id);
+CREATE INDEX IF NOT EXISTS artifacts_kind ON artifacts (kind, created_at);
+CREATE INDEX IF NOT EXISTS artifacts_path ON artifacts (path);
+CREATE INDEX IF NOT EXISTS artifacts_hash ON artifacts (sha256);
+
+-- files of forgotten runs, left for garbage collection wherever they are
+CREATE TABLE IF NOT EXISTS forgotten_artifacts (
+    path TEXT PRIMARY KEY,
+    forgotten_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS api_calls (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT REFERENCES runs (id) ON DELETE CASCADE,
+    stage_id INTEGER REFERENCES stages (id) ON DELETE SET NULL,
+    provider TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    model TEXT,
+    status TEXT NOT NULL,
+    latency_seconds REAL NOT NULL,
+    cost REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS api_calls_run ON api_calls (run_id);
+CREATE INDEX IF NOT EXISTS api_calls_created ON api_calls (created_at);
+CREATE INDEX IF NOT EXISTS api_calls_provider ON api_calls (provider, created_at);
+"""
+
+# spec fields copied to their own indexed columns, the whole spec is kept as JSON too
+SPEC_COLUMNS = {
+    "content_type" : "type",
+    "tone" : "tone",
+    "output_format" : "output_format",
+    "visual_art_style" : "visual_art_style",
+    "image_model" : "image_model_name",
+    "background_music" : "background_music",
+    "script_model" : "script_model",
+}
+
+SPEND_GROUPS = {
+    "provider" : "provider",
+    "endpoint" : "provider || '-' || endpoint",
+    "model" : "model",
+    "day" : "date(created_at, 'unixepoch')",
+}
+
+# the run and stage API calls made in this context are attributed to
+current_run_id : ContextVar[str | None] = ContextVar("current_run_id", default=None)
+current_stage_id : ContextVar[int | None] = ContextVar("current_stage_id", default=None)
+
+
+def spec_hash(spec : dict) -> str:
+    """Stable hash of a job spec, equal for specs with the same fields whatever their order."""
+    canonical = json.dumps(spec, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def column_value(value) -> str | None:
+    """Spec values as stored in the indexed columns, enums by their value."""
+    if value is None:
+        return None
+    return value.value if isinstance(value, Enum) else str(value)
+
+
+def file_sha256(path : str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RunStore:
+    """
+    Records every run of the pipeline in SQLite: the job spec, each stage, the files it produced
+    (with their hash, size and duration), every API call with its latency and cost, and the final
+    cost summary. Runs are indexed by topic, spec and date so lookups stay fast over thousands of
+    runs, and files in the output directories that no run references can be garbage collected.
+    """
+
+    def __init__(self, db_path : str = RUN_STORE_DB_FILEPATH):
+        """
+        :param db_path: SQLite file shared by every process recording runs.
+        """
+        self.db_path = db_path
+        self.local = threading.local()
+        self.connect().executescript(SCHEMA)
+
+    def connect(self) -> sqlite3.Connection:
+        """This thread's connection, opened on first use."""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self.connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def query(self, sql : str, params : tuple | list = ()) -> list[dict]:
+        return [dict(row) for row in self.connect().execute(sql, params).fetchall()]
+
+    # Recording
+
+    def start_run(self, topic : str | None, spec : dict) -> str:
+        """Records a new run of spec about topic and returns its id."""
+        run_id = str(uuid.uuid4())
+        columns = {column : spec.get(field) for column, field in SPEC_COLUMNS.items()}
+        with self.transaction() as connection:
+            connection.execute(
+                f"INSERT INTO runs (id, topic, spec_hash, spec_json, {', '.join(columns)}, status, created_at) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' * len(columns))}, 'running', ?)",
+                (run_id, topic, spec_hash(spec), json.dumps(spec, default=str), *[column_value(v) for v in columns.values()], time.time()))
+        return run_id
+
+    def finish_run(self, run_id : str, status : Literal["done", "failed"], cost_summary : dict | None = None, error : str | None = None) -> None:
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE runs SET status = ?, error = ?, cost_json = ?, total_cost = ?, finished_at = ? WHERE id = ?",
+                (status, error, json.dumps(cost_summary) if cost_summary else None,
+                 cost_summary.get("total_cost") if cost_summary else None, time.time(), run_id))
+
+    def start_stage(self, run_id : str, name : str) -> int:
+        with self.transaction() as connection:
+            return connection.execute(
+                "INSERT INTO stages (run_id, name, status, started_at) VALUES (?, ?, 'running', ?)",
+                (run_id, name, time.time())).lastrowid #type: ignore
+
+    def finish_stage(self, stage_id : int, status : Literal["done", "failed"]) -> None:
+        with self.transaction() as connection:
+            connection.execute("UPDATE stages SET status = ?, finished_at = ? WHERE id = ?", (status, time.time(), stage_id))
+
+    @contextmanager
+    def track_run(self, topic : str | None, spec : dict) -> Iterator[str]:
+        """Records a run around the block, attributing the API calls made in it to the run. The block
+        can record its cost summary with finish_run, otherwise the run is marked done when it exits
+        and failed if it raises."""
+        run_id = self.start_run(topic, spec)
+        token = current_run_id.set(run_id)
+        try:
+            yield run_id
+        except BaseException as e:
+            self.finish_run(run_id, "failed", error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            current_run_id.reset(token)
+        with self.transaction() as connection:
+            connection.execute("UPDATE runs SET status = 'done', finished_at = ? WHERE id = ? AND status = 'running'", (time.time(), run_id))
+
+    @contextmanager
+    def track_stage(self, name : str, run_id : str | None = None) -> Iterator[int | None]:
+        """Records a stage of the current run around the block, yielding its id (None outside a run)."""
+        run_id = run_id or current_run_id.get()
+        if run_id is None:
+            yield None
+            return
+        stage_id = self.start_stage(run_id, name)
+        token = current_stage_id.set(stage_id)
+        try:
+            yield stage_id
+        except BaseException:
+            self.finish_stage(stage_id, "failed")
+            raise
+        finally:
+            current_stage_id.reset(token)
+        self.finish_stage(stage_id, "done")
+
+    def add_artifact(self, path : str, kind : str, run_id : str | None = None, duration : float | None = None) -> str:
+        """Records a file produced by the current run (or run_id), hashing it and probing the duration
+        of media files. Returns the file's sha256."""
+        sha256 = file_sha256(path)
+        if duration is None and kind in ("video", "audio", "narration"):
+            duration = probe_duration(path)
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO artifacts (run_id, stage_id, kind, path, sha256, size_bytes, duration, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id or current_run_id.get(), current_stage_id.get(), kind, os.path.abspath(path), sha256,
+                 os.path.getsize(path), duration, time.time()))
+        return sha256
+
+    def add_api_call(self, provider : str, endpoint : str, model : str | None, latency_seconds : float,
+                     cost : float, status : str = "ok") -> None:
+        """Records an API call against the current run and stage, if any."""
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO api_calls (run_id, stage_id, provider, endpoint, model, status, latency_seconds, cost, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (current_run_id.get(), current_stage_id.get(), provider, endpoint, column_value(model), status, latency_seconds, cost, time.time()))
+
+    # Queries
+
+    def find_runs(self, topic : str | None = None, since : float | None = None, until : float | None = None,
+                  spec : dict | None = None, status : str | None = None, limit : int = 100, **spec_columns : str) -> list[dict]:
+        """Runs matching every filter given, newest first
+
+        Args:
+            topic (str | None): exact topic (the job's name)
+            since (float | None): created at or after this unix time
+            until (float | None): created before this unix time
+            spec (dict | None): runs of exactly this job spec
+            status (str | None): running, done or failed
+            limit (int): at most this many runs
+            **spec_columns: any column of SPEC_COLUMNS, e.g. visual_art_style="anime"
+
+        Returns:
+            list[dict]: the matching rows of the runs table
+        """
+        where, params = [], []
+        for column, value in [("topic", topic), ("status", status), ("spec_hash", spec_hash(spec) if spec else None)]:
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        for column, value in spec_columns.items():
+            if column not in SPEC_COLUMNS:
+                raise ValueError(f"cannot filter runs by '{column}', use one of {list(SPEC_COLUMNS)}")
+            where.append(f"{column} = ?")
+            params.append(column_value(value))
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+        sql = "SELECT * FROM runs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY created_at DESC LIMIT ?"
+        return self.query(sql, [*params, limit])
+
+    def find_artifacts(self, topic : str | None = None, kind : str | None = None, run_id : str | None = None,
+                       since : float | None = None, until : float | None = None) -> list[dict]:
+        """Artifacts matching every filter given, newest first, e.g. every image for a topic."""
+        where, params = [], []
+        for column, value in [("r.topic", topic), ("a.kind", kind), ("a.run_id", run_id)]:
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("a.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("a.created_at < ?")
+            params.append(until)
+        sql = ("SELECT a.*, r.topic FROM artifacts a LEFT JOIN runs r ON r.id = a.run_id"
+               + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY a.created_at DESC")
+        return self.query(sql, params)
+
+    def stages_of(self, run_id : str) -> list[dict]:
+        return self.query("SELECT * FROM stages WHERE run_id = ? ORDER BY started_at", (run_id,))
+
+    def api_calls_of(self, run_id : str) -> list[dict]:
+        return self.query("SELECT * FROM api_calls WHERE run_id = ? ORDER BY created_at", (run_id,))
+
+    def spend(self, since : float | None = None, until : float | None = None,
+              group_by : Literal["provider", "endpoint", "model", "day"] | None = None) -> dict[str, float]:
+        """Total API spend between since and until, from the recorded API calls
+
+        Returns:
+            dict[str, float]: spend per group, or {"total": spend} when not grouped
+        """
+        group = SPEND_GROUPS[group_by] if group_by else "'total'"
+        sql = (f"SELECT {group} AS grp, SUM(cost) AS cost FROM api_calls WHERE created_at >= ? AND created_at < ? "
+               f"GROUP BY grp ORDER BY grp")
+        rows = self.query(sql, (since or 0.0, until or float("inf")))
+        return {str(row["grp"]) : row["cost"] or 0.0 for row in rows}
+
+    def latency(self, provider : str, endpoint : str, since : float | None = None, limit : int | None = None) -> list[float]:
+        """Latencies of the most recent (up to limit) successful calls to an endpoint, slowest last."""
+        rows = self.query(
+            "SELECT latency_seconds FROM (SELECT latency_seconds FROM api_calls WHERE provider = ? AND endpoint = ? AND status = 'ok' "
+            "AND created_at >= ? ORDER BY created_at DESC LIMIT ?) ORDER BY latency_seconds",
+            (provider, endpoint, since or 0.0, -1 if limit is None else limit))
+        return [row["latency_seconds"] for row in rows]
+
+    # Retention
+
+    def delete_runs(self, before : float) -> int:
+        """Forgets runs created before this unix time, with their stages, artifacts and API calls.
+        Their files are left for collect_garbage, which removes them unless another run still
+        references them. Returns how many runs were deleted."""
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO forgotten_artifacts (path, forgotten_at) SELECT DISTINCT artifacts.path, ? "
+                "FROM artifacts JOIN runs ON runs.id = artifacts.run_id WHERE runs.created_at < ?", (time.time(), before))
+            return connection.execute("DELETE FROM runs WHERE created_at < ?", (before,)).rowcount
+
+    def collect_garbage(self, directories : list[str] = RUN_STORE_GC_DIRECTORIES,
+                        min_age_seconds : float = RUN_STORE_GC_MIN_AGE_SECONDS, dry_run : bool = False) -> list[str]:
+        """Removes the files older than min_age_seconds that no recorded artifact references: those in
+        directories of intermediate files, and those recorded for runs forgotten by delete_runs wherever
+        they are. Files the store never recorded outside directories, such as finished videos, are
+        never touched. Also drops artifact records whose file no longer exists.
+
+        Returns:
+            list[str]: the files removed, or that would be with dry_run
+        """
+        referenced = {row["path"] for row in self.query("SELECT DISTINCT path FROM artifacts")}
+        forgotten = [row["path"] for row in self.query("SELECT path FROM forgotten_artifacts")]
+        cutoff = time.time() - min_age_seconds
+        candidates = list(forgotten)
+        for directory in directories:
+            if os.path.isdir(directory):
+                candidates.extend(os.path.abspath(entry.path) for entry in os.scandir(directory) if entry.is_file())
+        removed = []
+        for path in dict.fromkeys(candidates):
+            if path in referenced or not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+                continue
+            if not dry_run:
+                os.remove(path)
+            removed.append(path)
+        if not dry_run:
+            missing = [path for path in referenced if not os.path.exists(path)]
+            # a forgotten file still referenced by another run is that run's to collect now
+            settled = [path for path in forgotten if path in referenced or not os.path.exists(path)]
+            with self.transaction() as connection:
+                connection.executemany("DELETE FROM artifacts WHERE path = ?", [(path,) for path in missing])
+                connection.executemany("DELETE FROM forgotten_artifacts WHERE path = ?", [(path,) for path in settled])
+        return removed
+
+    def close(self) -> None:
+        """Closes this thread's connection."""
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+
+_run_store : RunStore | None = None
+_run_store_lock = threading.Lock()
+
+def get_run_store() -> RunStore:
+    """Returns this process's RunStore on the shared database."""
+    global _run_store
+    with _run_store_lock:
+        if _run_store is None:
+            _run_store = RunStore()
+    return _run_store
+
+
+def record_api_call(provider : str, endpoint : str, model : str | None, latency_seconds : float,
+                    cost : float, status : str = "ok") -> None:
+    """Records an API call against the run and stage in progress in this context."""
+    get_run_store().add_api_call(provider, endpoint, model, latency_seconds, cost, status)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Queries and cleans up the run store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    spend_parser = commands.add_parser("spend", help="API spend over the last days")
+    spend_parser.add_argument("--days", type=float, default=7)
+    spend_parser.add_argument("--group-by", choices=list(SPEND_GROUPS))
+    runs_parser = commands.add_parser("runs", help="recent runs, optionally about one topic")
+    runs_parser.add_argument("--topic")
+    runs_parser.add_argument("--limit", type=int, default=20)
+    artifacts_parser = commands.add_parser("artifacts", help="files recorded for a topic")
+    artifacts_parser.add_argument("topic")
+    artifacts_parser.add_argument("--kind")
+    gc_parser = commands.add_parser("gc", help="list unreferenced files, removing them with --delete, and optionally forget old runs first")
+    gc_parser.add_argument("--older-than-days", type=float, help="forget runs created before this many days ago")
+    gc_parser.add_argument("--delete", action="store_true", help="remove the files instead of only listing them")
+    args = parser.parse_args()
+
+    store = get_run_store()
+    if args.command == "spend":
+        for group, cost in store.spend(since=time.time() - args.days * 86400, group_by=args.group_by).items():
+            print(f"{group}: ${cost:.4f}")
+    elif args.command == "runs":
+        for run in store.find_runs(topic=args.topic, limit=args.limit):
+            print(time.strftime("%Y-%m-%d %H:%M", time.localtime(run["created_at"])), run["id"], run["topic"], run["status"], run["total_cost"])
+    elif args.command == "artifacts":
+        for artifact in store.find_artifacts(topic=args.topic, kind=args.kind):
+            print(artifact["kind"], artifact["path"], artifact["size_bytes"], artifact["duration"])
+    else:
+        if args.older_than_days is not None:
+            before = time.time() - args.older_than_days * 86400
+            if args.delete:
+                print(f"forgot {store.delete_runs(before)} runs")
+            else:
+                print(f"would forget {len(store.query('SELECT id FROM runs WHERE created_at < ?', (before,)))} runs, "
+                      f"their files are not listed below")
+        removed = store.collect_garbage(dry_run=not args.delete)
+        for path in removed:
+            print(path)
+        print(f"{'removed' if args.delete else 'would remove'} {len(removed)} files" + ("" if args.delete else ", pass --delete to remove them"))
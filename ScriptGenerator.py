@@ -5,7 +5,12 @@ from dotenv import load_dotenv
 from typing import TypedDict
 from constants import *
 from prompts import *
+from rate_limits import rate_limit_key
+from clients import get_openai_client, send_rate_limited
+from RunStore import record_api_call
+from script_repair import ScriptParseError, parse_json_object, normalize_key, string_list, reconcile_lengths
 import json
+import time
 
 load_dotenv()
 
@@ -13,6 +18,33 @@ class MontageScriptFormat(TypedDict):
     image_prompts : list[str]
     narrations : list[str]
 
+MONTAGE_SCRIPT_SCHEMA = {
+    "type" : "object",
+    "properties" : {
+        "image_prompts" : {"type" : "array", "items" : {"type" : "string"}},
+        "narrations" : {"type" : "array", "items" : {"type" : "string"}}
+    },
+    "required" : ["image_prompts", "narrations"],
+    "additionalProperties" : False
+}
+
+def parse_montage_script(script : str) -> MontageScriptFormat:
+    """Parses and repairs a montage script locally
+
+    Accepts fenced or prose wrapped JSON, near-JSON and Python dict reprs, normalises the field
+    names and pairs narrations with image prompts one to one when the model returned lists of
+    different lengths.
+
+    Raises:
+        ScriptParseError: if the script cannot be repaired
+    """
+    data = {normalize_key(k) : v for k, v in parse_json_object(script).items()}
+    for field in ("image_prompts", "narrations"):
+        if field not in data:
+            raise ScriptParseError(f"Script is missing the '{field}' field.")
+    narrations, image_prompts = reconcile_lengths(string_list(data["narrations"]), string_list(data["image_prompts"]))
+    return {"image_prompts" : image_prompts, "narrations" : narrations}
+
 class GeneratedScript(TypedDict):
     script: str
     prompt_tokens: int
@@ -90,36 +122,72 @@ class MontageScriptGenerator(ScriptGenerator):
             duration = self.spec.duration, 
             output_format = self.spec.output_format)
     
-    def generate_script(self) -> GeneratedScript:
-        prompt = self.generate_prompt()
-        client = OpenAI(
-            api_key=os.environ.get(TEXT_GEN_API_KEY_NAME[self.model_company]),
-            base_url= TEXT_GEN_BASE_URL[self.model_company]
-        )
-        chat_completion = client.chat.completions.create(
-            messages=[
+    def response_format(self) -> dict | None:
+        """The strictest JSON output constraint the model supports, None to rely on the prompt alone."""
+        support = TEXT_MODEL_JSON_SUPPORT.get(self.model_name)
+        if support == "json_schema":
+            return {
+                "type" : "json_schema",
+                "json_schema" : {"name" : "montage_script", "strict" : True, "schema" : MONTAGE_SCRIPT_SCHEMA}
+            }
+        if support == "json_object":
+            return {"type" : "json_object"}
+        return None
+
+    def request_completion(self, client : OpenAI, prompt : str) -> tuple[str | None, int, int]:
+        """One chat completion, returning the content and the prompt and completion token counts."""
+        key = rate_limit_key(self.model_company.value, "chat")
+        request = {
+            "messages" : [
                 {
                     "role": "user",
                     "content": prompt,
                 }
             ],
-            model=self.model_name,
-        )
-        content = chat_completion.choices[0].message.content
+            "model" : self.model_name,
+        }
+        response_format = self.response_format()
+        if response_format:
+            request["response_format"] = response_format
+        started = time.perf_counter()
+        raw_response = send_rate_limited(key, lambda: client.chat.completions.with_raw_response.create(**request))
+        chat_completion = raw_response.parse()
         usage = chat_completion.usage
-        if(usage) != None:
-          prompt_tokens = usage.prompt_tokens
-          completion_tokens = usage.completion_tokens
-        if type(content) == str:
-          return {
-              "script": content,
-              "prompt_tokens" : prompt_tokens,
-              "completion_tokens" : completion_tokens,
-              "model_name": self.model_name,
-              "cost" : self.calculate_cost(prompt_tokens, completion_tokens)
-          }
-        else:
-            raise ScriptGenerationError("Error during LLM script generation.")
+        prompt_tokens = usage.prompt_tokens if usage else 0
+        completion_tokens = usage.completion_tokens if usage else 0
+        record_api_call(self.model_company.value, "chat", self.model_name, time.perf_counter() - started,
+                        self.calculate_cost(prompt_tokens, completion_tokens))
+        return chat_completion.choices[0].message.content, prompt_tokens, completion_tokens
+
+    def generate_script(self) -> GeneratedScript:
+        """Generates the script, repairing malformed JSON locally and only asking the model
+        again (up to SCRIPT_GENERATION_MAX_ATTEMPTS in total) when the response cannot be repaired.
+        The returned script is always canonical JSON in MontageScriptFormat."""
+        prompt = self.generate_prompt()
+        client = get_openai_client(self.model_company)
+        prompt_tokens, completion_tokens = 0, 0
+        error = "no response"
+        for attempt in range(SCRIPT_GENERATION_MAX_ATTEMPTS):
+            content, attempt_prompt_tokens, attempt_completion_tokens = self.request_completion(client, prompt)
+            prompt_tokens += attempt_prompt_tokens
+            completion_tokens += attempt_completion_tokens
+            if type(content) != str:
+                error = "empty response"
+                continue
+            try:
+                script = parse_montage_script(content)
+            except ScriptParseError as e:
+                error = str(e)
+                print(f"could not repair script ({error}), regenerating...")
+                continue
+            return {
+                "script": json.dumps(script, ensure_ascii=False),
+                "prompt_tokens" : prompt_tokens,
+                "completion_tokens" : completion_tokens,
+                "model_name": self.model_name,
+                "cost" : self.calculate_cost(prompt_tokens, completion_tokens)
+            }
+        raise ScriptGenerationError(f"Error during LLM script generation: {error}")
 
 if __name__ == "__main__":
     pass
@@ -1,6 +1,26 @@
 from constants import *
-from tiktok_uploader.upload import upload_video
+from tiktok_uploader import config as tiktok_config
+from tiktok_uploader.upload import upload_videos
+from tiktok_uploader.browsers import get_browser
 from tiktok_uploader.auth import AuthBackend
+from typing import TypedDict, Literal
+from utils import save_list_as_json, load_list_from_json
+from progress import ProgressReporter, StageProgress
+import threading
+import time
+import uuid
+import os
+
+class UploadError(Exception):
+    """
+    Raised when an upload fails and should be retried.
+    """
+
+    def __init__(self, message: str):
+        """
+        :param message: A human-readable error message describing the issue.
+        """
+        super().__init__(message)
 
 class Uploader:
     def __init__(self):
@@ -9,18 +29,215 @@ class Uploader:
     def upload(self, path_to_file : str, description : str):
         pass
 
+    def close(self):
+        pass
+
 class TikTokUploader(Uploader):
-    def __init__(self):
+    def __init__(self, browser : str = "chrome", headless : bool = False):
         super().__init__()
+        self.browser_name = browser
+        self.headless = headless
+        self.auth = AuthBackend(cookies=TIKTOK_COOKIES_FILEPATH)
+        self.browser = None
+
+    def get_browser_session(self):
+        """Returns the shared browser session, starting one on first use."""
+        if self.browser is None:
+            self.browser = get_browser(self.browser_name, headless=self.headless)
+        return self.browser
 
     def upload(self, path_to_file : str, description : str):
-        # single video
-        upload_video(path_to_file,
-                    description=description,
-                    cookies=TIKTOK_COOKIES_FILEPATH)
+        # single video, through the shared session
+        # upload_videos has no per-call option to keep the authenticated browser alive instead of quitting
+        # it, so the library's global setting is only changed for this call
+        quit_on_end = tiktok_config["quit_on_end"]
+        tiktok_config["quit_on_end"] = False
+        try:
+            failed = upload_videos(videos=[{"path" : path_to_file, "description" : description}],
+                                   auth=self.auth,
+                                   browser_agent=self.get_browser_session(),
+                                   headless=self.headless)
+        except Exception as e:
+            # the session may be in an unknown state, start a fresh one on the next attempt
+            self.close()
+            raise UploadError(str(e))
+        finally:
+            tiktok_config["quit_on_end"] = quit_on_end
+        if failed:
+            raise UploadError(f"TikTok upload failed for {path_to_file}")
+
+    def close(self):
+        if self.browser is not None:
+            try:
+                self.browser.quit()
+            finally:
+                self.browser = None
+
+
+class UploadJob(TypedDict):
+    id : str
+    path : str
+    description : str
+    status : Literal["pending", "uploading", "done", "failed"]
+    attempts : int
+    next_attempt_at : float
+    error : str | None
+
+
+class UploadQueue:
+    """
+    Uploads videos on a background thread so rendering can continue in parallel.
+    One uploader (and so one browser session) is reused for every job, failed uploads
+    are retried with exponential backoff and the queue is persisted to disk after every
+    change so pending uploads survive a crash.
+    """
+
+    def __init__(self, uploader : Uploader, state_path : str = UPLOAD_QUEUE_FILEPATH,
+                 max_attempts : int = 5, backoff_seconds : float = 30.0, max_backoff_seconds : float = 900.0,
+                 progress : ProgressReporter | None = None):
+        """
+        :param uploader: Uploader used for every job.
+        :param state_path: JSON file the queue is persisted to.
+        :param max_attempts: Attempts per job before it is marked failed.
+        :param backoff_seconds: Delay before the first retry, doubled after each failure.
+        :param max_backoff_seconds: Upper bound on the delay between retries.
+        :param progress: If given, every change of a job's status is reported to it as the "upload" stage.
+        """
+        self.uploader = uploader
+        self.state_path = state_path
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.condition = threading.Condition()
+        self.stopping = False
+        self.thread : threading.Thread | None = None
+        self.jobs : list[UploadJob] = self.load_state()
+        self.progress = StageProgress(progress, "upload", unit="uploads") if progress else None
+
+    def load_state(self) -> list[UploadJob]:
+        if not os.path.isfile(self.state_path):
+            return []
+        jobs : list[UploadJob] = load_list_from_json(self.state_path)
+        for job in jobs:
+            # an upload in flight when the process died never completed
+            if job["status"] == "uploading":
+                job["status"] = "pending"
+        return jobs
+
+    def report_progress(self, job : UploadJob):
+        """Reports the uploads finished out of every upload queued, called with the condition held."""
+        if self.progress is None:
+            return
+        finished = sum(1 for j in self.jobs if j["status"] in ("done", "failed"))
+        message = f"{os.path.basename(job['path'])} {job['status']}"
+        if job["error"]:
+            message += f" after {job['attempts']} attempts: {job['error']}"
+        self.progress.update(finished, total=len(self.jobs), message=message, force=True)
+
+    def save_state(self):
+        temp_path = self.state_path + ".tmp"
+        save_list_as_json(temp_path, self.jobs)
+        os.replace(temp_path, self.state_path)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="upload-queue", daemon=True)
+            self.thread.start()
+
+    def submit(self, path_to_file : str, description : str) -> str:
+        """Queues a video for upload and returns the job id."""
+        job : UploadJob = {
+            "id" : str(uuid.uuid4()),
+            "path" : path_to_file,
+            "description" : description,
+            "status" : "pending",
+            "attempts" : 0,
+            "next_attempt_at" : 0.0,
+            "error" : None
+        }
+        with self.condition:
+            self.jobs.append(job)
+            self.save_state()
+            self.report_progress(job)
+            self.condition.notify_all()
+        return job["id"]
+
+    def get_job(self, job_id : str) -> UploadJob | None:
+        with self.condition:
+            for job in self.jobs:
+                if job["id"] == job_id:
+                    return dict(job) #type: ignore
+        return None
+
+    def pending_count(self) -> int:
+        with self.condition:
+            return sum(1 for job in self.jobs if job["status"] in ("pending", "uploading"))
+
+    def next_job(self) -> UploadJob | None:
+        """Blocks until a job is due or the queue is stopped."""
+        with self.condition:
+            while not self.stopping:
+                pending = [job for job in self.jobs if job["status"] == "pending"]
+                if pending:
+                    job = min(pending, key=lambda j: j["next_attempt_at"])
+                    delay = job["next_attempt_at"] - time.time()
+                    if delay <= 0:
+                        job["status"] = "uploading"
+                        self.save_state()
+                        self.report_progress(job)
+                        return job
+                    self.condition.wait(timeout=delay)
+                else:
+                    self.condition.wait()
+        return None
+
+    def run(self):
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            try:
+                self.uploader.upload(job["path"], job["description"])
+                status, error = "done", None
+            except Exception as e:
+                status, error = "pending", str(e)
+            with self.condition:
+                job["attempts"] += 1
+                job["error"] = error
+                if status == "pending":
+                    if job["attempts"] >= self.max_attempts:
+                        status = "failed"
+                    delay = min(self.backoff_seconds * 2 ** (job["attempts"] - 1), self.max_backoff_seconds)
+                    job["next_attempt_at"] = time.time() + delay
+                job["status"] = status
+                self.save_state()
+                self.report_progress(job)
+                self.condition.notify_all()
+
+    def join(self, timeout : float | None = None) -> bool:
+        """Waits until every job is done or failed, returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while any(job["status"] in ("pending", "uploading") for job in self.jobs):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(timeout=remaining)
+        return True
+
+    def close(self):
+        """Stops the background thread after the current upload and releases the uploader."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.uploader.close()
+
 
 if __name__ == "__main__":
     # vid = "completed_videos/_8730c0ed-8968-4e53-8e71-6aee486efb67.mp4"
     # t_upload = TikTokUploader()
     # t_upload.upload(vid)
-    pass
\ No newline at end of file
+    pass
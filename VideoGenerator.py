@@ -1,25 +1,65 @@
 import re
 from constants import *
-from ImageGenerator import StabilityImageGenerator
-from ContentSpecs import VideoSpec
+from ImageGenerator import StabilityImageGenerator, HedgeBudget
+from ContentSpecs import VideoSpec, VideoVariant
 import uuid
-from ScriptGenerator import MontageScriptFormat
-from NarrationGenerator import generate_narration_audio
+from ScriptGenerator import MontageScriptFormat, parse_montage_script
+from NarrationGenerator import generate_narration_audio, generate_narration_bytes, generate_narration_pcm, load_cached_narration, decode_pcm_narration, generate_narration_batch, pack_narration_batches
 from transcribe import get_timestamped_transcriptions, TranscriptionWord
-from utils import save_list_as_json
+from utils import save_list_as_json, decode_image_bytes
+from ArtifactStore import ArtifactStore
+from FrameStore import FrameStore
 from moviepy.editor import (
-    ImageClip, TextClip, CompositeVideoClip, AudioFileClip, concatenate_videoclips, vfx, CompositeAudioClip, VideoFileClip
+    ImageClip, TextClip, CompositeVideoClip, VideoClip, AudioFileClip, concatenate_videoclips, vfx, CompositeAudioClip, VideoFileClip
 )
-from captions import add_captions_helper
+from moviepy.audio.AudioClip import AudioArrayClip
+from captions import add_captions_helper, scaled_caption_style
+from static_frames import StaticCaptionedClip
+from ass_captions import write_ass_captions, burn_in_ffmpeg_params
+from AudioEngine import AudioEngine, to_stereo
+from clip_stream import SequentialVideoClip
+from ffmpeg_tools import concatenate_clip_files
+from multi_format import SharedFrameSource
+from parallel_render import new_timeline_spec, render_timeline
+from still_encode import render_timeline_changes
+from alignment import align_narrations
+from progress import get_progress_reporter, MoviepyProgressLogger
+from prompt_index import PromptIndex, get_image_prompt_index, image_set_name, derive_image
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import contextvars
+import hashlib
 import json
+import os
+from PIL import Image
 
 
 
 class VideoGenerator:
 
-    def __init__(self, script : str, video_spec : VideoSpec):
+    def __init__(self, script : str, video_spec : VideoSpec, hedge_cost_cap : float = IMAGE_HEDGE_COST_CAP,
+                 image_reuse_threshold : float | None = None, topic : str | None = None,
+                 image_reuse_across_topics : bool = False):
         self.script = script
         self.video_spec = video_spec
+        # shared by every image request of this video, see StabilityImageGenerator
+        self.hedge_budget = HedgeBudget(hedge_cost_cap)
+        # prompts this similar to an earlier one reuse its image, None generates every image
+        self.image_reuse_threshold = image_reuse_threshold
+        # kept images are recorded under the topic, and only images kept for it are reused unless
+        # image_reuse_across_topics
+        self.topic = topic
+        self.image_reuse_across_topics = image_reuse_across_topics
+        self.image_generations_saved = 0
+        self.audio_engine = AudioEngine()
+        self.artifacts = ArtifactStore()
+        # decoded frames shared with render worker processes
+        self.frame_store = FrameStore()
+
+    def close(self):
+        """Removes every intermediate artifact of this generator's run."""
+        self.artifacts.close()
+        self.frame_store.close()
     
     def generate_video(self, output_path : str | None = None) -> str: #type: ignore
         pass
@@ -38,138 +78,623 @@ class VideoGenerator:
         cost = 0
         prompt = "Make the following image description in {} style: {}. Do not include text in the image.".format(self.video_spec.visual_art_style, prompt)
         if self.video_spec.image_model_name and self.video_spec.image_model_name.split("-")[0] == "stability":
-            image_path, cost = StabilityImageGenerator().generate_image(prompt, self.video_spec.get_aspect_ratio(),self.video_spec.image_model_name, self.video_spec.visual_art_style, image = image)
+            image_path, cost = StabilityImageGenerator(hedge_budget=self.hedge_budget).generate_image(prompt, self.video_spec.get_image_aspect_ratio(),self.video_spec.image_model_name, self.video_spec.visual_art_style, image = image)
         else:
             raise Exception("Unsupported model selected in video spec.")
         return image_path, cost
+
+    def generate_image_bytes(self, prompt : str, image : bytes | None = None, video_spec : VideoSpec | None = None) -> tuple[bytes, float]:
+        """Same as generate_image but returns the encoded image instead of a filepath
+
+        Args:
+            prompt (str): prompt for image generation model
+            image (bytes): encoded starting point for the image (optional)
+            video_spec (VideoSpec | None): spec whose style and model to use, this generator's by default
+
+        Returns:
+            bytes: encoded generated image
+            float: cost to generate image in USD
+        """
+        video_spec = video_spec or self.video_spec
+        prompt = "Make the following image description in {} style: {}. Do not include text in the image.".format(video_spec.visual_art_style, prompt)
+        if video_spec.image_model_name and video_spec.image_model_name.split("-")[0] == "stability":
+            return StabilityImageGenerator(hedge_budget=self.hedge_budget).generate_image_bytes(prompt, video_spec.get_image_aspect_ratio(), video_spec.image_model_name, video_spec.visual_art_style, image = image)
+        raise Exception("Unsupported model selected in video spec.")
     
-    def add_background_music(self, video : CompositeVideoClip) -> CompositeVideoClip:
+    def add_background_music(self, video : CompositeVideoClip, narration : np.ndarray | None = None) -> CompositeVideoClip:
         """Given a video, adds background music according to this generator's video spec
 
         Args:
             video (CompositeVideoClip): a video 
+            narration (np.ndarray | None): pre-decoded narration samples, decoded from the video's audio if not given
 
         Returns:
             CompositeVideoClip: video with background music added if specified
         """
-        total_duration = video.duration
         if self.video_spec.background_music:
-            music_track = AudioFileClip("{}/{}".format(BACKGROUND_MUSIC_FILEPATH, self.video_spec.background_music.value)).set_duration(total_duration).volumex(.08)
-            narration_track = video.audio
-            vid_audio = CompositeAudioClip([music_track, narration_track])
-            video = video.set_audio(vid_audio) #type: ignore
+            if narration is None:
+                narration = self.audio_engine.decode_clip_audio(video.audio) #type: ignore
+            video = video.set_audio(self.mix_background_music(narration, video.duration)) #type: ignore
         return video
+
+    def mix_background_music(self, narration : np.ndarray, duration : float) -> AudioArrayClip:
+        """Mixes the video spec's background music under the narration samples, fitted to duration seconds
+
+        Returns:
+            AudioArrayClip: the mixed soundtrack, which several renders of the same timeline can share
+        """
+        narration = self.audio_engine.fit_to_length(narration, int(round(duration * self.audio_engine.fps)))
+        mixed = self.audio_engine.mix(narration, self.video_spec.background_music) #type: ignore
+        return self.audio_engine.to_audio_clip(mixed)
     
     def save_audio_of_video_file(self, video : CompositeVideoClip | VideoFileClip) -> str:
 
-        output_filename = f"{TEMP_AUDIO_FILEPATH}_{uuid.uuid4()}.mp3"
+        _, output_filename = self.artifacts.new_path(".mp3")
         audio = video.audio
         if audio:
             audio.fps = 44100
-            audio.write_audiofile(
-                output_filename,
-                codec='libmp3lame',
-                bitrate="128k",
-                verbose=False,
-                logger=None
-            )
+            with get_progress_reporter().stage("encoding audio", unit="chunks") as progress:
+                audio.write_audiofile(
+                    output_filename,
+                    codec='libmp3lame',
+                    bitrate="128k",
+                    verbose=False,
+                    logger=MoviepyProgressLogger(progress, bar="chunk")
+                )
         
         return output_filename
     
-    def save_video_file(self, video : CompositeVideoClip, output_filename = None) -> str:
+    def save_video_file(self, video : CompositeVideoClip, output_filename = None, ffmpeg_params : list[str] | None = None,
+                        fps : int = VIDEO_FPS, preset : str = "medium", progress_stage : str = "encoding") -> str:
         if output_filename == None:
             output_filename = f"{COMPLETED_VIDEO_FILEPATH}_{uuid.uuid4()}.mp4"
         
-        video.write_videofile(
-            output_filename,
-            fps=24,
-            codec="libx264",
-            audio_codec="aac",
-            verbose=False,
-            logger=None
-        )
+        with get_progress_reporter().stage(progress_stage, total=int(video.duration * fps), unit="frames") as progress:
+            video.write_videofile(
+                output_filename,
+                fps=fps,
+                codec="libx264",
+                audio_codec="aac",
+                preset=preset,
+                ffmpeg_params=ffmpeg_params,
+                verbose=False,
+                logger=MoviepyProgressLogger(progress)
+            )
         return output_filename
     
+    def transcribe_video(self, video : CompositeVideoClip | VideoFileClip) -> tuple[list[TranscriptionWord], float]:
+        """Transcribes the audio track of a video into timestamped words
+
+        Returns:
+            list[TranscriptionWord]: transcribed words
+            float: cost of the transcription
+        """
+        audio_filepath = self.save_audio_of_video_file(video)
+        return get_timestamped_transcriptions(audio_filepath)
+
+    def transcribe_audio(self, samples : np.ndarray) -> tuple[list[TranscriptionWord], float]:
+        """Transcribes a sample buffer, sending a compact mono encode rather than rendering the video's audio
+
+        Returns:
+            list[TranscriptionWord]: transcribed words
+            float: cost of the transcription
+        """
+        _, audio_filepath = self.artifacts.new_path(".mp3")
+        self.audio_engine.encode_for_transcription(samples, audio_filepath)
+        return get_timestamped_transcriptions(audio_filepath)
+
     def add_captions(self, video : CompositeVideoClip | VideoFileClip) -> tuple[CompositeVideoClip, float]:
         """Given a video clip, add typewriter captions
 
         Returns:
             CompositeVideoClip: video clip
         """
-        audio_filepath = self.save_audio_of_video_file(video)
-        transcription_words, cost = get_timestamped_transcriptions(audio_filepath)
+        transcription_words, cost = self.transcribe_video(video)
         return add_captions_helper(transcription_words, video), cost
+
+    def burn_in_captions(self, transcription_words : list[TranscriptionWord], video_size : tuple[int, int]) -> list[str]:
+        """Writes typewriter captions to an ASS file for libass to render during the final encode
+
+        Returns:
+            list[str]: ffmpeg parameters to pass to save_video_file
+        """
+        _, ass_path = self.artifacts.new_path(".ass")
+        write_ass_captions(transcription_words, video_size, ass_path)
+        return burn_in_ffmpeg_params(ass_path)
     
-    def compile_clips(self, clip_paths: list[str]) -> CompositeVideoClip:
-        clips : list[VideoFileClip] = []
-        
-        current_start = 0
-        for path in clip_paths:
-            clip = VideoFileClip(path)
-            clip = clip.set_start(current_start)
-            current_start += clip.duration
-            clips.append(clip)
+    def compile_clips(self, clip_paths: list[str], durations : list[float] | None = None) -> SequentialVideoClip:
+        """Joins clip files in order, streaming them so only the readers for the
+        current playback window are open at any time
 
-        total_duration = sum(c.duration for c in clips)
-        return CompositeVideoClip(clips).set_duration(total_duration)
+        Args:
+            clip_paths (list[str]): clip files in playback order
+            durations (list[float] | None): exact length of each clip, probed if not given
+
+        Returns:
+            SequentialVideoClip: the joined video, call close() once it has been written
+        """
+        return SequentialVideoClip(clip_paths, durations=durations)
 
 class MontageGenerator(VideoGenerator):
 
-    def __init__(self, script : str, video_spec : VideoSpec):
-        super().__init__(script, video_spec)
+    def __init__(self, script : str, video_spec : VideoSpec, hedge_cost_cap : float = IMAGE_HEDGE_COST_CAP,
+                 image_reuse_threshold : float | None = None, topic : str | None = None,
+                 image_reuse_across_topics : bool = False):
+        super().__init__(script, video_spec, hedge_cost_cap, image_reuse_threshold, topic, image_reuse_across_topics)
         print(script)
-        script_dict : MontageScriptFormat = json.loads(script)
+        script_dict : MontageScriptFormat = parse_montage_script(script)
         self.narrations, self.image_prompts = script_dict["narrations"], script_dict["image_prompts"]
-        assert len(self.narrations) == len (self.image_prompts)
-        self.image_filepaths = []
-        self.narration_filepaths = []
+        # artifact keys in self.artifacts, one per scene
+        self.image_artifacts : list[str] = []
+        self.narration_artifacts : list[str] = []
+        self.clip_artifacts : list[str] = []
+        # (start, end) of each scene on the timeline, every scene being a still image
+        self.scene_segments : list[tuple[float, float]] = []
 
-    def generate_video(self, output_path : str | None = None) -> tuple[str, float]: 
+    @property
+    def image_filepaths(self) -> list[str]:
+        return [self.artifacts.get_path(key) for key in self.image_artifacts]
+
+    @property
+    def narration_filepaths(self) -> list[str]:
+        return [self.artifacts.get_path(key) for key in self.narration_artifacts]
+
+    def generate_video(self, output_path : str | None = None,
+                       assembly_mode : ASSEMBLY_MODES = ASSEMBLY_MODES.composite,
+                       caption_backend : CAPTION_BACKENDS = CAPTION_BACKENDS.moviepy,
+                       transcription_backend : TRANSCRIPTION_BACKENDS = TRANSCRIPTION_BACKENDS.whisper,
+                       workers : int = 1,
+                       segment_seconds : float = PARALLEL_SEGMENT_SECONDS,
+                       preview : bool = False,
+                       placeholder_images : bool = False,
+                       encoding_mode : ENCODING_MODES = ENCODING_MODES.every_frame) -> tuple[str, float]: 
         """Generates a video assuming narrations and images have already been generated
 
+        Args:
+            output_path (str | None): where to write the completed video
+            assembly_mode (ASSEMBLY_MODES): how scene clips are joined before captions and music are applied
+            caption_backend (CAPTION_BACKENDS): whether captions are composited by moviepy, burned in by libass or patched in as sprites
+            transcription_backend (TRANSCRIPTION_BACKENDS): whether caption timings come from Whisper or local alignment
+            workers (int): above 1, the timeline is split into segments encoded in that many processes (assembly_mode is then unused)
+            segment_seconds (float): target segment length when rendering in parallel
+            preview (bool): render a low resolution, low frame rate draft instead, see render_preview
+            placeholder_images (bool): in a preview, use flat placeholder frames instead of the generated images
+            encoding_mode (ENCODING_MODES): changes only generates the frames where the picture changes, see render_timeline_changes (sprites captions only, workers and assembly_mode are then unused)
+
         Returns:
             str: filepath to the completed video
             float: cost to add captions to video
         """
-        assert len(self.image_filepaths) == len(self.image_prompts)
-        assert len(self.narration_filepaths) == len(self.image_filepaths)
+        if preview:
+            return self.render_preview(output_path, caption_backend, placeholder_images=placeholder_images)
+        if workers > 1 or encoding_mode == ENCODING_MODES.changes:
+            return self.render_parallel(output_path, caption_backend, transcription_backend, workers, segment_seconds, encoding_mode)
+
+        video, narration = self.assemble_timeline(assembly_mode)
+
+        print("adding captions...")
+        transcription_words, cost = self.transcribe_narration(narration, transcription_backend)
+        video_filepath = self.render_output(video, narration, transcription_words, output_path, caption_backend)
+        video.close()
+        self.release_clips()
+        return video_filepath, cost
+
+    def generate_videos(self, output_paths : dict[OUTPUT_FORMATS, str] | None = None,
+                        assembly_mode : ASSEMBLY_MODES = ASSEMBLY_MODES.composite,
+                        caption_backend : CAPTION_BACKENDS = CAPTION_BACKENDS.moviepy,
+                        reframe_mode : REFRAME_MODES = REFRAME_MODES.crop,
+                        transcription_backend : TRANSCRIPTION_BACKENDS = TRANSCRIPTION_BACKENDS.whisper) -> tuple[dict[OUTPUT_FORMATS, str], float]:
+        """Renders every format in the video spec's output_formats from one pass. Narration, transcription
+        and the music mix are shared, and the encodes run concurrently from a single master frame source,
+        each cropped or padded to its aspect ratio with captions laid out for its width.
+
+        Args:
+            output_paths (dict[OUTPUT_FORMATS, str] | None): where to write each format, generated if not given
+            assembly_mode (ASSEMBLY_MODES): how scene clips are joined
+            caption_backend (CAPTION_BACKENDS): whether captions are composited by moviepy, burned in by libass or patched in as sprites
+            reframe_mode (REFRAME_MODES): whether the master frame is cropped or padded for each format
+            transcription_backend (TRANSCRIPTION_BACKENDS): whether caption timings come from Whisper or local alignment
+
+        Returns:
+            dict[OUTPUT_FORMATS, str]: filepath to each completed video
+            float: cost to add captions to the videos
+        """
+        output_formats = self.video_spec.output_formats
+        output_paths = output_paths or {}
+        video, narration = self.assemble_timeline(assembly_mode)
+
+        print("adding captions...")
+        transcription_words, cost = self.transcribe_narration(narration, transcription_backend)
+
+        soundtrack = None
+        if self.video_spec.background_music:
+            print("adding background music...")
+            soundtrack = self.mix_background_music(narration, video.duration)
+
+        source = SharedFrameSource(video, consumers=len(output_formats))
+        def render(output_format : OUTPUT_FORMATS) -> str:
+            clip = source.reframed_clip(ASPECT_RATIOS[output_format], reframe_mode)
+            return self.render_output(clip, narration, transcription_words, output_paths.get(output_format), caption_backend,
+                                      progress_stage=f"encoding {output_format.value}", soundtrack=soundtrack)
+
+        with ThreadPoolExecutor(max_workers=len(output_formats)) as executor:
+            # copies of this context so the encodes report to the active progress reporter
+            futures = [executor.submit(contextvars.copy_context().run, render, output_format) for output_format in output_formats]
+            video_filepaths = dict(zip(output_formats, [future.result() for future in futures]))
+        video.close()
+        self.release_clips()
+        return video_filepaths, cost
+
+    def assemble_timeline(self, assembly_mode : ASSEMBLY_MODES = ASSEMBLY_MODES.composite) -> tuple[VideoClip, np.ndarray]:
+        """Renders a clip per scene and joins them into one timeline carrying the narration audio
+
+        Returns:
+            VideoClip: the joined video, call close() once it has been written
+            np.ndarray: the narration samples, decoded once so captions and the music mix can share them
+        """
+        assert len(self.image_artifacts) == len(self.image_prompts)
+        assert len(self.narration_artifacts) == len(self.image_artifacts)
         
         clip_paths = []
-        for i, image_filepath in enumerate(self.image_filepaths):
-            narration = self.narrations[i]
-            narration_filepath = self.narration_filepaths[i]
-            clip = self.generate_montage_clip(image_filepath, narration_filepath, narration)
+        narration_sources = [self.narration_source(key) for key in self.narration_artifacts]
+        narration = self.decode_scene_narrations(narration_sources)
+        for i, image_key in enumerate(self.image_artifacts):
+            image = self.artifacts.get_decoded(image_key, decode_image_bytes)
+            start, end = self.scene_segments[i]
+            # the timeline's audio comes from the narration buffer, so scene clips are written silent and
+            # exactly as many frames long as their scene, or cuts and captions would drift from the narration
+            clip = self.generate_montage_clip(image, narration_sources[i], self.narrations[i], include_audio=False,
+                                              n_frames=int(round(end * VIDEO_FPS)) - int(round(start * VIDEO_FPS)))
             clip_paths.append(clip)
-        video = self.compile_clips(clip_paths)
+        if assembly_mode == ASSEMBLY_MODES.stream_copy:
+            # every clip comes out of generate_montage_clip with the same encoder settings,
+            # so they can be joined without decoding and captions/music applied in the final pass
+            joined_key, joined_path = self.artifacts.new_path(".mp4")
+            self.clip_artifacts.append(joined_key)
+            concatenate_clip_files(clip_paths, joined_path)
+            video = VideoFileClip(joined_path, audio=False)
+        else:
+            video = self.compile_clips(clip_paths, [end - start for start, end in self.scene_segments])
+
+        narration = self.audio_engine.fit_to_length(narration, int(round(video.duration * self.audio_engine.fps)))
+        return video.set_audio(self.audio_engine.to_audio_clip(narration)), narration
+
+    def decode_scene_narrations(self, narration_sources : list[str | np.ndarray]) -> np.ndarray:
+        """Joins the scene narrations into one buffer and records where each scene sits on the timeline.
+        Each scene is padded or trimmed to the nearest whole number of VIDEO_FPS frames, so scene cuts
+        fall on the frame grid wherever the timeline is rendered."""
+        afps = self.audio_engine.fps
+        scene_narrations = []
+        self.scene_segments = []
+        frames = 0
+        for source in narration_sources:
+            samples = self.audio_engine.concatenate_narrations([source])
+            scene_frames = max(1, int(round(len(samples) * VIDEO_FPS / afps)))
+            # cut on the running total rather than per scene, so sample rounding never adds up
+            start, end = frames / VIDEO_FPS, (frames + scene_frames) / VIDEO_FPS
+            scene_narrations.append(self.audio_engine.fit_to_length(samples, int(round(end * afps)) - int(round(start * afps))))
+            self.scene_segments.append((start, end))
+            frames += scene_frames
+        return self.audio_engine.concatenate_narrations(scene_narrations)
+
+    def render_parallel(self, output_path : str | None = None,
+                        caption_backend : CAPTION_BACKENDS = CAPTION_BACKENDS.moviepy,
+                        transcription_backend : TRANSCRIPTION_BACKENDS = TRANSCRIPTION_BACKENDS.whisper,
+                        workers : int | None = None,
+                        segment_seconds : float = PARALLEL_SEGMENT_SECONDS,
+                        encoding_mode : ENCODING_MODES = ENCODING_MODES.every_frame) -> tuple[str, float]:
+        """Renders the final timeline straight from the scene images in a pool of worker processes.
+        Segments are cut on the frame grid, encoded silent, joined with stream copy, and the mixed
+        audio is muxed once over the joined video. With ENCODING_MODES.changes the timeline is instead
+        rendered in this process from only the frames where its picture changes.
+
+        Returns:
+            str: filepath to the completed video
+            float: cost to add captions to video
+        """
+        narration, n_frames = self.decode_frame_grid_narration()
 
         print("adding captions...")
-        video, cost = self.add_captions(video)
+        transcription_words, cost = self.transcribe_narration(narration, transcription_backend)
+        spec = new_timeline_spec(self.image_filepaths, self.scene_segments, transcription_words, caption_backend, self.frame_store)
+        if caption_backend == CAPTION_BACKENDS.ass:
+            _, spec["ass_path"] = self.artifacts.new_path(".ass")
+            write_ass_captions(transcription_words, spec["size"], spec["ass_path"])
+
+        video_key, video_path = self.artifacts.new_path(".mp4")
+        if encoding_mode == ENCODING_MODES.changes:
+            render_timeline_changes(spec, n_frames, video_path, self.artifacts.spill_dir)
+        else:
+            print(f"rendering {n_frames} frames...")
+            render_timeline(spec, n_frames, video_path, self.artifacts.spill_dir, workers, segment_seconds)
+
+        if output_path is None:
+            output_path = f"{COMPLETED_VIDEO_FILEPATH}_{uuid.uuid4()}.mp4"
+        self.audio_engine.mux_with_video(self.audio_engine.mix(narration, self.video_spec.background_music), video_path, output_path)
+        self.artifacts.release(video_key)
+        return output_path, cost
+
+    def decode_frame_grid_narration(self) -> tuple[np.ndarray, int]:
+        """Joins the scene narrations and cuts them to the VIDEO_FPS frame grid, so audio rendered
+        separately from the video ends exactly with it
+
+        Returns:
+            np.ndarray: the narration samples
+            int: length of the timeline in frames
+        """
+        assert len(self.image_artifacts) == len(self.image_prompts)
+        assert len(self.narration_artifacts) == len(self.image_artifacts)
+
+        afps = self.audio_engine.fps
+        narration = self.decode_scene_narrations([self.narration_source(key) for key in self.narration_artifacts])
+        n_frames = int(round(len(narration) / afps * VIDEO_FPS))
+        narration = self.audio_engine.fit_to_length(narration, int(round(n_frames / VIDEO_FPS * afps)))
+        self.scene_segments[-1] = (self.scene_segments[-1][0], n_frames / VIDEO_FPS)
+        return narration, n_frames
+
+    def generate_variants(self, variants : list[VideoVariant],
+                          caption_backend : CAPTION_BACKENDS = CAPTION_BACKENDS.sprites,
+                          transcription_backend : TRANSCRIPTION_BACKENDS = TRANSCRIPTION_BACKENDS.whisper,
+                          workers : int | None = None,
+                          segment_seconds : float = PARALLEL_SEGMENT_SECONDS,
+                          encoding_mode : ENCODING_MODES = ENCODING_MODES.every_frame) -> tuple[list[str], float, float]:
+        """Renders several variants of this script, doing each piece of work once however many
+        variants share it. Narrations and transcription are shared by every variant. Images are only
+        generated again for an art style, image model or aspect ratio that differs from this
+        generator's video spec, and each distinct set of images and caption style is rendered once,
+        so variants that only swap the background music just get their own mix and mux.
+        Assumes narrations and images have already been generated for this generator's video spec.
+
+        Args:
+            variants (list[VideoVariant]): the variants to render
+            caption_backend (CAPTION_BACKENDS): how captions are drawn in every variant
+            transcription_backend (TRANSCRIPTION_BACKENDS): whether caption timings come from Whisper or local alignment
+            workers (int | None): worker processes shared by the concurrent renders, one per core by default
+            segment_seconds (float): target segment length when rendering in parallel
+            encoding_mode (ENCODING_MODES): changes only generates the frames where each render's picture changes
+
+        Returns:
+            list[str]: filepath to each variant's video, in the order given
+            float: cost to add captions to the videos
+            float: cost of the images generated for the variants
+        """
+        narration, n_frames = self.decode_frame_grid_narration()
+
+        print("adding captions...")
+        transcription_words, transcription_cost = self.transcribe_narration(narration, transcription_backend)
+
+        def image_set_key(video_spec : VideoSpec) -> tuple:
+            return (video_spec.visual_art_style, video_spec.image_model_name, video_spec.get_image_aspect_ratio())
+
+        image_sets = {image_set_key(self.video_spec) : self.image_artifacts}
+        new_image_specs = {}
+        image_cost = 0.0
+        for variant in variants:
+            key = image_set_key(variant["video_spec"])
+            if key not in image_sets:
+                new_image_specs.setdefault(key, variant["video_spec"])
+        if new_image_specs:
+            print(f"generating {len(new_image_specs)} more image sets...")
+            with ThreadPoolExecutor(max_workers=len(new_image_specs)) as executor:
+                # each task runs in a copy of this context so its API calls are recorded against the current run
+                futures = [executor.submit(contextvars.copy_context().run, self.generate_image_artifacts, spec)
+                           for spec in new_image_specs.values()]
+                results = dict(zip(new_image_specs, [future.result() for future in futures]))
+            for key, (image_artifacts, cost) in results.items():
+                image_sets[key] = image_artifacts
+                image_cost += cost
+
+        # one captioned, silent render per set of images and caption style
+        renders : dict[tuple, tuple[tuple, dict]] = {}
+        for variant in variants:
+            style = variant.get("caption_style", {})
+            key = (image_set_key(variant["video_spec"]), tuple(sorted(style.items())))
+            renders.setdefault(key, (key[0], style))
+        workers = workers or os.cpu_count() or 1
+        render_workers = max(1, workers // len(renders))
+        def render(image_key : tuple, style : dict, index : int) -> str:
+            image_paths = [self.artifacts.get_path(key) for key in image_sets[image_key]]
+            spec = new_timeline_spec(image_paths, self.scene_segments, transcription_words, caption_backend,
+                                     self.frame_store, caption_style=style)
+            if caption_backend == CAPTION_BACKENDS.ass:
+                _, spec["ass_path"] = self.artifacts.new_path(".ass")
+                write_ass_captions(transcription_words, spec["size"], spec["ass_path"], **style)
+            _, video_path = self.artifacts.new_path(".mp4")
+            if encoding_mode == ENCODING_MODES.changes:
+                return render_timeline_changes(spec, n_frames, video_path, self.artifacts.spill_dir,
+                                               progress_stage=f"rendering {index + 1}/{len(renders)}")
+            return render_timeline(spec, n_frames, video_path, self.artifacts.spill_dir, render_workers, segment_seconds,
+                                   progress_stage=f"rendering {index + 1}/{len(renders)}")
+
+        print(f"rendering {len(renders)} timelines of {n_frames} frames for {len(variants)} variants...")
+        with ThreadPoolExecutor(max_workers=len(renders)) as executor:
+            # copies of this context so the renders report to the active progress reporter
+            futures = [executor.submit(contextvars.copy_context().run, render, *args, i) for i, args in enumerate(renders.values())]
+            video_paths = dict(zip(renders, [future.result() for future in futures]))
+
+        # one mix per background music, muxed over each variant's render
+        mixes = {}
+        for variant in variants:
+            music = variant["video_spec"].background_music
+            if music not in mixes:
+                mixes[music] = self.audio_engine.mix(narration, music)
+        def mux(variant : VideoVariant) -> str:
+            style = variant.get("caption_style", {})
+            video_path = video_paths[(image_set_key(variant["video_spec"]), tuple(sorted(style.items())))]
+            output_path = variant.get("output_path") or f"{COMPLETED_VIDEO_FILEPATH}_{uuid.uuid4()}.mp4"
+            return self.audio_engine.mux_with_video(mixes[variant["video_spec"].background_music], video_path, output_path)
+
+        with ThreadPoolExecutor(max_workers=len(variants)) as executor:
+            output_paths = list(executor.map(mux, variants))
+        return output_paths, transcription_cost, image_cost
+
+    def render_preview(self, output_path : str | None = None,
+                       caption_backend : CAPTION_BACKENDS = CAPTION_BACKENDS.sprites,
+                       scale : float = PREVIEW_SCALE,
+                       fps : int = PREVIEW_FPS,
+                       placeholder_images : bool = False) -> tuple[str, float]:
+        """Renders a full length draft for checking captions, fonts and music without a full render
+        or any API call. The timeline is built straight from the scene images at scale times their
+        resolution and encoded at fps with the fastest preset. Captions are aligned locally and
+        scaled with the frame so their layout matches the final video.
+
+        Scenes without a generated narration use the narration cache, or silence timed from the
+        narration's word count. Scenes without an image, or every scene with placeholder_images,
+        get a flat placeholder frame.
+
+        Returns:
+            str: filepath to the preview
+            float: cost, always 0
+        """
+        afps = self.audio_engine.fps
+        narration = self.decode_scene_narrations(self.preview_narration_sources())
+        frames = self.preview_frames(scale, placeholder_images)
+        size = (frames[0].shape[1], frames[0].shape[0])
+
+        scenes = [narration[int(round(start * afps)):int(round(end * afps))] for start, end in self.scene_segments]
+        transcription_words = align_narrations(scenes, self.narrations, afps)
+
+        ends = np.array([end for _, end in self.scene_segments])
+        def make_frame(t):
+            return frames[min(int(np.searchsorted(ends, t, side="right")), len(frames) - 1)]
+        video = VideoClip(make_frame, duration=len(narration) / afps)
+
+        style = scaled_caption_style(scale)
+        ffmpeg_params = None
+        if caption_backend == CAPTION_BACKENDS.ass:
+            _, ass_path = self.artifacts.new_path(".ass")
+            ffmpeg_params = burn_in_ffmpeg_params(write_ass_captions(transcription_words, size, ass_path, **style))
+        elif caption_backend == CAPTION_BACKENDS.sprites:
+            video = StaticCaptionedClip(video, transcription_words, self.scene_segments, **style)
+        else:
+            video = add_captions_helper(transcription_words, video, **style)
+
+        audio = self.audio_engine.mix(narration, self.video_spec.background_music)
+        video = video.set_audio(self.audio_engine.to_audio_clip(audio))
+        if output_path is None:
+            output_path = f"{COMPLETED_VIDEO_FILEPATH}_preview_{uuid.uuid4()}.mp4"
+        return self.save_video_file(video, output_path, ffmpeg_params, fps=fps, preset=PREVIEW_PRESET), 0.0
+
+    def preview_narration_sources(self) -> list[str | np.ndarray]:
+        """Per scene narration for a preview: the generated narration, a cached one, or timed silence."""
+        sources : list[str | np.ndarray] = []
+        for i, text in enumerate(self.narrations):
+            if i < len(self.narration_artifacts):
+                sources.append(self.narration_source(self.narration_artifacts[i]))
+                continue
+            cached = load_cached_narration(text, "mp3")
+            if cached is not None:
+                sources.append(self.artifacts.get_path(self.artifacts.put_bytes(cached, ".mp3")))
+                continue
+            cached = load_cached_narration(text, "pcm")
+            if cached is not None:
+                sources.append(decode_pcm_narration(cached, self.audio_engine.fps))
+                continue
+            seconds = max(1.0, len(text.split()) / PREVIEW_WORDS_PER_SECOND)
+            sources.append(np.zeros(int(seconds * self.audio_engine.fps), dtype=np.float32))
+        return sources
+
+    def preview_frames(self, scale : float, placeholder_images : bool = False) -> list[np.ndarray]:
+        """Per scene frames at scale times the final resolution, placeholders where there is no image."""
+        if self.image_artifacts and not placeholder_images:
+            height, width = self.artifacts.get_decoded(self.image_artifacts[0], decode_image_bytes).shape[:2]
+        else:
+            width, height = OUTPUT_RESOLUTIONS[self.video_spec.output_format]
+        size = (max(2, int(width * scale)) // 2 * 2, max(2, int(height * scale)) // 2 * 2)
+
+        frames = []
+        for i, prompt in enumerate(self.image_prompts):
+            if i < len(self.image_artifacts) and not placeholder_images:
+                image = Image.fromarray(self.artifacts.get_decoded(self.image_artifacts[i], decode_image_bytes))
+                frames.append(np.asarray(image.resize(size, Image.BILINEAR)))
+            else:
+                # a stable muted colour per prompt so scene changes are visible
+                seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:6], 16)
+                color = [64 + (seed >> shift & 0xFF) // 2 for shift in (0, 8, 16)]
+                frames.append(np.full((size[1], size[0], 3), color, dtype=np.uint8))
+        return frames
+
+    def transcribe_narration(self, narration : np.ndarray,
+                             transcription_backend : TRANSCRIPTION_BACKENDS = TRANSCRIPTION_BACKENDS.whisper) -> tuple[list[TranscriptionWord], float]:
+        """Word timings for the joined narration. The narration text is known, so the alignment
+        backend matches it to each scene's audio locally instead of recognising the speech again.
+
+        Returns:
+            list[TranscriptionWord]: timed words on the video's timeline
+            float: cost of the transcription, nothing for local alignment
+        """
+        if transcription_backend == TRANSCRIPTION_BACKENDS.alignment:
+            scenes = [self.audio_engine.concatenate_narrations([self.narration_source(key)])
+                      for key in self.narration_artifacts]
+            return align_narrations(scenes, self.narrations, self.audio_engine.fps), 0.0
+        return self.transcribe_audio(narration)
+
+    def render_output(self, video : VideoClip, narration : np.ndarray, transcription_words : list[TranscriptionWord],
+                      output_path : str | None, caption_backend : CAPTION_BACKENDS, progress_stage : str = "encoding",
+                      soundtrack : AudioArrayClip | None = None) -> str:
+        """Adds captions laid out for the video's size and background music, then encodes it. The music is
+        mixed here unless soundtrack, an already mixed one from mix_background_music, is given.
+
+        Returns:
+            str: filepath to the completed video
+        """
+        ffmpeg_params = None
+        if caption_backend == CAPTION_BACKENDS.ass:
+            ffmpeg_params = self.burn_in_captions(transcription_words, video.size)
+        elif caption_backend == CAPTION_BACKENDS.sprites:
+            video = StaticCaptionedClip(video, transcription_words, self.scene_segments)
+        else:
+            video = add_captions_helper(transcription_words, video)
 
         # add background music if selected 
-        if self.video_spec.background_music:
+        if soundtrack is not None:
+            video = video.set_audio(soundtrack)
+        elif self.video_spec.background_music:
             print("adding background music...")
-            video = self.add_background_music(video)
+            video = self.add_background_music(video, narration)
         
-        return self.save_video_file(video, output_filename=output_path), cost
+        return self.save_video_file(video, output_filename=output_path, ffmpeg_params=ffmpeg_params, progress_stage=progress_stage)
 
-    def generate_montage_clip(self, image_path: str, narration_path: str, narration_text: str) -> str:
+    def narration_source(self, key : str) -> str | np.ndarray:
+        """Raw samples for narrations kept as PCM, otherwise a path to the encoded narration."""
+        if self.artifacts.get(key).suffix == ".npy":
+            return self.artifacts.get_array(key)
+        return self.artifacts.get_path(key)
+
+    def release_clips(self):
+        """Drops the intermediate clips once the timeline they make up has been written."""
+        for key in self.clip_artifacts:
+            self.artifacts.release(key)
+        self.clip_artifacts = []
+
+    def generate_montage_clip(self, image_path: str | np.ndarray, narration_path: str | np.ndarray, narration_text: str,
+                              include_audio : bool = True, n_frames : int | None = None) -> str:
         """
         Given an image filepath and narration audio file, generates a video
         whose length matches the narration audio. The video displays the image
         with a slow Ken Burns zoom effect and overlays the narration text as a caption.
         
         Args:
-            image_path (str): Path to an image file (e.g., 'myphoto.jpg').
-            narration_path (str): Path to an MP3 (or other audio) file containing narration.
+            image_path (str | np.ndarray): Path to an image file (e.g., 'myphoto.jpg') or a decoded RGB image.
+            narration_path (str | np.ndarray): Path to an MP3 (or other audio) file containing narration, or its samples at AUDIO_FPS.
             narration_text (str): A string of text to overlay as a caption.
+            include_audio (bool): Whether to mux the narration into the clip.
+            n_frames (int | None): Length of the clip in VIDEO_FPS frames, the narration's length if None.
 
         Returns:
             str: The filepath to the completed clip (e.g., 'montage_<uuid>.mp4').
         """
 
         # 1) Load the narration audio to determine clip duration
-        audio_clip = AudioFileClip(narration_path)
+        if isinstance(narration_path, np.ndarray):
+            audio_clip = self.audio_engine.to_audio_clip(to_stereo(narration_path))
+        else:
+            audio_clip = AudioFileClip(narration_path)
         clip_duration = audio_clip.duration
+        if n_frames is not None:
+            # moviepy writes a frame for every multiple of 1 / fps below the duration, half a frame short
+            # of n_frames / fps writes exactly n_frames whatever the float rounding
+            clip_duration = (n_frames - .5) / VIDEO_FPS
 
         # 2) Create an ImageClip from the image, with the same duration
         base_clip = ImageClip(image_path).set_duration(clip_duration)
@@ -178,10 +703,12 @@ class MontageGenerator(VideoGenerator):
 
         # 6) Set the audio track to the narration audio
         #    (replace any existing audio with your narration)
-        final_clip = final_clip.set_audio(audio_clip)
+        if include_audio:
+            final_clip = final_clip.set_audio(audio_clip)
 
         # 7) Write out the final MP4
-        output_filename = f"{CLIPS_FILEPATH}_{uuid.uuid4()}.mp4"
+        clip_key, output_filename = self.artifacts.new_path(".mp4")
+        self.clip_artifacts.append(clip_key)
         self.save_video_file(final_clip, output_filename=output_filename)
         # Clean up to release resources
         final_clip.close()
@@ -191,18 +718,60 @@ class MontageGenerator(VideoGenerator):
 
         return output_filename
 
-    def generate_narrations_from_script(self) -> float:
+    def generate_narrations_from_script(self, audio_mode : AUDIO_MODES = AUDIO_MODES.mp3, batch : bool = False,
+                                        use_cache : bool = False) -> float:
         """Generates narrations for each clip
+
+        Args:
+            audio_mode (AUDIO_MODES): pcm keeps narrations as raw samples until the final mux
+            batch (bool): synthesize consecutive narrations together in as few TTS requests as fit, see
+                generate_narration_batch. Narrations are then kept as raw samples whatever the audio_mode
+            use_cache (bool): reuse narrations kept in NARRATION_CACHE_FILEPATH and keep the new ones there,
+                so a preview of this script can use them without API calls
         Returns:
             float of total cost of the narrations
         """
+        if batch:
+            return self.generate_batched_narrations(use_cache)
         out = []
         total_cost = 0.0
-        for narration in self.narrations:
-            narration_filepath, cost = generate_narration_audio(narration)
-            out.append(narration_filepath)
-            total_cost += cost
-        self.set_narration_filepaths(out)
+        with get_progress_reporter().stage("narrations", total=len(self.narrations), unit="scenes") as progress:
+            for narration in self.narrations:
+                if audio_mode == AUDIO_MODES.pcm:
+                    samples, cost = generate_narration_pcm(narration, self.audio_engine.fps, use_cache)
+                    out.append(self.artifacts.put_array(samples))
+                else:
+                    audio, cost = generate_narration_bytes(narration, use_cache=use_cache)
+                    out.append(self.artifacts.put_bytes(audio, ".mp3"))
+                total_cost += cost
+                progress.advance()
+        self.narration_artifacts = out
+        return total_cost
+
+    def generate_batched_narrations(self, use_cache : bool = False) -> float:
+        """Generates the narrations in batches of consecutive scenes up to the TTS input limit, a few
+        batches at a time, and splits each batch's audio back into one narration per scene
+
+        Returns:
+            float of total cost of the narrations
+        """
+        batches = pack_narration_batches(self.narrations)
+        print(f"synthesizing {len(self.narrations)} narrations in {len(batches)} requests...")
+        out : list[str] = [""] * len(self.narrations)
+        total_cost = 0.0
+        with get_progress_reporter().stage("narrations", total=len(self.narrations), unit="scenes") as progress, \
+                ThreadPoolExecutor(max_workers=min(TTS_BATCH_CONCURRENCY, len(batches))) as executor:
+            # copies of this context so the requests are recorded against the current run
+            futures = {executor.submit(contextvars.copy_context().run, generate_narration_batch,
+                                       [self.narrations[i] for i in indices], self.audio_engine.fps, use_cache) : indices
+                       for indices in batches}
+            for future in as_completed(futures):
+                samples, cost = future.result()
+                for i, scene_samples in zip(futures[future], samples):
+                    out[i] = self.artifacts.put_array(scene_samples)
+                total_cost += cost
+                progress.advance(len(futures[future]))
+        self.narration_artifacts = out
         return total_cost
 
     def generate_images_from_script(self) -> float:
@@ -210,26 +779,98 @@ class MontageGenerator(VideoGenerator):
         Returns:
             float: total cost of creating images
         """
+        self.image_artifacts, total_cost = self.generate_image_artifacts()
+        return total_cost
+
+    def generate_image_artifacts(self, video_spec : VideoSpec | None = None) -> tuple[list[str], float]:
+        """Generates one image per image prompt in the style and with the model of video_spec. A prompt
+        nearly the same as an earlier prompt of the script gets a mirrored crop of its image, and one
+        nearly the same as the prompt of a kept image reuses that image, instead of a new generation
+
+        Returns:
+            list[str]: artifact key of each scene's image
+            float: total cost of creating images
+        """
         out = []
         image = None
         total_cost = 0.0
-        for prompt in self.image_prompts:
-            if image:
-                image, cost = self.generate_image(prompt, image)
-                total_cost += cost
-                out.append(image)
-            else:
-                image, cost = self.generate_image(prompt)
-                total_cost += cost
-                out.append(image)
-        self.set_image_filepaths(out)
-        return total_cost
+        video_spec = video_spec or self.video_spec
+        image_set = image_set_name(video_spec.visual_art_style, video_spec.image_model_name, video_spec.get_image_aspect_ratio())
+        script_index = PromptIndex()
+        saved = 0
+        with get_progress_reporter().stage(f"images ({video_spec.visual_art_style.value})", total=len(self.image_prompts), unit="images") as progress:
+            for prompt in self.image_prompts:
+                similar = self.similar_image(prompt, image_set, script_index)
+                if similar is not None:
+                    image, derived = similar
+                    saved += 1
+                else:
+                    derived = False
+                    if image:
+                        image, cost = self.generate_image_bytes(prompt, image, video_spec)
+                    else:
+                        image, cost = self.generate_image_bytes(prompt, video_spec=video_spec)
+                    total_cost += cost
+                key = self.artifacts.put_bytes(image, "." + DEFAULT_IMAGE_FORMAT)
+                if not derived:
+                    script_index.add([{"prompt" : prompt, "image" : key, "image_set" : image_set}])
+                out.append(key)
+                progress.advance()
+        if saved:
+            print(f"reused images for {saved} of {len(self.image_prompts)} prompts instead of generating them")
+        self.image_generations_saved += saved
+        return out, total_cost
+
+    def similar_image(self, prompt : str, image_set : str, script_index : PromptIndex) -> tuple[bytes, bool] | None:
+        """An image for prompt from a similar prompt earlier in the script, derived so the scene does not
+        repeat the same frame, or else from a similar prompt of an image kept for this topic (any topic
+        with image_reuse_across_topics, none without a topic)
+
+        Returns:
+            bytes: the encoded image
+            bool: whether it was derived from the earlier image
+        """
+        if self.image_reuse_threshold is None:
+            return None
+        match = script_index.find(prompt, image_set, self.image_reuse_threshold)
+        if match:
+            return derive_image(self.artifacts.get_bytes(match[0]["image"])), True
+        if self.topic is None and not self.image_reuse_across_topics:
+            return None
+        match = get_image_prompt_index().find(prompt, image_set, self.image_reuse_threshold,
+                                              None if self.image_reuse_across_topics else self.topic)
+        if match:
+            with open(match[0]["image"], "rb") as f:
+                return f.read(), False
+        return None
     
+    def keep_images(self, directory : str = IMAGE_FILEPATH) -> list[str]:
+        """Copies the generated images out of the artifact store, named by their content so an
+        image generated again is stored once
+
+        Returns:
+            list[str]: path of each scene's image in directory
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for key in self.image_artifacts:
+            data = self.artifacts.get_bytes(key)
+            path = os.path.join(directory, hashlib.sha256(data).hexdigest() + self.artifacts.get(key).suffix)
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(data)
+            paths.append(path)
+        # so later scripts can reuse them for similar prompts
+        image_set = image_set_name(self.video_spec.visual_art_style, self.video_spec.image_model_name, self.video_spec.get_image_aspect_ratio())
+        get_image_prompt_index().add([{"prompt" : prompt, "image" : os.path.abspath(path), "image_set" : image_set, "topic" : self.topic}
+                                      for prompt, path in zip(self.image_prompts, paths)])
+        return paths
+
     def set_narration_filepaths(self, narration_filepaths : list[str]):
-        self.narration_filepaths = narration_filepaths
+        self.narration_artifacts = [self.artifacts.put_file(path) for path in narration_filepaths]
 
     def set_image_filepaths(self, image_filepaths : list[str]):
-        self.image_filepaths = image_filepaths
+        self.image_artifacts = [self.artifacts.put_file(path) for path in image_filepaths]
 
 
 if __name__ == "__main__":
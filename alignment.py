@@ -0,0 +1,128 @@
+from constants import *
+from captions import TranscriptionWord
+import numpy as np
+import re
+
+# pause weight, in syllables, added after words ending a clause or sentence
+PUNCTUATION_PAUSES = {",": .75, ";": 1.0, ":": 1.0, ".": 1.5, "!": 1.5, "?": 1.5}
+
+
+def syllable_estimate(word : str) -> float:
+    """Rough spoken length of a word in syllables, digits counted as about one syllable each."""
+    lowered = word.lower()
+    if any(c.isdigit() for c in lowered):
+        return max(1.0, sum(c.isdigit() for c in lowered) * .9)
+    groups = len(re.findall(r"[aeiouy]+", lowered))
+    # a silent final e, but not the syllabic "-le" of words like "battle"
+    if lowered.endswith("e") and groups > 1 and not re.search(r"[^aeiouy]le$", lowered):
+        groups -= 1
+    return float(max(1, groups))
+
+
+def tokenize_narration(text : str) -> list[tuple[str, float]]:
+    """Splits narration text into words as Whisper reports them (no punctuation), with the weight
+    of each word: its syllable estimate plus any pause implied by trailing punctuation."""
+    tokens = []
+    for raw in text.split():
+        word = re.sub(r"[^\w'’-]", "", raw)
+        if not word:
+            continue
+        pause = PUNCTUATION_PAUSES.get(raw.rstrip("\"')]”’")[-1:], 0.0)
+        tokens.append((word, syllable_estimate(word) + pause))
+    return tokens
+
+
+def frame_energy(samples : np.ndarray, fps : int, hop_seconds : float) -> np.ndarray:
+    """RMS level in dB of consecutive hop_seconds frames of a mono or stereo buffer."""
+    mono = samples.mean(axis=1) if samples.ndim == 2 else samples
+    hop = max(1, int(hop_seconds * fps))
+    n_frames = max(1, len(mono) // hop)
+    frames = mono[:n_frames * hop].reshape(n_frames, hop) if len(mono) >= hop else mono[None, :]
+    rms = np.sqrt((frames.astype(np.float64) ** 2).mean(axis=1))
+    return 20 * np.log10(rms + 1e-9)
+
+
+def align_words(samples : np.ndarray, text : str, fps : int = AUDIO_FPS, offset : float = 0.0,
+                hop_seconds : float = .01, snap_seconds : float = .25) -> list[TranscriptionWord]:
+    """Computes word timings for audio whose exact text is known, without a speech recognizer
+
+    Voiced frames are found with an adaptive energy threshold, the words are spread over the voiced
+    time in proportion to their estimated spoken length, and each boundary between words is then
+    moved to a nearby pause, or failing that to the quietest frame near it.
+
+    Args:
+        samples (np.ndarray): narration samples, mono or stereo
+        text (str): the narration text that was synthesized
+        fps (int): sample rate of samples
+        offset (float): seconds added to every timestamp, the start of this narration in the video
+        hop_seconds (float): analysis frame length
+        snap_seconds (float): how far a word boundary may move towards a quieter frame
+
+    Returns:
+        list[TranscriptionWord]: one entry per word, in the same format as Whisper's word timestamps
+    """
+    tokens = tokenize_narration(text)
+    if not tokens:
+        return []
+    energy = frame_energy(samples, fps, hop_seconds)
+
+    floor, peak = np.percentile(energy, 10), np.percentile(energy, 95)
+    voiced = energy > floor + .3 * (peak - floor)
+    if not voiced.any():
+        voiced[:] = True
+    voiced_idx = np.flatnonzero(voiced)
+    first, last = voiced_idx[0], voiced_idx[-1] + 1
+
+    # cumulative voiced time inside the speech span, words are laid out on this axis
+    voiced_time = np.concatenate([[0], np.cumsum(voiced[first:last])]).astype(np.float64)
+    weights = np.array([w for _, w in tokens])
+    targets = np.concatenate([[0], np.cumsum(weights)]) / weights.sum() * voiced_time[-1]
+    boundaries = first + np.searchsorted(voiced_time, targets, side="left").astype(np.int64)
+    boundaries[0], boundaries[-1] = first, last
+
+    # pauses inside the speech span, as (first, last) unvoiced frame of each run
+    edges = np.flatnonzero(np.diff(voiced[first:last].astype(np.int8))) + first + 1
+    gaps = list(zip(edges[::2], edges[1::2]))
+
+    snap = max(1, int(snap_seconds / hop_seconds))
+    for i in range(1, len(boundaries) - 1):
+        target = boundaries[i]
+        # a pause near the estimate is the most likely word boundary, each pause is used once
+        nearby = [(abs((a + b) // 2 - target), (a + b) // 2) for a, b in gaps
+                  if boundaries[i - 1] < (a + b) // 2 and abs((a + b) // 2 - target) <= snap]
+        if nearby:
+            boundaries[i] = min(nearby)[1]
+            continue
+        lo = max(boundaries[i - 1] + 1, target - snap)
+        hi = min(last - 1, target + snap)
+        if lo < hi:
+            # otherwise the quietest voiced frame, the dip between two run-together words
+            window = np.where(voiced[lo:hi + 1], energy[lo:hi + 1], np.inf)
+            if np.isfinite(window).any():
+                boundaries[i] = lo + int(np.argmin(window))
+    boundaries = np.maximum.accumulate(np.clip(boundaries, first, last))
+
+    words : list[TranscriptionWord] = []
+    for i, (word, _) in enumerate(tokens):
+        start, end = boundaries[i], boundaries[i + 1]
+        # silence around a word belongs to the pause, not the word
+        while start < end - 1 and not voiced[start]:
+            start += 1
+        while end - 1 > start and not voiced[end - 1]:
+            end -= 1
+        words.append({
+            "start" : float(offset + start * hop_seconds),
+            "end" : float(offset + max(end, start + 1) * hop_seconds),
+            "word" : word
+        })
+    return words
+
+
+def align_narrations(narrations : list[np.ndarray], texts : list[str], fps : int = AUDIO_FPS) -> list[TranscriptionWord]:
+    """Aligns consecutive narrations and returns word timings on the joined timeline."""
+    words : list[TranscriptionWord] = []
+    offset = 0.0
+    for samples, text in zip(narrations, texts):
+        words.extend(align_words(samples, text, fps, offset))
+        offset += len(samples) / fps
+    return words
@@ -0,0 +1,118 @@
+from typing import List
+from PIL import ImageColor
+from captions import TranscriptionWord, layout_captions, load_font
+from constants import CAPTION_FONT_FILEPATH, CAPTION_FONT_SIZE, CAPTION_STROKE_WIDTH, CAPTION_MARGIN_BOTTOM, CAPTION_PADDING, FONTS_FILEPATH
+import os
+
+
+def ass_timestamp(seconds: float) -> str:
+    """Format seconds as an ASS H:MM:SS.cc timestamp."""
+    centiseconds = int(round(max(seconds, 0) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+
+def ass_color(color: str | tuple, opacity: float = 1.0) -> str:
+    """Convert a PIL color name or RGB tuple and an opacity to an ASS &HAABBGGRR color."""
+    r, g, b = ImageColor.getrgb(color)[:3] if isinstance(color, str) else color[:3]
+    alpha = int(round((1 - opacity) * 255))
+    return f"&H{alpha:02X}{b:02X}{g:02X}{r:02X}"
+
+
+def escape_ass_text(text: str) -> str:
+    """Remove characters libass would interpret as override tags."""
+    return text.replace("\\", "").replace("{", "").replace("}", "")
+
+
+def escape_filter_path(path: str) -> str:
+    """Escape a path for use as an ffmpeg filter option value."""
+    return os.path.abspath(path).replace("\\", "/").replace(":", "\\:").replace("'", "\\'")
+
+
+def write_ass_captions(
+    transcription_words: List[TranscriptionWord],
+    video_size: tuple[int, int],
+    output_path: str,
+    font_path: str = CAPTION_FONT_FILEPATH,
+    font_size: int = CAPTION_FONT_SIZE,
+    font_color: str = "white",
+    stroke_color: str = "black",
+    stroke_width: int = CAPTION_STROKE_WIDTH,
+    margin_bottom: int = CAPTION_MARGIN_BOTTOM,
+    background_color: tuple = (0, 0, 0),
+    background_opacity: float = 0.6,
+    padding: int = CAPTION_PADDING,
+) -> str:
+    """
+    Writes the same word by word captions as captions.add_captions_helper to an ASS subtitle
+    file, so they can be rasterized by libass inside ffmpeg instead of in python frame callbacks.
+    Every word gets a semi-transparent box drawn on layer 0 and stroked text on layer 1,
+    positioned with the same layout as the moviepy backend.
+
+    Args:
+        transcription_words (List[TranscriptionWord]): List of transcribed words.
+        video_size (tuple[int, int]): Width and height of the video the captions are burned into.
+        output_path (str): Where to write the .ass file.
+        font_path (str): Path to the font file, its directory is passed to libass as fontsdir.
+        font_size (int): Font size in pixels, as used by PIL.
+        font_color (str): Text color.
+        stroke_color (str): Text stroke color.
+        stroke_width (int): Width of the text stroke.
+        margin_bottom (int): Distance from the bottom of the video.
+        background_color (tuple): RGB color for background box.
+        background_opacity (float): Opacity of background box (0 to 1).
+        padding (int): Padding around the text inside the background box.
+
+    Returns:
+        str: output_path
+    """
+    pil_font = load_font(font_path, font_size)
+    font_name = pil_font.getname()[0]
+    # libass sizes fonts by ascent + descent rather than by em size like PIL
+    ascent, descent = pil_font.getmetrics()
+    ass_font_size = ascent + descent
+
+    width, height = video_size
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+        "Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: Caption,{font_name},{ass_font_size},{ass_color(font_color)},{ass_color(font_color)},"
+        f"{ass_color(stroke_color)},&HFF000000,0,0,0,0,100,100,0,0,1,{stroke_width},0,7,0,0,0,1",
+        f"Style: Box,{font_name},{ass_font_size},{ass_color(background_color, background_opacity)},"
+        f"{ass_color(background_color, background_opacity)},&HFF000000,&HFF000000,0,0,0,0,100,100,0,0,1,0,0,7,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+
+    for placement in layout_captions(transcription_words, video_size, pil_font, margin_bottom, padding):
+        start = ass_timestamp(placement["start"])
+        end = ass_timestamp(placement["start"] + placement["duration"])
+        x, y = placement["x"], placement["y"]
+        w, h = placement["box_width"], placement["box_height"]
+        lines.append(f"Dialogue: 0,{start},{end},Box,,0,0,0,,{{\\an7\\pos({x},{y})\\p1}}m 0 0 l {w} 0 {w} {h} 0 {h}{{\\p0}}")
+        lines.append(f"Dialogue: 1,{start},{end},Caption,,0,0,0,,{{\\an7\\pos({x},{y})}}{escape_ass_text(placement['word'])}")
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return output_path
+
+
+def burn_in_ffmpeg_params(ass_path: str, fonts_dir: str = FONTS_FILEPATH, offset: float = 0.0) -> list[str]:
+    """ffmpeg output parameters that burn an ASS file into the video while it is being encoded.
+    offset is the time in the captions' timeline of the first frame, for encoding part of a video."""
+    subtitles = f"subtitles=filename='{escape_filter_path(ass_path)}':fontsdir='{escape_filter_path(fonts_dir)}'"
+    if offset:
+        subtitles = f"setpts=PTS+{offset}/TB,{subtitles},setpts=PTS-STARTPTS"
+    return ["-vf", subtitles]
@@ -0,0 +1,62 @@
+"""
+Compares the moviepy, ASS/libass and static sprite caption backends on the same synthetic video.
+
+Usage (from the repository root):
+    python -m benchmarks.caption_backends --duration 30 --format tiktok
+"""
+from constants import *
+from captions import add_captions_helper, load_transcription_words, TranscriptionWord
+from ass_captions import write_ass_captions, burn_in_ffmpeg_params
+from static_frames import StaticCaptionedClip
+from moviepy.editor import ColorClip
+import argparse
+import tempfile
+import time
+import os
+
+
+def synthetic_words(duration : float, source_path : str = "transcription_words.json") -> list[TranscriptionWord]:
+    """Repeats the sample transcription until it covers duration seconds."""
+    source = load_transcription_words(source_path)
+    span = source[-1]["end"]
+    words : list[TranscriptionWord] = []
+    offset = 0.0
+    while offset < duration:
+        for w in source:
+            if w["start"] + offset >= duration:
+                break
+            words.append({"start" : w["start"] + offset, "end" : min(w["end"] + offset, duration), "word" : w["word"]})
+        offset += span
+    return words
+
+
+def render(backend : CAPTION_BACKENDS, words : list[TranscriptionWord], size : tuple[int, int], duration : float, output_dir : str) -> float:
+    """Renders the captioned video with one backend and returns the wall clock time in seconds."""
+    video = ColorClip(size, color=(40, 90, 140), duration=duration)
+    output_path = os.path.join(output_dir, f"{backend.value}.mp4")
+    started = time.perf_counter()
+    ffmpeg_params = None
+    if backend == CAPTION_BACKENDS.ass:
+        ffmpeg_params = burn_in_ffmpeg_params(write_ass_captions(words, size, os.path.join(output_dir, "captions.ass")))
+    elif backend == CAPTION_BACKENDS.sprites:
+        # the synthetic video is one still scene
+        video = StaticCaptionedClip(video, words, [(0.0, duration)])
+    else:
+        video = add_captions_helper(words, video)
+    video.write_videofile(output_path, fps=24, codec="libx264", ffmpeg_params=ffmpeg_params, verbose=False, logger=None)
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30.0, help="length of the synthetic video in seconds")
+    parser.add_argument("--format", choices=[f.value for f in OUTPUT_FORMATS], default=OUTPUT_FORMATS.tiktok.value)
+    args = parser.parse_args()
+
+    size = OUTPUT_RESOLUTIONS[args.format]
+    words = synthetic_words(args.duration)
+    with tempfile.TemporaryDirectory() as output_dir:
+        print(f"{len(words)} words, {args.duration:.0f}s at {size[0]}x{size[1]}")
+        for backend in CAPTION_BACKENDS:
+            elapsed = render(backend, words, size, args.duration, output_dir)
+            print(f"{backend.value:>8}: {elapsed:7.2f}s ({args.duration * 24 / elapsed:6.1f} frames/s)")
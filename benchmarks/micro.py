@@ -0,0 +1,307 @@
+"""
+Micro-benchmarks for the CPU hot paths of captioning and compositing, checked against the stored
+budgets in benchmarks/budgets.json. Exits with status 1 when a benchmark's median time exceeds its
+budget, or when per frame caption cost grows faster with the word count than its scaling budget allows.
+A benchmark or scaling family measured without a budget also fails, so every benchmark that runs is
+checked: baseline it on a machine that can run it with --update-budgets.
+
+Usage (from the repository root):
+    python -m benchmarks.micro                      # run everything and check the budgets
+    python -m benchmarks.micro -k get_frame         # only benchmarks whose name contains get_frame
+    python -m benchmarks.micro --update-budgets     # store the current medians times --headroom as budgets
+    python -m benchmarks.micro -k caption_composite --update-budgets  # baseline only some benchmarks
+
+Budgets are wall clock seconds per operation and depend on the machine, update them when
+moving the suite to different hardware rather than loosening them to hide a regression.
+"""
+from constants import *
+from captions import measure_text, layout_captions, load_font, add_captions_helper, TranscriptionWord
+from static_frames import StaticCaptionedClip
+from ffmpeg_tools import run_ffmpeg
+from ContentSpecs import VideoSpec
+from VideoGenerator import VideoGenerator
+from benchmarks.caption_backends import synthetic_words
+from benchmarks.parallel_render import synthetic_scenes
+from moviepy.editor import ImageClip, ColorClip
+from typing import Callable, Any
+import AudioEngine
+import numpy as np
+import statistics
+import argparse
+import tempfile
+import math
+import json
+import time
+import sys
+import os
+
+BUDGETS_FILEPATH = os.path.join(os.path.dirname(__file__), "budgets.json")
+
+WORD_COUNTS = [100, 1000, 5000]
+
+
+class MicroBenchmark:
+    """
+    One timed operation. setup builds its inputs outside the timing and returns the state passed to
+    run, which is the operation measured, and to teardown. A setup raising SkipBenchmark skips it
+    on this machine.
+    """
+
+    def __init__(self, name : str, setup : Callable[[], Any], run : Callable[[Any], Any],
+                 teardown : Callable[[Any], Any] | None = None, words : int | None = None):
+        """
+        :param name: Unique name, the key of its budget.
+        :param setup: Builds the inputs, untimed.
+        :param run: The operation timed, called with setup's result.
+        :param teardown: Releases what setup created, untimed.
+        :param words: Caption word count, for benchmarks checked for scaling.
+        """
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.teardown = teardown
+        self.words = words
+
+
+class SkipBenchmark(Exception):
+    """
+    Raised by a benchmark's setup when it cannot run here, e.g. a missing system dependency.
+    """
+
+    def __init__(self, message: str):
+        """
+        :param message: Why the benchmark was skipped.
+        """
+        super().__init__(message)
+
+
+def time_benchmark(benchmark : MicroBenchmark, rounds : int, min_round_seconds : float) -> list[float]:
+    """Times the benchmark in rounds of enough calls to last min_round_seconds
+
+    Returns:
+        list[float]: seconds per call in each round
+    """
+    state = benchmark.setup()
+    try:
+        # calibrate the calls per round, the first call also warms caches
+        started = time.perf_counter()
+        benchmark.run(state)
+        once = max(time.perf_counter() - started, 1e-7)
+        number = max(1, int(min_round_seconds / once))
+        results = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for _ in range(number):
+                benchmark.run(state)
+            results.append((time.perf_counter() - started) / number)
+    finally:
+        if benchmark.teardown:
+            benchmark.teardown(state)
+    return results
+
+
+# Inputs
+
+def caption_words(n_words : int) -> list[TranscriptionWord]:
+    """The first n_words of the sample transcription repeated end to end."""
+    words = synthetic_words(n_words * 2.0)
+    while len(words) < n_words:
+        words = synthetic_words(words[-1]["end"] * 2)
+    return words[:n_words]
+
+
+def still_video(words : list[TranscriptionWord], output_dir : str) -> ImageClip:
+    """A generated scene image, as long as the captions."""
+    size = OUTPUT_RESOLUTIONS[OUTPUT_FORMATS.tiktok]
+    paths, _ = synthetic_scenes(1, words[-1]["end"], size, output_dir)
+    return ImageClip(paths[0]).set_duration(words[-1]["end"])
+
+
+def frame_times(duration : float, n_frames : int = 48) -> list[float]:
+    """Consecutive frame times from the middle of the video, as an encoder asks for them."""
+    start = duration / 2
+    return [min(duration, start + i / VIDEO_FPS) for i in range(n_frames)]
+
+
+# Benchmarks
+
+def measure_text_benchmark() -> MicroBenchmark:
+    font = load_font(CAPTION_FONT_FILEPATH, CAPTION_FONT_SIZE)
+    return MicroBenchmark("measure_text", lambda: font, lambda font: measure_text("Stalingrad", font))
+
+
+def layout_benchmark(n_words : int) -> MicroBenchmark:
+    def setup():
+        return caption_words(n_words), OUTPUT_RESOLUTIONS[OUTPUT_FORMATS.tiktok], load_font(CAPTION_FONT_FILEPATH, CAPTION_FONT_SIZE)
+    return MicroBenchmark(f"layout_captions[{n_words}]", setup, lambda state: layout_captions(*state), words=n_words)
+
+
+def composite_get_frame_benchmark(n_words : int, output_dir : str) -> MicroBenchmark:
+    """get_frame of the moviepy caption composite built by add_captions_helper, per frame."""
+    def setup():
+        words = caption_words(n_words)
+        try:
+            video = add_captions_helper(words, still_video(words, output_dir))
+        except OSError as e:
+            # TextClip needs ImageMagick
+            raise SkipBenchmark(str(e).splitlines()[0])
+        return video, frame_times(video.duration)
+    def run(state):
+        video, times = state
+        for t in times:
+            video.get_frame(t)
+    return MicroBenchmark(f"caption_composite.get_frame[{n_words}]", setup, run, words=n_words)
+
+
+def sprites_get_frame_benchmark(n_words : int, output_dir : str) -> MicroBenchmark:
+    """get_frame of the sprite captioned still scene, per frame."""
+    def setup():
+        words = caption_words(n_words)
+        video = still_video(words, output_dir)
+        return StaticCaptionedClip(video, words, [(0.0, video.duration)]), frame_times(video.duration)
+    def run(state):
+        video, times = state
+        for t in times:
+            video.get_frame(t)
+    return MicroBenchmark(f"sprites.get_frame[{n_words}]", setup, run, words=n_words)
+
+
+def compile_clips_benchmark(n_scenes : int, output_dir : str) -> MicroBenchmark:
+    """Joins n_scenes short clips and reads one frame from each, as playback does."""
+    def setup():
+        paths = []
+        for i in range(n_scenes):
+            path = os.path.join(output_dir, f"clip_{n_scenes}_{i}.mp4")
+            run_ffmpeg(["-f", "lavfi", "-i", f"color=c=0x{i * 2654435761 % 0xFFFFFF:06x}:s=96x160:r={VIDEO_FPS}:d=0.25",
+                        "-c:v", "libx264", "-pix_fmt", "yuv420p", path])
+            paths.append(path)
+        return VideoGenerator(None, None), paths #type: ignore
+    def run(state):
+        generator, paths = state
+        video = generator.compile_clips(paths)
+        try:
+            for start in video.starts[:-1]:
+                video.get_frame(start + .05)
+        finally:
+            video.close()
+    return MicroBenchmark(f"compile_clips[{n_scenes}]", setup, run, lambda state: state[0].close())
+
+
+def background_music_benchmark(seconds : float, duck_music : bool) -> MicroBenchmark:
+    """add_background_music over seconds of narration, with a synthetic track standing in for a
+    missing music file so the mix itself is what is measured."""
+    music = BACKGROUND_MUSIC.good_night_lofi
+    def setup():
+        generator = VideoGenerator(None, VideoSpec(CONTENT_TYPES.montage, CONTENT_TONES.historian, OUTPUT_FORMATS.tiktok, #type: ignore
+                                                   seconds, VISUAL_ART_STYLES.comic_book, background_music=music))
+        generator.audio_engine.duck_music = duck_music
+        if not os.path.isfile(f"{BACKGROUND_MUSIC_FILEPATH}/{music.value}"):
+            track = (np.random.default_rng(0).standard_normal((AUDIO_FPS * 90, 2)) * .1).astype(np.float32)
+            track.setflags(write=False)
+            AudioEngine._music_cache[(music.value, AUDIO_FPS)] = track
+        narration = (np.random.default_rng(1).standard_normal((int(seconds * AUDIO_FPS), 2)) * .2).astype(np.float32)
+        video = ColorClip((96, 160), color=(0, 0, 0), duration=seconds)
+        return generator, video, narration
+    def run(state):
+        generator, video, narration = state
+        generator.add_background_music(video, narration)
+    return MicroBenchmark(f"add_background_music[{seconds:.0f}s{', ducked' if duck_music else ''}]", setup, run,
+                          lambda state: state[0].close())
+
+
+def all_benchmarks(output_dir : str) -> list[MicroBenchmark]:
+    return [
+        measure_text_benchmark(),
+        *[layout_benchmark(n) for n in WORD_COUNTS],
+        *[composite_get_frame_benchmark(n, output_dir) for n in WORD_COUNTS],
+        *[sprites_get_frame_benchmark(n, output_dir) for n in WORD_COUNTS],
+        compile_clips_benchmark(100, output_dir),
+        background_music_benchmark(180, duck_music=False),
+        background_music_benchmark(180, duck_music=True),
+    ]
+
+
+# Budgets
+
+def scaling_exponent(times : dict[int, float]) -> float | None:
+    """k in time ~ words ** k, from the smallest and largest word counts measured."""
+    if len(times) < 2:
+        return None
+    low, high = min(times), max(times)
+    return math.log(times[high] / times[low]) / math.log(high / low)
+
+
+def check_budgets(medians : dict[str, float], scaling : dict[str, float], budgets : dict) -> list[str]:
+    """Every budget exceeded, and every measurement without a budget, as messages."""
+    failures = []
+    for name, median in medians.items():
+        budget = budgets.get("seconds", {}).get(name)
+        if budget is None:
+            failures.append(f"{name}: no budget, measured {median * 1e3:.3f}ms")
+        elif median > budget:
+            failures.append(f"{name}: {median * 1e3:.3f}ms over its {budget * 1e3:.3f}ms budget")
+    for family, exponent in scaling.items():
+        budget = budgets.get("max_scaling_exponent", {}).get(family)
+        if budget is None:
+            failures.append(f"{family}: no scaling budget, cost grows as words^{exponent:.2f}")
+        elif exponent > budget:
+            failures.append(f"{family}: cost grows as words^{exponent:.2f}, budget is words^{budget:.2f}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-round-seconds", type=float, default=.2)
+    parser.add_argument("--budgets", default=BUDGETS_FILEPATH)
+    parser.add_argument("--update-budgets", action="store_true", help="write the measured medians times --headroom as the budgets")
+    parser.add_argument("--headroom", type=float, default=2.0)
+    parser.add_argument("--scaling-headroom", type=float, default=.2, help="added to measured scaling exponents stored as budgets")
+    args = parser.parse_args()
+
+    with open(args.budgets) as f:
+        budgets = json.load(f)
+
+    medians : dict[str, float] = {}
+    skipped : list[str] = []
+    per_word_count : dict[str, dict[int, float]] = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for benchmark in all_benchmarks(output_dir):
+            if args.filter not in benchmark.name:
+                continue
+            try:
+                results = time_benchmark(benchmark, args.rounds, args.min_round_seconds)
+            except SkipBenchmark as e:
+                print(f"{benchmark.name:<42} skipped: {e}")
+                skipped.append(benchmark.name)
+                continue
+            median = statistics.median(results)
+            medians[benchmark.name] = median
+            budget = budgets.get("seconds", {}).get(benchmark.name)
+            print(f"{benchmark.name:<42} median {median * 1e3:10.3f}ms  min {min(results) * 1e3:10.3f}ms"
+                  + (f"  budget {budget * 1e3:10.3f}ms" if budget is not None else ""))
+            if benchmark.words is not None:
+                per_word_count.setdefault(benchmark.name.split("[")[0], {})[benchmark.words] = median
+
+    scaling = {family : exponent for family, times in per_word_count.items()
+               if (exponent := scaling_exponent(times)) is not None}
+    for family, exponent in scaling.items():
+        print(f"{family:<42} scales as words^{exponent:.2f}")
+
+    if args.update_budgets:
+        budgets.setdefault("seconds", {}).update({name : round(median * args.headroom, 7) for name, median in medians.items()})
+        budgets.setdefault("max_scaling_exponent", {}).update(
+            {family : round(exponent + args.scaling_headroom, 2) for family, exponent in scaling.items()})
+        with open(args.budgets, "w") as f:
+            json.dump(budgets, f, indent=4, sort_keys=True)
+            f.write("\n")
+        print(f"updated {len(medians)} budgets and {len(scaling)} scaling budgets in {args.budgets}")
+        sys.exit(0)
+
+    failures = check_budgets(medians, scaling, budgets)
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if skipped:
+        print(f"NOT CHECKED {len(skipped)} benchmarks skipped on this machine: {', '.join(skipped)}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,56 @@
+"""
+Measures how the parallel segment renderer scales with the number of worker processes.
+
+Usage (from the repository root):
+    python -m benchmarks.parallel_render --duration 60 --scenes 12 --format tiktok
+"""
+from constants import *
+from parallel_render import new_timeline_spec, render_timeline
+from FrameStore import FrameStore
+from benchmarks.caption_backends import synthetic_words
+from PIL import Image
+import numpy as np
+import argparse
+import tempfile
+import time
+import os
+
+
+def synthetic_scenes(n_scenes : int, duration : float, size : tuple[int, int], output_dir : str) -> tuple[list[str], list[tuple[float, float]]]:
+    """Writes one noise image per scene and splits duration evenly between them."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(n_scenes):
+        path = os.path.join(output_dir, f"scene_{i}.png")
+        Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(path)
+        paths.append(path)
+    bounds = np.linspace(0, duration, n_scenes + 1)
+    return paths, list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=60.0, help="length of the synthetic video in seconds")
+    parser.add_argument("--scenes", type=int, default=12, help="number of still image scenes")
+    parser.add_argument("--format", choices=[f.value for f in OUTPUT_FORMATS], default=OUTPUT_FORMATS.tiktok.value)
+    parser.add_argument("--segment-seconds", type=float, default=PARALLEL_SEGMENT_SECONDS)
+    parser.add_argument("--caption-backend", choices=[b.value for b in CAPTION_BACKENDS], default=CAPTION_BACKENDS.sprites.value)
+    args = parser.parse_args()
+
+    size = OUTPUT_RESOLUTIONS[args.format]
+    n_frames = int(round(args.duration * VIDEO_FPS))
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, *[2 ** i for i in range(1, cores.bit_length())], cores})
+
+    with tempfile.TemporaryDirectory() as output_dir, FrameStore() as frame_store:
+        image_paths, scene_segments = synthetic_scenes(args.scenes, args.duration, size, output_dir)
+        words = synthetic_words(args.duration)
+        print(f"{n_frames} frames at {size[0]}x{size[1]}, {args.scenes} scenes, {len(words)} words, {cores} cores")
+        baseline = None
+        for workers in worker_counts:
+            spec = new_timeline_spec(image_paths, scene_segments, words, CAPTION_BACKENDS(args.caption_backend), frame_store)
+            started = time.perf_counter()
+            render_timeline(spec, n_frames, os.path.join(output_dir, f"out_{workers}.mp4"), output_dir, workers, args.segment_seconds)
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            print(f"{workers:>3} workers: {elapsed:7.2f}s ({n_frames / elapsed:6.1f} frames/s, {baseline / elapsed:4.2f}x)")
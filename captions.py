@@ -4,6 +4,8 @@ from typing import List
 from moviepy.editor import VideoFileClip, CompositeVideoClip, TextClip, ColorClip
 from typing import TypedDict
 from PIL import ImageFont, ImageDraw, Image
+from functools import lru_cache
+from constants import CAPTION_FONT_FILEPATH, CAPTION_FONT_SIZE, CAPTION_STROKE_WIDTH, CAPTION_MARGIN_BOTTOM, CAPTION_PADDING
 import os
 import json
 from utils import load_list_from_json  # Ensure this function correctly loads the JSON list
@@ -46,21 +48,124 @@ def measure_text(text: str, font: ImageFont.FreeTypeFont) -> tuple[int, int]:
     return width, height
 
 
+class CaptionPlacement(TypedDict):
+    word: str
+    start: float
+    duration: float
+    x: int
+    y: int
+    box_width: int
+    box_height: int
+
+
+@lru_cache(maxsize=None)
+def load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
+    """Load a TrueType/OpenType font once per (path, size)."""
+    # Verify font path
+    if not os.path.isfile(font_path):
+        raise FileNotFoundError(f"Font file not found: {font_path}")
+    return ImageFont.truetype(font_path, font_size)
+
+
+def scaled_caption_style(scale: float) -> dict[str, int]:
+    """Caption geometry for a render at scale times the final resolution, so captions keep the same proportions."""
+    return {
+        "font_size": max(1, round(CAPTION_FONT_SIZE * scale)),
+        "stroke_width": max(1, round(CAPTION_STROKE_WIDTH * scale)) if CAPTION_STROKE_WIDTH else 0,
+        "margin_bottom": round(CAPTION_MARGIN_BOTTOM * scale),
+        "padding": round(CAPTION_PADDING * scale),
+    }
+
+
+def layout_captions(
+    transcription_words: List[TranscriptionWord],
+    video_size: tuple[int, int],
+    font: ImageFont.FreeTypeFont,
+    margin_bottom: int = CAPTION_MARGIN_BOTTOM,
+    padding: int = CAPTION_PADDING,
+) -> List[CaptionPlacement]:
+    """
+    Computes where and when each caption word is shown. Each line contains as many words as fit,
+    with words appearing one at a time from left to right and staying up until the line ends.
+
+    Args:
+        transcription_words (List[TranscriptionWord]): List of transcribed words.
+        video_size (tuple[int, int]): Width and height of the video.
+        font (ImageFont.FreeTypeFont): Font used to measure words.
+        margin_bottom (int): Distance from the bottom of the video.
+        padding (int): Padding around the text inside the background box.
+
+    Returns:
+        List[CaptionPlacement]: One placement per displayed word.
+    """
+    video_width, video_height = video_size
+    placements: List[CaptionPlacement] = []
+    words = transcription_words
+
+    while words:
+        # Determine how many words can fit on this line
+        line_words = []
+        total_width = 0
+
+        for word_info in words:
+            word = word_info['word']
+            word_width, _ = measure_text(word, font)
+            # Check if adding this word exceeds the video width
+            if line_words and total_width + word_width  + 2* padding > video_width:
+                break
+            line_words.append(word_info)
+            total_width += word_width + 2* padding
+
+        line_end = max([w["end"] for w in line_words])
+        curr_width = padding
+        # Place each word in the line
+        for word_info in line_words:
+            word = word_info['word']
+            start = word_info['start']
+            duration = line_end - start
+
+            if duration <= 0:
+                continue
+
+            # Measure text size
+            text_width, text_height = measure_text(word, font)
+
+            # Define background size
+            box_width = text_width + 2 * padding
+            box_height = text_height + 2 * padding
+
+            placements.append({
+                "word": word,
+                "start": start,
+                "duration": duration,
+                "x": curr_width,
+                "y": video_height - margin_bottom,
+                "box_width": box_width,
+                "box_height": box_height,
+            })
+            curr_width += box_width
+
+        # Continue with the remaining words on the next line
+        words = words[len(line_words):]
+
+    return placements
+
+
 def add_captions_helper(
     transcription_words: List[TranscriptionWord],
     video: VideoFileClip | CompositeVideoClip,
-    font_path: str = "fonts/MechanicalBold-oOmA.otf",
-    font_size: int = 70,
+    font_path: str = CAPTION_FONT_FILEPATH,
+    font_size: int = CAPTION_FONT_SIZE,
     font_color: str = "white",
     stroke_color: str = "black",
-    stroke_width: int = 2,
-    margin_bottom: int = 100,
+    stroke_width: int = CAPTION_STROKE_WIDTH,
+    margin_bottom: int = CAPTION_MARGIN_BOTTOM,
     background_color: tuple = (0, 0, 0),
     background_opacity: float = 0.6,
-    padding: int = 10,
+    padding: int = CAPTION_PADDING,
 ) -> CompositeVideoClip:
     """
-    Adds captions to the video file clip recursively. Each line contains as many words as fit,
+    Adds captions to the video file clip. Each line contains as many words as fit,
     with words appearing one at a time from left to right.
     
     Args:
@@ -75,106 +180,44 @@ def add_captions_helper(
         background_color (tuple): RGB color for background box.
         background_opacity (float): Opacity of background box (0 to 1).
         padding (int): Padding around the text inside the background box.
-        line_spacing (int): Spacing between lines.
     
     Returns:
         CompositeVideoClip: The final video with captions.
     """
-    # Verify font path
-    if not os.path.isfile(font_path):
-        raise FileNotFoundError(f"Font file not found: {font_path}")
-    
     # Load font using PIL for measurement
-    pil_font = ImageFont.truetype(font_path, font_size)
-    
-    video_width, video_height = video.size
+    pil_font = load_font(font_path, font_size)
     
     caption_clips = []
-    
-    def process_lines(words: List[TranscriptionWord], current_line: int) -> None:
-        """Recursive helper function to process captions line by line."""
-        if not words:
-            return
-        
-        # Determine how many words can fit on this line
-        line_words = []
-        total_width = 0
-        
-        for word_info in words:
-            word = word_info['word']
-            word_width, _ = measure_text(word, pil_font)
-            # Check if adding this word exceeds the video width
-            if total_width + word_width  + 2* padding > video_width:
-                break
-            line_words.append(word_info)
-            total_width += word_width + 2* padding
+    for placement in layout_captions(transcription_words, video.size, pil_font, margin_bottom, padding):
+        position = (placement["x"], placement["y"])
+
+        # Create the semi-transparent background box
+        box_clip = (
+            ColorClip(size=(placement["box_width"], placement["box_height"]), color=background_color)
+            .set_opacity(background_opacity)
+            .set_start(placement["start"])
+            .set_duration(placement["duration"])
+            .set_position(position)
+        )
         
-        curr_width = padding
-        # Create captions for each word in the line
-        for word_info in line_words:
-            word = word_info['word']
-            start = word_info['start']
-            end = word_info['end']
-            duration = max([w["end"] for w in line_words]) - start
-            
-            if duration <= 0:
-                continue
-            
-            # Measure text size
-            text_width, text_height = measure_text(word, pil_font)
-            
-            # Define background size
-            box_width = text_width + 2 * padding
-            box_height = text_height + 2 * padding
-            
-            # Starting and ending x positions
-            initial_x = 0
-            # Create the semi-transparent background box
-            box_clip = (
-                ColorClip(size=(box_width, box_height), color=background_color)
-                .set_opacity(background_opacity)
-                .set_start(start)
-                .set_duration(duration)
-                .set_position(
-                    (
-                        initial_x + curr_width,
-                        video_height - margin_bottom
-                    )
-                )
-            )
-            
-            # Create the TextClip
-            txt_clip = (
-                TextClip(
-                    txt=word,
-                    fontsize=font_size,
-                    font=font_path,
-                    color=font_color,
-                    stroke_color=stroke_color,
-                    stroke_width=stroke_width,
-                    method="label",
-                )
-                .set_start(start)
-                .set_duration(duration)
-                .set_position(
-                    (
-                        initial_x + curr_width,
-                        video_height - margin_bottom
-                    )
-                )
+        # Create the TextClip
+        txt_clip = (
+            TextClip(
+                txt=placement["word"],
+                fontsize=font_size,
+                font=font_path,
+                color=font_color,
+                stroke_color=stroke_color,
+                stroke_width=stroke_width,
+                method="label",
             )
-
-            curr_width += box_width
-            
-            # Append clips to the list
-            caption_clips.extend([box_clip, txt_clip])
+            .set_start(placement["start"])
+            .set_duration(placement["duration"])
+            .set_position(position)
+        )
         
-        # Recursively process remaining words
-        remaining_words = words[len(line_words):]
-        process_lines(remaining_words, current_line + 1)
-    
-    # Start processing from the first line
-    process_lines(transcription_words, current_line=0)
+        # Append clips to the list
+        caption_clips.extend([box_clip, txt_clip])
     
     # Combine the original video with all caption clips
     composite = CompositeVideoClip([video, *caption_clips])
@@ -0,0 +1,59 @@
+from openai import OpenAI, RateLimitError
+from dotenv import load_dotenv
+from functools import lru_cache
+from constants import *
+from rate_limits import get_rate_limiter
+from typing import Callable, TypeVar
+import requests
+import os
+
+Response = TypeVar("Response")
+
+load_dotenv()
+
+
+@lru_cache(maxsize=None)
+def get_openai_client(company : TEXT_MODEL_COMPANY = TEXT_MODEL_COMPANY.openai) -> OpenAI:
+    """One OpenAI compatible client per provider and process, so connections stay open between requests."""
+    return OpenAI(
+        api_key=os.environ.get(TEXT_GEN_API_KEY_NAME[company]),
+        base_url=TEXT_GEN_BASE_URL[company]
+    )
+
+
+@lru_cache(maxsize=None)
+def get_http_session() -> requests.Session:
+    """Shared keep-alive session for plain HTTP APIs (Stability)."""
+    return requests.Session()
+
+
+def send_rate_limited(key : str, request : Callable[[], Response], max_attempts : int = 3) -> Response:
+    """Sends an OpenAI compatible request under a rate limit bucket, retrying after 429s
+
+    Args:
+        key (str): bucket key, see rate_limit_key
+        request (Callable[[], Response]): makes the request through a client's with_raw_response, called once per attempt
+        max_attempts (int): attempts before the last 429 is raised
+
+    Returns:
+        Response: the raw response, whose headers have already adapted the bucket
+
+    Raises:
+        RateLimitError: if every attempt was throttled
+    """
+    rate_limiter = get_rate_limiter()
+    attempt = 1
+    while True:
+        rate_limiter.acquire(key)
+        try:
+            raw_response = request()
+        except RateLimitError as e:
+            # the SDK raises before a response is returned, so the bucket learns of the 429 here
+            rate_limiter.update_from_response(key, e.response.headers, 429)
+            if attempt >= max_attempts:
+                raise
+            # the bucket now blocks until the provider's reset so just try again
+            attempt += 1
+            continue
+        rate_limiter.update_from_response(key, raw_response.headers) #type: ignore
+        return raw_response
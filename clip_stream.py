@@ -0,0 +1,115 @@
+from constants import *
+from moviepy.editor import VideoClip, VideoFileClip, AudioFileClip
+from moviepy.audio.AudioClip import AudioClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from collections import OrderedDict
+import numpy as np
+import threading
+
+
+class ReaderWindow:
+    """
+    Lazily opens one reader per clip and keeps at most max_open of them alive.
+    Readers behind the current playback position are closed as soon as playback
+    moves past them, so resource usage does not grow with the number of clips.
+    """
+
+    def __init__(self, open_reader, max_open : int = 2):
+        """
+        :param open_reader: Callable taking a clip index and returning an opened moviepy clip.
+        :param max_open: Maximum number of readers alive at the same time.
+        """
+        self.open_reader = open_reader
+        self.max_open = max_open
+        self.readers : OrderedDict[int, VideoFileClip | AudioFileClip] = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, index : int) -> VideoFileClip | AudioFileClip:
+        with self.lock:
+            # playback moved forward, release every reader that is behind it
+            for i in [i for i in self.readers if i < index]:
+                self.readers.pop(i).close()
+            if index not in self.readers:
+                while len(self.readers) >= self.max_open:
+                    _, reader = self.readers.popitem(last=False)
+                    reader.close()
+                self.readers[index] = self.open_reader(index)
+            self.readers.move_to_end(index)
+            return self.readers[index]
+
+    def close(self):
+        with self.lock:
+            while self.readers:
+                _, reader = self.readers.popitem()
+                reader.close()
+
+
+class SequentialAudioClip(AudioClip):
+    """Plays the audio tracks of a list of clip files back to back, opening one decoder at a time."""
+
+    def __init__(self, clip_paths : list[str], starts : np.ndarray, has_audio : list[bool], fps : int = AUDIO_FPS):
+        super().__init__(duration=float(starts[-1]), fps=fps)
+        self.nchannels = 2
+        self.clip_paths = clip_paths
+        self.starts = starts
+        self.has_audio = has_audio
+        self.window = ReaderWindow(lambda i: AudioFileClip(self.clip_paths[i], fps=self.fps))
+        self.make_frame = self._make_frame
+
+    def _make_frame(self, t):
+        scalar = np.isscalar(t)
+        tt = np.atleast_1d(np.asarray(t, dtype=float))
+        out = np.zeros((len(tt), self.nchannels))
+        indices = np.clip(np.searchsorted(self.starts, tt, side="right") - 1, 0, len(self.clip_paths) - 1)
+        for index in np.unique(indices):
+            if not self.has_audio[index]:
+                continue
+            mask = indices == index
+            frame = self.window.get(int(index)).get_frame(tt[mask] - self.starts[index])
+            out[mask] = frame.reshape(int(mask.sum()), -1)[:, :self.nchannels]
+        return out[0] if scalar else out
+
+    def close(self):
+        self.window.close()
+
+
+class SequentialVideoClip(VideoClip):
+    """
+    Concatenates clip files in playback order without keeping a reader open per clip.
+    Durations and sizes are probed up front, and the ffmpeg reader subprocesses are
+    opened only for the clip currently being played and released once playback passes it.
+    """
+
+    def __init__(self, clip_paths : list[str], max_open : int = 2, durations : list[float] | None = None):
+        """
+        :param clip_paths: Clip files in playback order, all with the same frame size.
+        :param max_open: Maximum number of video readers alive at the same time.
+        :param durations: Exact length of each clip when known, ffmpeg only reports them to the
+                          hundredth of a second and those errors would add up over the clips.
+        """
+        super().__init__()
+        infos = [ffmpeg_parse_infos(path) for path in clip_paths]
+        self.clip_paths = clip_paths
+        self.starts = np.cumsum([0.0] + (durations or [info["duration"] for info in infos]))
+        self.size = infos[0]["video_size"]
+        self.duration = self.end = float(self.starts[-1])
+        self.window = ReaderWindow(lambda i: VideoFileClip(self.clip_paths[i], audio=False), max_open)
+        self.make_frame = self._make_frame
+
+        has_audio = [info["audio_found"] for info in infos]
+        if any(has_audio):
+            self.audio = SequentialAudioClip(clip_paths, self.starts, has_audio)
+
+    def clip_index(self, t : float) -> int:
+        # a frame time computed as a multiple of 1 / fps can land a hair before the start of the clip it begins
+        index = int(np.searchsorted(self.starts, t + 1e-6, side="right")) - 1
+        return min(max(index, 0), len(self.clip_paths) - 1)
+
+    def _make_frame(self, t):
+        index = self.clip_index(t)
+        return self.window.get(index).get_frame(t - self.starts[index])
+
+    def close(self):
+        self.window.close()
+        if isinstance(self.audio, SequentialAudioClip):
+            self.audio.close()
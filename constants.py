@@ -7,6 +7,9 @@ CLIPS_FILEPATH = "temp_clips/"
 
 NARRATION_FILEPATH = "temp_narrations/"
 
+# synthesized narrations keyed by text, reused instead of calling the TTS endpoint again
+NARRATION_CACHE_FILEPATH = "narration_cache/"
+
 COMPLETED_VIDEO_FILEPATH = "completed_videos/"
 
 BACKGROUND_MUSIC_FILEPATH = "background_music/"
@@ -17,11 +20,69 @@ TEXT_DATA_PATH = "text_data/"
 
 MONTAGE_SCRIPT_PATH = "montage_scripts/"
 
+FONTS_FILEPATH = "fonts/"
+
+CAPTION_FONT_FILEPATH = "fonts/MechanicalBold-oOmA.otf"
+
+# intermediate artifacts larger than this are spilled from memory to tmpfs
+ARTIFACT_SPILL_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+# Audio mixing
+AUDIO_FPS = 44100
+
+# sample rate of the raw 16-bit mono PCM returned by the TTS endpoint
+TTS_PCM_FPS = 24000
+
+# compact encode sent to Whisper, which only needs intelligible mono speech
+TRANSCRIPTION_AUDIO_FPS = 16000
+
+TRANSCRIPTION_AUDIO_BITRATE = "32k"
+
+BACKGROUND_MUSIC_GAIN = .08
+
+# music gain multiplier applied while narration is speaking (when ducking is enabled)
+BACKGROUND_MUSIC_DUCK_GAIN = .5
+
+# Rendering
+VIDEO_FPS = 24
+
+# draft previews: fraction of the final resolution, frame rate and x264 preset
+PREVIEW_SCALE = .25
+
+PREVIEW_FPS = 8
+
+PREVIEW_PRESET = "ultrafast"
+
+# speaking rate used to time placeholder narrations in previews
+PREVIEW_WORDS_PER_SECOND = 2.5
+
+# default caption geometry in pixels at full resolution, scaled down with previews
+CAPTION_FONT_SIZE = 70
+
+CAPTION_STROKE_WIDTH = 2
+
+CAPTION_MARGIN_BOTTOM = 100
+
+CAPTION_PADDING = 10
+
+# target length of the segments the parallel renderer splits a timeline into,
+# cuts are placed on scene boundaries where possible
+PARALLEL_SEGMENT_SECONDS = 10.0
+
 ASPECT_RATIOS = {
     "youtube" : "16:9",
     "tiktok" : "9:16"
 }
 
+# aspect ratio images are generated at when one spec renders several output formats,
+# each format is then cropped or padded out of it
+MASTER_ASPECT_RATIO = "1:1"
+
+OUTPUT_RESOLUTIONS = {
+    "youtube" : (1920, 1080),
+    "tiktok" : (1080, 1920)
+}
+
 
 
 #Company name a prefix to model name separated by "-"
@@ -87,6 +148,36 @@ class OUTPUT_FORMATS(str, Enum):
     youtube = "youtube"
     tiktok = "tiktok"
 
+class ASSEMBLY_MODES(str, Enum):
+    composite = "composite" # decode every clip and join them while encoding the final video
+    stream_copy = "stream-copy" # join clips with ffmpeg's concat demuxer, re-encoding only if stream parameters differ
+
+class AUDIO_MODES(str, Enum):
+    mp3 = "mp3" # TTS returns mp3, decoded for mixing
+    pcm = "pcm" # TTS returns raw samples that stay uncompressed until the final mux
+
+class REFRAME_MODES(str, Enum):
+    crop = "crop" # fill the output, cutting off the edges of the master frame
+    pad = "pad" # fit the whole master frame, letterboxing the rest
+
+class CAPTION_BACKENDS(str, Enum):
+    moviepy = "moviepy" # composite ColorClip/TextClip layers in python frame callbacks
+    ass = "ass" # write an ASS subtitle file and burn it in with ffmpeg/libass during the final encode
+    sprites = "sprites" # pre-rendered caption sprites patched into cached per-scene base frames
+
+class ENCODING_MODES(str, Enum):
+    every_frame = "every_frame" # every frame of the timeline is generated and piped to the encoder
+    changes = "changes" # only frames where the picture changes are generated, each held for its duration (sprites captions only)
+
+class TRANSCRIPTION_BACKENDS(str, Enum):
+    whisper = "whisper" # send the narration to the Whisper API for word timestamps
+    alignment = "alignment" # align the known narration text to the audio locally, no API call
+
+class COLLECTOR_KINDS(str, Enum):
+    wikipedia = "wikipedia" # a Wikipedia article URL
+    text = "text" # a local plain text or Markdown file
+    html = "html" # a local HTML file
+
 DEFAULT_IMAGE_FORMAT = "png"
 
 # https://platform.openai.com/docs/pricing
@@ -127,6 +218,17 @@ TEXT_GEN_BASE_URL : dict[Enum, str] = {
     TEXT_MODEL_COMPANY.deepseek : "https://api.deepseek.com"
 }
 
+# how each text model can be held to the script's JSON structure, models missing here rely on the prompt
+# "json_schema": structured outputs validated against a schema, "json_object": JSON mode
+TEXT_MODEL_JSON_SUPPORT : dict[Enum, str] = {
+    TEXT_MODEL_NAMES.openai_4o_mini : "json_schema",
+    TEXT_MODEL_NAMES.openai_4o : "json_schema",
+    TEXT_MODEL_NAMES.deepseek_v2 : "json_object",
+}
+
+# total paid generations before giving up on a response that cannot be repaired locally
+SCRIPT_GENERATION_MAX_ATTEMPTS = 3
+
 TEXT_GEN_API_KEY_NAME : dict[Enum, str] = {
     TEXT_MODEL_COMPANY.openai : "OPENAI_API_KEY",
     TEXT_MODEL_COMPANY.deepseek : "DEEPSEEK_API_KEY"
@@ -143,5 +245,116 @@ DEEPSEEK_PRICING_MAP : dict[Enum, dict[str,float]] = {
     },
 }
 
+# Rate limits
+RATE_LIMIT_DB_FILEPATH = "rate_limits.sqlite3"
+
+# (requests, per seconds) per provider endpoint, keyed by "<provider>-<endpoint>".
+# Buckets tighten themselves from x-ratelimit-* headers and 429 responses at runtime.
+RATE_LIMITS : dict[str, tuple[float, float]] = {
+    "openai-tts" : (50, 60),
+    "openai-whisper" : (50, 60),
+    "openai-chat" : (500, 60),
+    "deepseek-chat" : (60, 60),
+    "stability-core" : (150, 10),
+    "stability-ultra" : (150, 10),
+}
+
+DEFAULT_RATE_LIMIT = (60, 60)
+
+RATE_LIMIT_BACKOFF_SECONDS = 10.0
+
+# Image requests
+# a Stability request (including its retries after 429s) is abandoned after this long
+STABILITY_REQUEST_TIMEOUT_SECONDS = 90.0
+
+# a duplicate request is sent when one runs past this percentile of recent latencies
+IMAGE_HEDGE_PERCENTILE = 95
+
+# recent successful requests the percentile is taken over, and how many are needed before hedging
+IMAGE_HEDGE_LATENCY_WINDOW = 200
+
+IMAGE_HEDGE_MIN_SAMPLES = 20
+
+# USD a job may spend on duplicate requests, 0 disables hedging
+IMAGE_HEDGE_COST_CAP = 0.15
+
+# Run store
+RUN_STORE_DB_FILEPATH = "runs.sqlite3"
+
+# directories of intermediate files garbage collection may remove once no run references them. Finished videos
+# and kept images are only removed once a run they were recorded for is forgotten, see RunStore.delete_runs
+RUN_STORE_GC_DIRECTORIES = [NARRATION_FILEPATH, CLIPS_FILEPATH, TEMP_AUDIO_FILEPATH, NARRATION_CACHE_FILEPATH]
+
+# files younger than this are never collected, they may belong to a run still in progress
+RUN_STORE_GC_MIN_AGE_SECONDS = 24 * 60 * 60
+
 # Auth
-TIKTOK_COOKIES_FILEPATH = "tiktok_auth/www.tiktok.com_cookies.txt"
\ No newline at end of file
+TIKTOK_COOKIES_FILEPATH = "tiktok_auth/www.tiktok.com_cookies.txt"
+
+UPLOAD_QUEUE_FILEPATH = "upload_queue.json"
+# Render service
+RENDER_SERVICE_HOST = "127.0.0.1"
+
+RENDER_SERVICE_PORT = 8765
+
+# Progress reporting
+# running updates of a stage are sent at most this often
+PROGRESS_MIN_INTERVAL_SECONDS = 0.5
+
+# throughput, and so the ETA, is measured over this much recent progress
+PROGRESS_RATE_WINDOW_SECONDS = 10.0
+
+# Source collection
+# a source still fetching after this long is dropped from the corpus
+COLLECTOR_TIMEOUT_SECONDS = 30.0
+
+# characters of source text passed to the script generator
+COLLECTED_CORPUS_MAX_CHARS = 60000
+
+# paragraphs are compared by their hashed runs of this many words
+DEDUPE_SHINGLE_WORDS = 5
+
+# a paragraph with at least this fraction of its shingles already in the corpus is dropped
+DEDUPE_OVERLAP_THRESHOLD = 0.8
+
+# Image reuse
+# reuse is off unless a job sets image_reuse_threshold, prompts at least that similar (estimated Jaccard similarity
+# of their words) and naming the same people, places and numbers reuse an image instead of generating one.
+# This is the threshold suggested when turning it on, only prompts differing in little more than word order or
+# filler words score above it
+IMAGE_REUSE_THRESHOLD = 0.9
+
+IMAGE_PROMPT_MINHASH_PERMUTATIONS = 64
+
+# prompts of every image kept in IMAGE_FILEPATH, searched for images to reuse
+IMAGE_PROMPT_INDEX_FILEPATH = "image_prompt_index.json"
+
+# fraction of the width and height kept when an image is derived for a scene repeating an earlier one
+IMAGE_DERIVE_CROP = 0.85
+
+# Narration batching
+# longest input the TTS endpoint accepts
+TTS_MAX_INPUT_CHARS = 4096
+
+# joins the narrations of a batch, a paragraph break makes the voice pause between scenes
+TTS_BATCH_SEPARATOR = "\n\n"
+
+# narration batches synthesized at the same time
+TTS_BATCH_CONCURRENCY = 4
+
+# a pause is a run of 10ms frames this far below the loudest frame lasting at least TTS_SPLIT_MIN_SILENCE_SECONDS
+TTS_SPLIT_SILENCE_DB = -35
+
+TTS_SPLIT_MIN_SILENCE_SECONDS = 0.12
+
+# seconds of distance from the expected cut a pause's length (up to the cap) is worth, per second of pause
+TTS_SPLIT_PAUSE_WEIGHT = 2.0
+
+TTS_SPLIT_PAUSE_CAP_SECONDS = 0.6
+
+# Change only encoding
+# "cfr" duplicates held frames to VIDEO_FPS before encoding, as upload targets expect, "vfr" encodes each distinct frame once
+STILL_ENCODE_FPS_MODE = "cfr"
+
+# zlib level of the distinct frames written for ffmpeg, fast rather than small as they are deleted once encoded
+STILL_ENCODE_PNG_COMPRESSION = 1
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+
+class CollectorError(Exception):
+    """
+    Raised when a source cannot be collected.
+    """
+
+    def __init__(self, message: str):
+        """
+        :param message: A human-readable error message describing the issue.
+        """
+        super().__init__(message)
+
+
+# blocking fetches run here rather than in asyncio's default executor, which asyncio.run waits
+# for on exit, so a source abandoned after its timeout cannot hold up the rest of the run
+_fetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="collector")
+
+
+class Collector:
+    """
+    A source of text about a topic. Subclasses implement get_text, which may block,
+    and are fetched concurrently through fetch.
+    """
+
+    def __init__(self, source : str):
+        """
+        :param source: Where the text comes from, a URL or a file path.
+        """
+        self.source = source
+
+    def get_text(self) -> str:
+        """
+        Retrieve the source's text.
+
+        :return: The text, one paragraph per line, blank lines between them are ignored.
+        :raises CollectorError: If the source cannot be read.
+        """
+        raise NotImplementedError
+
+    async def fetch(self) -> str:
+        """
+        Retrieve the source's text without blocking the event loop.
+
+        :return: The text, one paragraph per line, blank lines between them are ignored.
+        """
+        return await asyncio.get_running_loop().run_in_executor(_fetch_executor, self.get_text)
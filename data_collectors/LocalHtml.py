@@ -0,0 +1,67 @@
+from data_collectors.Collector import Collector, CollectorError
+from html.parser import HTMLParser
+import re
+
+# elements whose text is never part of the article
+SKIPPED_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "template"}
+
+# elements that end a paragraph
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "h1", "h2", "h3", "h4", "h5", "h6",
+              "blockquote", "pre", "table", "tr", "br", "dd", "dt", "figcaption"}
+
+
+class ParagraphParser(HTMLParser):
+    """Collects the visible text of a page, one paragraph per block element."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs : list[str] = []
+        self.current : list[str] = []
+        self.skip_depth = 0
+
+    def end_paragraph(self):
+        paragraph = re.sub(r"\s+", " ", "".join(self.current)).strip()
+        if paragraph:
+            self.paragraphs.append(paragraph)
+        self.current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.end_paragraph()
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.end_paragraph()
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.current.append(data)
+
+
+class LocalHtml(Collector):
+    """
+    An HTML file on disk, e.g. a saved article. Scripts, styles and page furniture such as
+    navigation and footers are dropped and each block element becomes a paragraph.
+    """
+
+    def __init__(self, path : str):
+        """
+        :param path: Path to a .html or .htm file.
+        """
+        super().__init__(path)
+
+    def get_text(self) -> str:
+        try:
+            with open(self.source, encoding="utf-8", errors="replace") as f:
+                html = f.read()
+        except OSError as e:
+            raise CollectorError(f"cannot read {self.source}: {e}")
+        parser = ParagraphParser()
+        parser.feed(html)
+        parser.close()
+        parser.end_paragraph()
+        return "\n\n".join(parser.paragraphs)
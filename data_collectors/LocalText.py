@@ -0,0 +1,54 @@
+from data_collectors.Collector import Collector, CollectorError
+import re
+
+# longest line of a hard wrapped paragraph, longer lines are whole paragraphs
+HARD_WRAP_MAX_COLUMNS = 100
+
+
+class LocalText(Collector):
+    """
+    A plain text or Markdown file on disk. Markdown markup is removed so only the prose is
+    passed on: headings, emphasis, link targets, images, code fences and table rules. Hard
+    wrapped paragraphs are joined so each paragraph is on one line, like other collectors' text.
+    """
+
+    def __init__(self, path : str):
+        """
+        :param path: Path to a .txt or .md file.
+        """
+        super().__init__(path)
+
+    def get_text(self) -> str:
+        try:
+            with open(self.source, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except OSError as e:
+            raise CollectorError(f"cannot read {self.source}: {e}")
+        if self.source.lower().endswith((".md", ".markdown")):
+            text = strip_markdown(text)
+        return unwrap_paragraphs(text)
+
+
+def strip_markdown(text : str) -> str:
+    """The prose of a Markdown document, its paragraphs still separated by blank lines."""
+    text = re.sub(r"```.*?```", "", text, flags=re.DOTALL)
+    text = re.sub(r"!\[[^\]]*\]\([^)]*\)", "", text)
+    text = re.sub(r"\[([^\]]*)\]\([^)]*\)", r"\1", text)
+    text = re.sub(r"^[ \t]{0,3}#{1,6}[ \t]*", "", text, flags=re.MULTILINE)
+    text = re.sub(r"^[ \t]*([-*+]|\d+\.)[ \t]+", "", text, flags=re.MULTILINE)
+    text = re.sub(r"^[ \t]*>[ \t]?", "", text, flags=re.MULTILINE)
+    text = re.sub(r"^[ \t]*\|?[ \t:|-]*-[ \t:|-]*\|?[ \t]*$", "", text, flags=re.MULTILINE)
+    text = re.sub(r"(\*\*|__|\*|_|`)(\S.*?\S|\S)\1", r"\2", text)
+    return text
+
+
+def unwrap_paragraphs(text : str, max_columns : int = HARD_WRAP_MAX_COLUMNS) -> str:
+    """Joins hard wrapped lines: a blank line separated block whose lines, but the last, are all at most
+    max_columns long is one paragraph. The lines of other blocks are paragraphs already and kept apart."""
+    blocks = []
+    for block in re.split(r"\n[ \t]*\n", text):
+        lines = [line.strip() for line in block.splitlines() if line.strip()]
+        if lines:
+            hard_wrapped = all(len(line) <= max_columns for line in lines[:-1])
+            blocks.append((" " if hard_wrapped else "\n").join(lines))
+    return "\n\n".join(blocks)
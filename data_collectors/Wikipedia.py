@@ -1,6 +1,7 @@
 import wikipedia
+from data_collectors.Collector import Collector, CollectorError
 
-class Wikipedia:
+class Wikipedia(Collector):
     """
     A class representing a Wikipedia source. It takes a Wikipedia article URL
     and provides a method to return its main textual content.
@@ -13,18 +14,20 @@ class Wikipedia:
         :param url: A valid Wikipedia article URL, for example:
                     'https://en.wikipedia.org/wiki/Artificial_intelligence'
         """
+        super().__init__(url)
         self.url = url
 
     def get_text(self) -> str:
         """
         Retrieve the primary text from the Wikipedia page.
-        (Skeleton only—no actual implementation here.)
 
         :return: A string containing the article's main content.
         """
-        # Implementation placeholder
         article_name = self.clean_url(self.url)
-        page = wikipedia.page(article_name, auto_suggest=True)
+        try:
+            page = wikipedia.page(article_name, auto_suggest=True)
+        except wikipedia.exceptions.WikipediaException as e:
+            raise CollectorError(f"cannot fetch {self.url}: {e}")
         return page.content
     
     def clean_url(self, url: str) -> str:
@@ -0,0 +1,149 @@
+from constants import *
+from moviepy.config import get_setting
+from typing import TypedDict
+import subprocess
+import tempfile
+import os
+import re
+
+
+class StreamParams(TypedDict):
+    video_codec : str | None
+    pix_fmt : str | None
+    size : tuple[int, int] | None
+    fps : float | None
+    audio_codec : str | None
+    audio_fps : int | None
+    audio_channels : str | None
+
+
+class FFmpegError(Exception):
+    """
+    Raised when an ffmpeg subprocess exits with a non zero status.
+    """
+
+    def __init__(self, message: str):
+        """
+        :param message: A human-readable error message, usually ffmpeg's stderr.
+        """
+        super().__init__(message)
+
+
+def get_ffmpeg_binary() -> str:
+    """Returns the ffmpeg executable moviepy is configured to use."""
+    return get_setting("FFMPEG_BINARY")
+
+
+def run_ffmpeg(args : list[str]) -> None:
+    """Runs ffmpeg with the given arguments, raising FFmpegError on failure."""
+    process = subprocess.run([get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y", *args],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise FFmpegError(process.stderr.decode("utf-8", errors="replace"))
+
+
+def probe_stream_params(path : str) -> StreamParams:
+    """Reads the codec level parameters of the first video and audio stream of a file
+
+    Args:
+        path (str): path to a media file
+
+    Returns:
+        StreamParams: parameters that must match for two files to be joined with stream copy
+    """
+    process = subprocess.run([get_ffmpeg_binary(), "-hide_banner", "-i", path],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    infos = process.stderr.decode("utf-8", errors="replace")
+    params : StreamParams = {
+        "video_codec" : None, "pix_fmt" : None, "size" : None, "fps" : None,
+        "audio_codec" : None, "audio_fps" : None, "audio_channels" : None
+    }
+
+    video_line = re.search(r"Stream #.*?Video: (.*)", infos)
+    if video_line:
+        fields = [f.strip() for f in re.split(r",(?![^(]*\))", video_line.group(1))]
+        params["video_codec"] = fields[0].split(" ")[0]
+        params["pix_fmt"] = fields[1].split("(")[0] if len(fields) > 1 else None
+        for field in fields:
+            size = re.match(r"(\d+)x(\d+)", field)
+            if size:
+                params["size"] = (int(size.group(1)), int(size.group(2)))
+                break
+        fps = re.search(r"([\d.]+) fps", video_line.group(1))
+        if fps:
+            params["fps"] = float(fps.group(1))
+
+    audio_line = re.search(r"Stream #.*?Audio: (.*)", infos)
+    if audio_line:
+        fields = [f.strip() for f in re.split(r",(?![^(]*\))", audio_line.group(1))]
+        params["audio_codec"] = fields[0].split(" ")[0]
+        audio_fps = re.search(r"(\d+) Hz", audio_line.group(1))
+        if audio_fps:
+            params["audio_fps"] = int(audio_fps.group(1))
+        params["audio_channels"] = fields[2] if len(fields) > 2 else None
+
+    return params
+
+
+def probe_duration(path : str) -> float | None:
+    """Duration in seconds of a media file from its container header, None if ffmpeg cannot tell."""
+    process = subprocess.run([get_ffmpeg_binary(), "-hide_banner", "-i", path],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    match = re.search(r"Duration: (\d+):(\d+):([\d.]+)", process.stderr.decode("utf-8", errors="replace"))
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def can_stream_copy(paths : list[str]) -> bool:
+    """Whether every file shares the stream parameters of the first one."""
+    params = [probe_stream_params(path) for path in paths]
+    return all(p == params[0] for p in params[1:])
+
+
+def write_concat_list(paths : list[str]) -> str:
+    """Writes an ffmpeg concat demuxer list file and returns its path."""
+    fd, list_path = tempfile.mkstemp(suffix=".txt", prefix="concat_")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
+
+
+def concatenate_clip_files(paths : list[str], output_path : str, fps : int = 24) -> tuple[str, bool]:
+    """Joins clip files without re-encoding when their stream parameters match, otherwise
+    re-encodes them to the parameters of the first clip
+
+    Args:
+        paths (list[str]): clip files in playback order
+        output_path (str): where to write the joined file
+        fps (int): frame rate used if a re-encode is needed
+
+    Returns:
+        tuple[str, bool]: path of the joined file and whether stream copy was used
+    """
+    if can_stream_copy(paths):
+        list_path = write_concat_list(paths)
+        try:
+            run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path])
+        finally:
+            os.remove(list_path)
+        return output_path, True
+
+    # parameters differ, normalise every input to the first clip and join with the concat filter
+    first = probe_stream_params(paths[0])
+    width, height = first["size"] or (0, 0)
+    has_audio = all(probe_stream_params(path)["audio_codec"] for path in paths)
+    args, filters, streams = [], [], ""
+    for i, path in enumerate(paths):
+        args += ["-i", path]
+        filters.append(f"[{i}:v]scale={width}:{height},setsar=1,fps={fps},format=yuv420p[v{i}]")
+        streams += f"[v{i}]" + (f"[{i}:a]" if has_audio else "")
+    filters.append(f"{streams}concat=n={len(paths)}:v=1:a={int(has_audio)}" + ("[v][a]" if has_audio else "[v]"))
+    args += ["-filter_complex", ";".join(filters), "-map", "[v]", "-c:v", "libx264"]
+    if has_audio:
+        args += ["-map", "[a]", "-c:a", "aac"]
+    run_ffmpeg([*args, output_path])
+    return output_path, False
@@ -0,0 +1,105 @@
+from constants import *
+from moviepy.editor import VideoClip
+import numpy as np
+import threading
+
+
+def parse_aspect_ratio(aspect_ratio : str) -> float:
+    """Converts an aspect ratio string such as '16:9' to width / height."""
+    width, height = aspect_ratio.split(":")
+    return int(width) / int(height)
+
+
+def reframe_size(master_size : tuple[int, int], aspect_ratio : str, mode : REFRAME_MODES) -> tuple[int, int]:
+    """Size of the frame obtained by cropping or padding master_size to aspect_ratio, rounded to even pixels."""
+    master_width, master_height = master_size
+    target = parse_aspect_ratio(aspect_ratio)
+    crop = mode == REFRAME_MODES.crop
+    if (master_width / master_height > target) == crop:
+        width, height = master_height * target, master_height
+    else:
+        width, height = master_width, master_width / target
+    return int(width) // 2 * 2, int(height) // 2 * 2
+
+
+def reframe(frame : np.ndarray, size : tuple[int, int], mode : REFRAME_MODES) -> np.ndarray:
+    """Center crops or letterboxes a frame to size."""
+    width, height = size
+    frame_height, frame_width = frame.shape[:2]
+    if mode == REFRAME_MODES.crop:
+        x = (frame_width - width) // 2
+        y = (frame_height - height) // 2
+        return frame[y:y + height, x:x + width]
+    canvas = np.zeros((height, width, frame.shape[2]), dtype=frame.dtype)
+    x = (width - frame_width) // 2
+    y = (height - frame_height) // 2
+    canvas[y:y + frame_height, x:x + frame_width] = frame
+    return canvas
+
+
+class SharedFrameSource:
+    """
+    Lets several encoders read the same master timeline while every frame is rendered once.
+    A frame is kept until each consumer has fetched it, with max_frames as a hard bound in
+    case one consumer falls far behind the others (it then re-renders what it missed).
+    """
+
+    def __init__(self, clip : VideoClip, consumers : int, fps : int = 24, max_frames : int = 96):
+        """
+        :param clip: The master timeline to render frames from.
+        :param consumers: How many encoders will read every frame.
+        :param fps: Frame rate the encoders request frames at.
+        :param max_frames: Maximum number of rendered frames held in memory.
+        """
+        self.clip = clip
+        self.consumers = consumers
+        self.fps = fps
+        self.max_frames = max_frames
+        self.frames : dict[int, tuple[np.ndarray, int]] = {}
+        self.rendering : dict[int, threading.Event] = {} # frames being rendered, set once they are in frames
+        self.lock = threading.Lock()
+        # moviepy's file readers are not thread safe, so renders are serialized apart from the frame
+        # bookkeeping and a consumer fetching a rendered frame never waits on another one's render
+        self.render_lock = threading.Lock()
+
+    def read(self, index : int) -> np.ndarray:
+        """Counts a consumer's fetch of a rendered frame, dropping it once every consumer has it. Call with lock held."""
+        frame, reads = self.frames[index]
+        reads += 1
+        if reads >= self.consumers:
+            del self.frames[index]
+        else:
+            self.frames[index] = (frame, reads)
+        return frame
+
+    def get_frame(self, t : float) -> np.ndarray:
+        index = int(round(t * self.fps))
+        while True:
+            with self.lock:
+                if index in self.frames:
+                    return self.read(index)
+                pending = self.rendering.get(index)
+                if pending is None:
+                    pending = self.rendering[index] = threading.Event()
+                    break
+            # another consumer is rendering this frame, if it was dropped or failed by then this one renders it
+            pending.wait()
+
+        try:
+            with self.render_lock:
+                frame = self.clip.get_frame(t)
+            with self.lock:
+                while len(self.frames) >= self.max_frames:
+                    del self.frames[min(self.frames)]
+                self.frames[index] = (frame, 0)
+                return self.read(index)
+        finally:
+            with self.lock:
+                del self.rendering[index]
+            pending.set()
+
+    def reframed_clip(self, aspect_ratio : str, mode : REFRAME_MODES = REFRAME_MODES.crop) -> VideoClip:
+        """A clip reading this source, cropped or padded to aspect_ratio."""
+        size = reframe_size(self.clip.size, aspect_ratio, mode)
+        clip = VideoClip(lambda t: reframe(self.get_frame(t), size, mode), duration=self.clip.duration)
+        return clip.set_audio(self.clip.audio)
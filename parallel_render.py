@@ -0,0 +1,156 @@
+from constants import *
+from captions import TranscriptionWord, add_captions_helper
+from ass_captions import burn_in_ffmpeg_params
+from static_frames import StaticCaptionedClip
+from ffmpeg_tools import concatenate_clip_files
+from FrameStore import FrameStore, attach_frame
+from moviepy.editor import VideoClip
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+from progress import get_progress_reporter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TypedDict
+from PIL import Image
+import numpy as np
+import uuid
+import os
+
+
+class TimelineSpec(TypedDict):
+    """Everything a worker process needs to rebuild the final timeline on its own."""
+    key : str
+    frame_store_root : str
+    # scene images decoded once into the frame store, attached by every worker
+    frame_paths : list[str]
+    scene_segments : list[tuple[float, float]]
+    transcription_words : list[TranscriptionWord]
+    size : tuple[int, int]
+    fps : int
+    caption_backend : CAPTION_BACKENDS
+    # overrides of the default caption style, as for add_captions_helper
+    caption_style : dict
+    ass_path : str | None
+
+
+def plan_segments(scene_segments : list[tuple[float, float]], n_frames : int, fps : int,
+                  segment_seconds : float = PARALLEL_SEGMENT_SECONDS) -> list[tuple[int, int]]:
+    """Splits a timeline of n_frames into [start, end) frame ranges of about segment_seconds, cutting
+    at scene boundaries where possible and on the frame grid inside scenes longer than two segments
+
+    Returns:
+        list[tuple[int, int]]: contiguous frame ranges covering the whole timeline
+    """
+    target = max(1, int(round(segment_seconds * fps)))
+    cuts = sorted({min(n_frames, int(round(end * fps))) for _, end in scene_segments[:-1]})
+    bounds = [0]
+    for cut in [*cuts, n_frames]:
+        while cut - bounds[-1] > 2 * target:
+            bounds.append(bounds[-1] + target)
+        if cut > bounds[-1] and (cut - bounds[-1] >= target or cut == n_frames):
+            bounds.append(cut)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def build_timeline(spec : TimelineSpec) -> VideoClip:
+    """The captioned montage timeline, one still image per scene, without audio."""
+    frames = [attach_frame(path) for path in spec["frame_paths"]]
+    ends = np.array([end for _, end in spec["scene_segments"]])
+
+    def make_frame(t):
+        return frames[min(int(np.searchsorted(ends, t, side="right")), len(frames) - 1)]
+
+    video = VideoClip(make_frame, duration=spec["scene_segments"][-1][1])
+    if spec["caption_backend"] == CAPTION_BACKENDS.sprites:
+        return StaticCaptionedClip(video, spec["transcription_words"], spec["scene_segments"],
+                                   frame_store=FrameStore(spec["frame_store_root"]), **spec["caption_style"])
+    if spec["caption_backend"] == CAPTION_BACKENDS.moviepy:
+        return add_captions_helper(spec["transcription_words"], video, **spec["caption_style"])
+    # ASS captions are burned in by the segment encoder
+    return video
+
+
+# the timeline most recently built in this worker process, reused by its later segments
+_timeline : tuple[str, VideoClip] | None = None
+
+def render_segment(spec : TimelineSpec, start_frame : int, end_frame : int, output_path : str, threads : int = 1) -> str:
+    """Encodes frames [start_frame, end_frame) of the timeline to a silent clip, run in a worker process."""
+    global _timeline
+    if _timeline is None or _timeline[0] != spec["key"]:
+        _timeline = (spec["key"], build_timeline(spec))
+    video = _timeline[1]
+
+    fps = spec["fps"]
+    ffmpeg_params = None
+    if spec["caption_backend"] == CAPTION_BACKENDS.ass:
+        ffmpeg_params = burn_in_ffmpeg_params(spec["ass_path"], offset=start_frame / fps) #type: ignore
+    writer = FFMPEG_VideoWriter(output_path, spec["size"], fps, codec="libx264", threads=threads, ffmpeg_params=ffmpeg_params)
+    try:
+        # frames are addressed by index so segments tile the timeline exactly
+        for index in range(start_frame, end_frame):
+            writer.write_frame(video.get_frame(index / fps))
+    finally:
+        writer.close()
+    return output_path
+
+
+def render_timeline(spec : TimelineSpec, n_frames : int, output_path : str, work_dir : str,
+                    workers : int | None = None, segment_seconds : float = PARALLEL_SEGMENT_SECONDS,
+                    progress_stage : str = "rendering") -> str:
+    """Renders the timeline's segments in a process pool and joins them with stream copy
+
+    Every segment is encoded with the same settings and starts on a keyframe, so the concat
+    demuxer can join them without re-encoding. The result has no audio, it is muxed once
+    over the joined video so it cannot drift at the segment boundaries.
+
+    Args:
+        spec (TimelineSpec): the timeline to render
+        n_frames (int): length of the timeline in frames
+        output_path (str): where to write the joined, silent video
+        work_dir (str): directory for the segment files, which are removed once joined
+        workers (int | None): worker processes, one per core by default
+        segment_seconds (float): target segment length
+        progress_stage (str): name the frames rendered are reported under, as each segment completes
+
+    Returns:
+        str: output_path
+    """
+    workers = workers or os.cpu_count() or 1
+    segments = plan_segments(spec["scene_segments"], n_frames, spec["fps"], segment_seconds)
+    # split the cores between the workers' encoders rather than oversubscribing them
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    segment_paths = [os.path.join(work_dir, f"segment_{uuid.uuid4()}.mp4") for _ in segments]
+    try:
+        with get_progress_reporter().stage(progress_stage, total=n_frames, unit="frames") as progress, \
+                ProcessPoolExecutor(max_workers=min(workers, len(segments))) as executor:
+            futures = {executor.submit(render_segment, spec, start, end, path, threads) : end - start
+                       for (start, end), path in zip(segments, segment_paths)}
+            for future in as_completed(futures):
+                future.result()
+                progress.advance(futures[future])
+        concatenate_clip_files(segment_paths, output_path, spec["fps"])
+    finally:
+        for path in segment_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return output_path
+
+
+def new_timeline_spec(image_paths : list[str], scene_segments : list[tuple[float, float]],
+                      transcription_words : list[TranscriptionWord], caption_backend : CAPTION_BACKENDS,
+                      frame_store : FrameStore, ass_path : str | None = None, fps : int = VIDEO_FPS,
+                      caption_style : dict | None = None) -> TimelineSpec:
+    """A TimelineSpec sized like the first scene image, as the single process timeline is.
+    The scene images are decoded into frame_store here so the workers only attach to them."""
+    with Image.open(image_paths[0]) as image:
+        size = image.size
+    return {
+        "key" : str(uuid.uuid4()),
+        "frame_store_root" : frame_store.root,
+        "frame_paths" : [frame_store.put_image(path, size) for path in image_paths],
+        "scene_segments" : scene_segments,
+        "transcription_words" : transcription_words,
+        "size" : size,
+        "fps" : fps,
+        "caption_backend" : caption_backend,
+        "caption_style" : caption_style or {},
+        "ass_path" : ass_path
+    }
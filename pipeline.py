@@ -0,0 +1,251 @@
+from Data_Collection import collect, collector_for_source, CollectorError
+from ContentSpecs import VideoSpec, VideoVariant
+from ScriptGenerator import MontageScriptGenerator
+from VideoGenerator import MontageGenerator
+from NarrationGenerator import narration_cache_path
+from RunStore import RunStore, get_run_store
+from progress import ProgressReporter, get_progress_reporter
+from contextlib import contextmanager
+from typing import TypedDict, Callable
+from utils import *
+from constants import *
+import json
+import uuid
+import os
+
+
+class JobSpec(TypedDict, total=False):
+    """
+    A video request: the VideoSpec fields, where the source text comes from and how to generate it.
+    Enum fields take their string values so a spec can be sent as JSON.
+    """
+    name : str
+    source_url : str # a Wikipedia article
+    sources : list[str] # more Wikipedia articles and local .txt, .md or .html files, merged after source_url
+    source_text : str # used instead of source_url and sources when given
+    description : str
+    type : str
+    tone : str
+    output_format : str
+    duration : float
+    visual_art_style : str
+    image_model_name : str | None
+    background_music : str | None
+    script_model : str
+    script_model_company : str
+    caption_backend : str
+    encoding_mode : str # "changes" only generates frames where the picture changes, with sprites captions
+    transcription_backend : str
+    workers : int
+    preview : bool
+    batch_narrations : bool # synthesize consecutive narrations together in fewer TTS requests
+    cache_narrations : bool # keep synthesized narrations in NARRATION_CACHE_FILEPATH for previews and reruns of the script
+    hedge_cost_cap : float # USD the job may spend on duplicate image requests
+    image_reuse_threshold : float | None # prompts this similar to an earlier one reuse its image, e.g. IMAGE_REUSE_THRESHOLD, null (the default) generates every image
+    image_reuse_across_topics : bool # also reuse images kept for other topics' videos, not only this one's
+    # variants of the video rendered from the same script, each overriding visual_art_style,
+    # image_model_name, output_format or background_music and optionally adding a caption_style
+    variants : list[dict]
+
+
+class CostSummary(TypedDict):
+    image_model : float
+    text_model : float
+    narration_model : float
+    transcription_model : float
+    total_cost : float
+
+
+class JobResult(TypedDict):
+    run_id : str # the run's id in the RunStore
+    video_filepath : str # the first variant's when the job has variants
+    variant_filepaths : list[str]
+    script_location : str
+    cost_summary : CostSummary
+
+
+def video_spec_from_job(job : JobSpec) -> VideoSpec:
+    """Builds and validates the VideoSpec of a job, raising ValueError for invalid fields."""
+    try:
+        return VideoSpec(
+            CONTENT_TYPES(job.get("type", CONTENT_TYPES.montage)),
+            CONTENT_TONES(job["tone"]),
+            OUTPUT_FORMATS(job.get("output_format", OUTPUT_FORMATS.tiktok)),
+            job.get("duration", 1),
+            VISUAL_ART_STYLES(job["visual_art_style"]),
+            IMAGE_MODEL_NAMES(job["image_model_name"]) if job.get("image_model_name") else None,
+            BACKGROUND_MUSIC(job["background_music"]) if job.get("background_music") else None)
+    except KeyError as e:
+        raise ValueError(f"job is missing the {e} field")
+
+
+def validate_job(job : JobSpec) -> VideoSpec:
+    """Checks everything a job needs before it is queued, raising ValueError if it cannot run."""
+    if not job.get("source_text") and not job.get("source_url") and not job.get("sources"):
+        raise ValueError("job needs a source_url, sources or source_text")
+    if not job.get("source_text"):
+        for source in job_sources(job):
+            try:
+                collector_for_source(source)
+            except CollectorError as e:
+                raise ValueError(str(e))
+    TEXT_MODEL_NAMES(job.get("script_model", TEXT_MODEL_NAMES.deepseek_v2))
+    TEXT_MODEL_COMPANY(job.get("script_model_company", TEXT_MODEL_COMPANY.deepseek))
+    CAPTION_BACKENDS(job.get("caption_backend", CAPTION_BACKENDS.moviepy))
+    TRANSCRIPTION_BACKENDS(job.get("transcription_backend", TRANSCRIPTION_BACKENDS.whisper))
+    if (ENCODING_MODES(job.get("encoding_mode", ENCODING_MODES.every_frame)) == ENCODING_MODES.changes
+            and CAPTION_BACKENDS(job.get("caption_backend", CAPTION_BACKENDS.moviepy)) != CAPTION_BACKENDS.sprites):
+        raise ValueError("encoding_mode changes needs the sprites caption_backend")
+    if not isinstance(job.get("hedge_cost_cap", 0.0), (int, float)) or job.get("hedge_cost_cap", 0.0) < 0:
+        raise ValueError("hedge_cost_cap must be a non-negative number")
+    threshold = job.get("image_reuse_threshold")
+    if threshold is not None and (not isinstance(threshold, (int, float)) or not 0 < threshold <= 1):
+        raise ValueError("image_reuse_threshold must be a number in (0, 1] or null")
+    if job.get("variants") and job.get("preview"):
+        raise ValueError("variants cannot be rendered as a preview")
+    for variant in job.get("variants", []):
+        variant_spec_from_job(job, variant)
+    return video_spec_from_job(job)
+
+
+def job_sources(job : JobSpec) -> list[str]:
+    """The sources a job's text is collected from, in priority order."""
+    return ([job["source_url"]] if job.get("source_url") else []) + list(job.get("sources", []))
+
+
+def variant_spec_from_job(job : JobSpec, variant : dict) -> VideoVariant:
+    """The VideoVariant of one of a job's variants, raising ValueError for invalid fields."""
+    if not isinstance(variant.get("caption_style", {}), dict):
+        raise ValueError("a variant's caption_style must be an object")
+    return {
+        "video_spec" : video_spec_from_job({**job, **variant}), #type: ignore
+        "caption_style" : variant.get("caption_style", {})
+    }
+
+
+def run_montage_job(job : JobSpec, on_stage : Callable[[str], None] = print, run_store : RunStore | None = None,
+                    progress : ProgressReporter | None = None) -> JobResult:
+    """Runs the whole montage pipeline for one job: source text, script, narrations, images and video
+
+    Args:
+        job (JobSpec): the video request
+        on_stage (Callable[[str], None]): called with a description as each stage starts
+        run_store (RunStore | None): where the run, its stages, files, API calls and costs are recorded, this process's store by default
+        progress (ProgressReporter | None): where narrations, images, frames rendered and their ETA are reported, the active reporter by default
+
+    Returns:
+        JobResult: the completed video, where its script was saved and what it cost
+    """
+    video_spec = validate_job(job)
+    name = job.get("name") or str(uuid.uuid4())
+    run_store = run_store or get_run_store()
+
+    cost_summary : CostSummary = {
+        "image_model" : 0.0,
+        "text_model" : 0.0,
+        "narration_model" : 0.0,
+        "transcription_model" : 0.0,
+        "total_cost" : 0.0
+    }
+
+    @contextmanager
+    def stage(description : str):
+        on_stage(description)
+        with run_store.track_stage(description):
+            yield
+
+    with (progress or get_progress_reporter()).activate(), run_store.track_run(name, job) as run_id:
+        # Source data gathering
+        text = job.get("source_text")
+        if not text:
+            with stage("collecting source text..."):
+                sources = job_sources(job)
+                # a single source is passed on whole, the bound keeps several merged sources to a size the script model handles
+                corpus = collect(sources, max_chars=COLLECTED_CORPUS_MAX_CHARS if len(sources) > 1 else None)
+                for report in corpus["sources"]:
+                    if report["status"] != "ok":
+                        on_stage(f"skipped {report['source']}: {report['error']}")
+                text = corpus["text"]
+                if corpus["truncated"]:
+                    on_stage(f"source text truncated to {len(text)} characters, the paragraphs past that were left out")
+                save_string_as_text(f"{TEXT_DATA_PATH}/{name}", text)
+                run_store.add_artifact(f"{TEXT_DATA_PATH}/{name}", "source_text")
+
+        # Script Generation
+        with stage("generating a script..."):
+            script_generator = MontageScriptGenerator(
+                text, video_spec,
+                TEXT_MODEL_NAMES(job.get("script_model", TEXT_MODEL_NAMES.deepseek_v2)),
+                TEXT_MODEL_COMPANY(job.get("script_model_company", TEXT_MODEL_COMPANY.deepseek)))
+            response = script_generator.generate_script()
+            cost_summary["text_model"] = round(response["cost"], 5)
+            script_location = f"{MONTAGE_SCRIPT_PATH}/{name} script.json"
+            save_dict_as_json(script_location, json.loads(response["script"]))
+            run_store.add_artifact(script_location, "script")
+
+        # Video assembly
+        video_gen = MontageGenerator(response["script"], video_spec, job.get("hedge_cost_cap", IMAGE_HEDGE_COST_CAP),
+                                     job.get("image_reuse_threshold"), name, job.get("image_reuse_across_topics", False))
+        try:
+            with stage("generating audio narrations..."):
+                cost_summary["narration_model"] = round(video_gen.generate_narrations_from_script(
+                    batch=job.get("batch_narrations", False), use_cache=job.get("cache_narrations", False)), 5)
+                if job.get("cache_narrations"):
+                    response_format = "pcm" if job.get("batch_narrations") else "mp3"
+                    for narration in video_gen.narrations:
+                        path = narration_cache_path(narration, response_format)
+                        if os.path.exists(path):
+                            # raw PCM has no header to probe, its length gives the duration
+                            duration = os.path.getsize(path) / 2 / TTS_PCM_FPS if response_format == "pcm" else None
+                            run_store.add_artifact(path, "narration", duration=duration)
+
+            with stage("generating accompanying images..."):
+                cost_summary["image_model"] = round(video_gen.generate_images_from_script(), 5)
+                if video_gen.hedge_budget.hedges:
+                    on_stage(f"sent {video_gen.hedge_budget.hedges} hedge image requests (${video_gen.hedge_budget.spent:.2f})")
+                if video_gen.image_generations_saved:
+                    on_stage(f"saved {video_gen.image_generations_saved} image generations by reusing images of similar prompts")
+                # generated images are kept so they can be found again by topic
+                for path in video_gen.keep_images(IMAGE_FILEPATH):
+                    run_store.add_artifact(path, "image")
+
+            variant_filepaths = []
+            if job.get("variants"):
+                with stage(f"compiling {len(job['variants'])} video variants..."):
+                    variants = [variant_spec_from_job(job, variant) for variant in job["variants"]]
+                    for variant in variants:
+                        variant["output_path"] = f"{COMPLETED_VIDEO_FILEPATH}{name}{uuid.uuid4()}.mp4"
+                    variant_filepaths, cost, image_cost = video_gen.generate_variants(
+                        variants,
+                        caption_backend=CAPTION_BACKENDS(job.get("caption_backend", CAPTION_BACKENDS.moviepy)),
+                        transcription_backend=TRANSCRIPTION_BACKENDS(job.get("transcription_backend", TRANSCRIPTION_BACKENDS.whisper)),
+                        workers=job.get("workers"),
+                        encoding_mode=ENCODING_MODES(job.get("encoding_mode", ENCODING_MODES.every_frame)))
+                    video_filepath = variant_filepaths[0]
+                    cost_summary["transcription_model"] = round(cost, 5)
+                    cost_summary["image_model"] = round(cost_summary["image_model"] + image_cost, 5)
+            else:
+                with stage("compiling video..."):
+                    video_filepath, cost = video_gen.generate_video(
+                        output_path=f"{COMPLETED_VIDEO_FILEPATH}{name}{uuid.uuid4()}.mp4",
+                        caption_backend=CAPTION_BACKENDS(job.get("caption_backend", CAPTION_BACKENDS.moviepy)),
+                        transcription_backend=TRANSCRIPTION_BACKENDS(job.get("transcription_backend", TRANSCRIPTION_BACKENDS.whisper)),
+                        workers=job.get("workers", 1),
+                        preview=job.get("preview", False),
+                        encoding_mode=ENCODING_MODES(job.get("encoding_mode", ENCODING_MODES.every_frame)))
+                    cost_summary["transcription_model"] = round(cost, 5)
+            for path in variant_filepaths or [video_filepath]:
+                run_store.add_artifact(path, "video")
+        finally:
+            video_gen.close()
+
+        cost_summary["total_cost"] = round(sum(v for k, v in cost_summary.items() if k != "total_cost"), 5)
+        run_store.finish_run(run_id, "done", dict(cost_summary))
+
+    return {
+        "run_id" : run_id,
+        "video_filepath" : video_filepath,
+        "variant_filepaths" : variant_filepaths,
+        "script_location" : script_location,
+        "cost_summary" : cost_summary
+    }
@@ -0,0 +1,273 @@
+from constants import *
+from proglog import ProgressBarLogger
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import deque
+from typing import TypedDict, Literal, Callable, Iterator, TextIO
+import threading
+import json
+import time
+import sys
+
+
+class ProgressEvent(TypedDict):
+    """One update of a stage's progress, JSON serializable so it can be sent to a scheduler as is."""
+    job : str | None
+    stage : str # e.g. "narrations", "images", "encoding", "upload"
+    unit : str # what done and total count, e.g. "scenes", "frames"
+    done : int
+    total : int | None
+    rate : float | None # units per second over the last PROGRESS_RATE_WINDOW_SECONDS
+    eta_seconds : float | None
+    elapsed_seconds : float
+    status : Literal["started", "running", "done", "failed"]
+    message : str | None
+    timestamp : float
+
+
+ProgressSink = Callable[[ProgressEvent], None]
+
+
+class StageProgress:
+    """
+    Counts the work done in one stage and reports it to its reporter, with the recent throughput
+    and the time left at that throughput.
+    """
+
+    def __init__(self, reporter : "ProgressReporter", stage : str, total : int | None = None, unit : str = "items"):
+        """
+        :param reporter: Where the stage's events are sent.
+        :param stage: Name of the stage.
+        :param total: Units of work in the stage, if known.
+        :param unit: What a unit of work is.
+        """
+        self.reporter = reporter
+        self.stage = stage
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.last_sent = 0.0
+        # (time, done) samples the rate is measured over
+        self.samples : deque[tuple[float, int]] = deque([(self.started_at, 0)])
+
+    def rate(self, now : float) -> float | None:
+        while len(self.samples) > 1 and now - self.samples[0][0] > PROGRESS_RATE_WINDOW_SECONDS:
+            self.samples.popleft()
+        start, done = self.samples[0]
+        if now <= start or self.done <= done:
+            return None
+        return (self.done - done) / (now - start)
+
+    def event(self, status : Literal["started", "running", "done", "failed"], message : str | None = None) -> ProgressEvent:
+        now = time.time()
+        rate = self.rate(now)
+        eta = None
+        if rate and self.total is not None:
+            eta = max(0.0, (self.total - self.done) / rate)
+        return {
+            "job" : self.reporter.job,
+            "stage" : self.stage,
+            "unit" : self.unit,
+            "done" : self.done,
+            "total" : self.total,
+            "rate" : rate,
+            "eta_seconds" : 0.0 if status == "done" else eta,
+            "elapsed_seconds" : now - self.started_at,
+            "status" : status,
+            "message" : message,
+            "timestamp" : now
+        }
+
+    def update(self, done : int, total : int | None = None, message : str | None = None, force : bool = False):
+        """Sets the units done so far, and the total when it is only known once the stage has started.
+        force sends the update even if the stage reported less than min_interval ago."""
+        with self.lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+            self.samples.append((time.time(), done))
+            if not force and time.time() - self.last_sent < self.reporter.min_interval:
+                return
+            event = self.event("running", message)
+            self.last_sent = event["timestamp"]
+        self.reporter.emit(event)
+
+    def advance(self, n : int = 1, message : str | None = None):
+        """Adds n units done."""
+        self.update(self.done + n, message=message)
+
+    def finish(self, status : Literal["done", "failed"] = "done", message : str | None = None):
+        with self.lock:
+            if status == "done" and self.total is not None:
+                self.done = self.total
+            event = self.event(status, message)
+        self.reporter.emit(event)
+
+
+class ProgressReporter:
+    """
+    Sends the progress of a job's stages to its sinks. Running updates of a stage are sent at most
+    every min_interval seconds, a stage starting, finishing or failing is always sent.
+
+    A reporter is made the current one with activate, and the pipeline reports to
+    get_progress_reporter(), so nothing needs to be threaded through the generators. Work run on
+    other threads only reports if it runs in a copy of the activating context.
+    """
+
+    def __init__(self, sinks : list[ProgressSink] | None = None, job : str | None = None,
+                 min_interval : float = PROGRESS_MIN_INTERVAL_SECONDS):
+        """
+        :param sinks: Called with every event sent, see TerminalProgressSink, JsonCallbackSink and JsonLinesFileSink.
+        :param job: Name of the job, included in every event.
+        :param min_interval: Seconds between running updates of the same stage.
+        """
+        self.sinks = sinks or []
+        self.job = job
+        self.min_interval = min_interval
+
+    def emit(self, event : ProgressEvent):
+        for sink in self.sinks:
+            try:
+                sink(event)
+            except Exception as e:
+                # a broken sink must not fail the render
+                print(f"progress sink failed: {type(e).__name__}: {e}")
+
+    @contextmanager
+    def stage(self, name : str, total : int | None = None, unit : str = "items") -> Iterator[StageProgress]:
+        """Reports a stage as started, yields its StageProgress and reports it done, or failed if it raises."""
+        progress = StageProgress(self, name, total, unit)
+        self.emit(progress.event("started"))
+        try:
+            yield progress
+        except BaseException as e:
+            progress.finish("failed", f"{type(e).__name__}: {e}")
+            raise
+        progress.finish("done")
+
+    @contextmanager
+    def activate(self) -> Iterator["ProgressReporter"]:
+        """Makes this the reporter get_progress_reporter returns in this context."""
+        token = current_progress_reporter.set(self)
+        try:
+            yield self
+        finally:
+            current_progress_reporter.reset(token)
+
+
+# the reporter the stages run in this context report to
+current_progress_reporter : ContextVar[ProgressReporter | None] = ContextVar("current_progress_reporter", default=None)
+
+# reports nowhere, used when no reporter is active
+_null_reporter = ProgressReporter()
+
+def get_progress_reporter() -> ProgressReporter:
+    """Returns the reporter active in this context, or one without sinks."""
+    return current_progress_reporter.get() or _null_reporter
+
+
+class TerminalProgressSink:
+    """
+    Draws each stage as a progress bar on one line of a terminal, followed by the throughput and ETA.
+    """
+
+    def __init__(self, stream : TextIO = sys.stderr, width : int = 30):
+        """
+        :param stream: Where the bar is drawn.
+        :param width: Characters in the bar.
+        """
+        self.stream = stream
+        self.width = width
+        self.lock = threading.Lock()
+
+    def format(self, event : ProgressEvent) -> str:
+        if event["total"]:
+            filled = int(self.width * min(1.0, event["done"] / event["total"]))
+            line = f"{event['stage']} [{'#' * filled}{'.' * (self.width - filled)}] {event['done']}/{event['total']} {event['unit']}"
+        else:
+            line = f"{event['stage']} {event['done']} {event['unit']}"
+        if event["status"] in ("done", "failed"):
+            line += f" {event['status']} in {format_seconds(event['elapsed_seconds'])}"
+        else:
+            if event["rate"]:
+                line += f" {event['rate']:.1f} {event['unit']}/s"
+            if event["eta_seconds"] is not None:
+                line += f" ETA {format_seconds(event['eta_seconds'])}"
+        if event["message"]:
+            line += f" {event['message']}"
+        return line
+
+    def __call__(self, event : ProgressEvent):
+        with self.lock:
+            end = "\n" if event["status"] in ("done", "failed") else ""
+            self.stream.write(f"\r\033[K{self.format(event)}{end}")
+            self.stream.flush()
+
+
+class JsonCallbackSink:
+    """
+    Passes every event to a callback as a JSON document, e.g. to post it to a scheduler.
+    """
+
+    def __init__(self, callback : Callable[[str], None]):
+        """
+        :param callback: Called with each event serialized to JSON.
+        """
+        self.callback = callback
+
+    def __call__(self, event : ProgressEvent):
+        self.callback(json.dumps(event))
+
+
+class JsonLinesFileSink:
+    """
+    Appends every event to a file as one line of JSON, so another process can follow the job with tail.
+    """
+
+    def __init__(self, path : str):
+        """
+        :param path: File the events are appended to.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, event : ProgressEvent):
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(event) + "\n")
+
+
+class MoviepyProgressLogger(ProgressBarLogger):
+    """
+    A moviepy logger forwarding the position of one of its progress bars to a StageProgress,
+    by default the "t" bar counting the frames a write_videofile has encoded.
+    """
+
+    def __init__(self, progress : StageProgress, bar : str = "t"):
+        """
+        :param progress: The stage the bar's position is reported to.
+        :param bar: Name of the moviepy bar followed, "t" for frames and "chunk" for audio chunks.
+        """
+        # bars are followed through bars_callback only, logging them would keep a line per frame
+        super().__init__(logged_bars=None)
+        self.progress = progress
+        self.bar = bar
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar != self.bar:
+            return
+        if attr == "total":
+            self.progress.update(0, total=value)
+        elif attr == "index":
+            # proglog sets the index to the item about to be processed, and to the bar's length once
+            # the loop ends, so the index is the count already done
+            total = self.bars[bar]["total"]
+            self.progress.update(min(value, total) if total is not None else value)
+
+
+def format_seconds(seconds : float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
@@ -0,0 +1,151 @@
+from constants import *
+from utils import save_list_as_json, load_list_from_json
+from PIL import Image, ImageOps
+from typing import TypedDict, NotRequired
+import numpy as np
+import threading
+import hashlib
+import io
+import os
+import re
+
+# words that say nothing about what is in the scene
+STOPWORDS = {"a", "an", "the", "of", "in", "on", "at", "to", "and", "or", "with", "by", "for", "from", "as",
+             "is", "are", "was", "were", "be", "its", "his", "her", "their", "this", "that", "during", "while"}
+
+_rng = np.random.default_rng(0x5EED)
+# odd multipliers and offsets of the multiply-shift hash family, one pair per MinHash permutation
+_MULTIPLIERS = _rng.integers(1, 2**63, size=IMAGE_PROMPT_MINHASH_PERMUTATIONS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_OFFSETS = _rng.integers(0, 2**63, size=IMAGE_PROMPT_MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def prompt_shingles(prompt : str) -> set[str]:
+    """The content words of a prompt and each pair of consecutive content words."""
+    words = [word for word in re.findall(r"[a-z0-9]+", prompt.lower()) if word not in STOPWORDS]
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+def prompt_anchors(prompt : str) -> frozenset[str]:
+    """The capitalized words and numbers of a prompt, mostly names of people and places and dates.
+    Prompts only match when these are the same, however similar the rest of their words. A word
+    starting a sentence is capitalized whatever it is, so it is only an anchor if it is a number."""
+    anchors = set()
+    for match in re.finditer(r"[A-Za-z0-9]+", prompt):
+        word = match.group()
+        sentence_start = re.search(r"(^|[.!?:;]\s*)[\"'“‘(\[]*$", prompt[:match.start()]) is not None
+        if any(c.isdigit() for c in word) or (word[0].isupper() and not sentence_start and word.lower() not in STOPWORDS):
+            anchors.add(word.lower())
+    return frozenset(anchors)
+
+
+def minhash_signature(prompt : str) -> np.ndarray:
+    """MinHash of a prompt's shingles, the fraction of equal entries in two signatures estimates
+    the Jaccard similarity of their shingle sets."""
+    shingles = prompt_shingles(prompt) or {""}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles],
+                      dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        permuted = (hashes[:, None] * _MULTIPLIERS[None, :] + _OFFSETS[None, :]) >> np.uint64(32)
+    return permuted.min(axis=0)
+
+
+class PromptIndexEntry(TypedDict):
+    prompt : str
+    image : str # the image generated for the prompt, a path or an artifact key
+    image_set : str # art style, model and aspect ratio the image was generated with, see image_set_name
+    topic : NotRequired[str | None] # of the video the image was kept for, None for images within a script
+
+
+def image_set_name(visual_art_style : VISUAL_ART_STYLES, image_model_name : IMAGE_MODEL_NAMES | None, aspect_ratio : str) -> str:
+    """Images are only reused between prompts generated in the same style, with the same model and shape."""
+    return "/".join(str(getattr(value, "value", value)) for value in (visual_art_style, image_model_name, aspect_ratio))
+
+
+class PromptIndex:
+    """
+    Finds the image generated for the most similar earlier prompt, comparing MinHash signatures of
+    the prompts' words so no embedding model or network call is needed, among prompts naming the
+    same people, places and numbers. Kept in memory for the prompts of one script, or persisted to
+    state_path for every image kept across runs.
+    """
+
+    def __init__(self, state_path : str | None = None):
+        """
+        :param state_path: JSON file the entries are persisted to, in memory only if None.
+        """
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.entries : list[PromptIndexEntry] = []
+        self.signatures = np.empty((0, IMAGE_PROMPT_MINHASH_PERMUTATIONS), dtype=np.uint64)
+        self.anchors : list[frozenset[str]] = []
+        if state_path and os.path.isfile(state_path):
+            self.add_entries(load_list_from_json(state_path))
+
+    def add_entries(self, entries : list[PromptIndexEntry]):
+        """Adds entries without persisting them."""
+        if entries:
+            self.entries.extend(entries)
+            self.anchors.extend(prompt_anchors(entry["prompt"]) for entry in entries)
+            self.signatures = np.vstack([self.signatures, *[minhash_signature(entry["prompt"]) for entry in entries]])
+
+    def add(self, entries : list[PromptIndexEntry]):
+        """Adds the entries not already in the index and persists it."""
+        with self.lock:
+            known = {(e["prompt"], e["image"], e["image_set"]) for e in self.entries}
+            entries = [e for e in entries if (e["prompt"], e["image"], e["image_set"]) not in known]
+            if not entries:
+                return
+            self.add_entries(entries)
+            if self.state_path:
+                temp_path = self.state_path + ".tmp"
+                save_list_as_json(temp_path, self.entries)
+                os.replace(temp_path, self.state_path)
+
+    def find(self, prompt : str, image_set : str, threshold : float, topic : str | None = None) -> tuple[PromptIndexEntry, float] | None:
+        """The entry of the same image set, and of topic unless it is None, whose prompt is most similar
+        to prompt, if at least threshold and naming the same people, places and numbers
+
+        Returns:
+            PromptIndexEntry: the matching entry
+            float: estimated Jaccard similarity of the two prompts
+        """
+        with self.lock:
+            if not self.entries:
+                return None
+            similarities = (self.signatures == minhash_signature(prompt)[None, :]).mean(axis=1)
+            anchors = prompt_anchors(prompt)
+            for i in np.argsort(-similarities, kind="stable"):
+                if similarities[i] < threshold:
+                    return None
+                entry = self.entries[i]
+                if (entry["image_set"] == image_set and self.anchors[i] == anchors
+                        and (topic is None or entry.get("topic") == topic)
+                        and (self.state_path is None or os.path.exists(entry["image"]))):
+                    return entry, float(similarities[i])
+        return None
+
+
+def derive_image(data : bytes, crop : float = IMAGE_DERIVE_CROP) -> bytes:
+    """A new shot of an image for a scene that shows nearly the same thing: mirrored, cropped in
+    and scaled back to the original size."""
+    with Image.open(io.BytesIO(data)) as image:
+        format = image.format or DEFAULT_IMAGE_FORMAT
+        width, height = image.size
+        mirrored = ImageOps.mirror(image.convert("RGB"))
+        box = (int(width * (1 - crop)), 0, width, int(height * crop))
+        derived = mirrored.crop(box).resize((width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        derived.save(out, format=format)
+        return out.getvalue()
+
+
+_image_prompt_index : PromptIndex | None = None
+_image_prompt_index_lock = threading.Lock()
+
+def get_image_prompt_index() -> PromptIndex:
+    """Returns this process's index of the prompts of every image kept."""
+    global _image_prompt_index
+    with _image_prompt_index_lock:
+        if _image_prompt_index is None:
+            _image_prompt_index = PromptIndex(IMAGE_PROMPT_INDEX_FILEPATH)
+    return _image_prompt_index
@@ -0,0 +1,156 @@
+from constants import *
+from typing import Mapping
+from contextlib import closing
+import sqlite3
+import time
+import re
+
+
+class RateLimitTimeout(Exception):
+    """
+    Raised when a rate limit token could not be acquired before the timeout.
+    """
+
+    def __init__(self, message: str):
+        """
+        :param message: A human-readable error message describing the issue.
+        """
+        super().__init__(message)
+
+
+def rate_limit_key(provider : str, endpoint : str) -> str:
+    """Bucket name for a provider endpoint, e.g. ('openai', 'tts') -> 'openai-tts'."""
+    return f"{provider}-{endpoint}"
+
+
+def parse_reset_duration(value : str) -> float | None:
+    """Parses rate limit reset durations such as '1s', '6m0s', '20ms' or plain seconds."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"h" : 3600.0, "m" : 60.0, "s" : 1.0, "ms" : .001}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+class RateLimiter:
+    """
+    Token buckets per provider endpoint, stored in SQLite so every thread and worker process
+    on the machine draws from the same budget. Each acquire runs in an IMMEDIATE transaction,
+    which serialises the refill and take across processes without a separate broker.
+    Buckets adapt to the rate limit headers returned by providers and back off on 429s.
+    """
+
+    def __init__(self, db_path : str = RATE_LIMIT_DB_FILEPATH,
+                 limits : dict[str, tuple[float, float]] = RATE_LIMITS):
+        """
+        :param db_path: SQLite file shared by every process using these limits.
+        :param limits: Default (requests, per_seconds) for each bucket key.
+        """
+        self.db_path = db_path
+        self.limits = limits
+        with closing(self.connect()) as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    capacity REAL NOT NULL,
+                    refill_per_second REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                )""")
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def load_bucket(self, connection : sqlite3.Connection, key : str, now : float) -> tuple[float, float, float, float]:
+        """Reads and refills a bucket inside the caller's transaction, creating it from the defaults if needed."""
+        row = connection.execute(
+            "SELECT tokens, capacity, refill_per_second, updated_at, blocked_until FROM buckets WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            requests, per_seconds = self.limits.get(key, DEFAULT_RATE_LIMIT)
+            tokens, capacity, refill, updated_at, blocked_until = requests, requests, requests / per_seconds, now, 0.0
+            connection.execute("INSERT INTO buckets VALUES (?, ?, ?, ?, ?, ?)", (key, tokens, capacity, refill, now, 0.0))
+        else:
+            tokens, capacity, refill, updated_at, blocked_until = row
+        tokens = min(capacity, tokens + max(0.0, now - updated_at) * refill)
+        return tokens, capacity, refill, blocked_until
+
+    def acquire(self, key : str, cost : float = 1.0, timeout : float | None = None) -> None:
+        """Blocks until cost tokens are available in the bucket and takes them
+
+        Args:
+            key (str): bucket key, see rate_limit_key
+            cost (float): tokens to take, usually 1 per request
+            timeout (float | None): give up after this many seconds
+
+        Raises:
+            RateLimitTimeout: if the tokens could not be acquired in time
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with closing(self.connect()) as connection:
+                connection.execute("BEGIN IMMEDIATE")
+                now = time.time()
+                tokens, capacity, refill, blocked_until = self.load_bucket(connection, key, now)
+                if now >= blocked_until and tokens >= cost:
+                    tokens -= cost
+                    wait = 0.0
+                else:
+                    wait = max(blocked_until - now, (cost - tokens) / refill if refill > 0 else 1.0)
+                connection.execute("UPDATE buckets SET tokens = ?, updated_at = ? WHERE key = ?", (tokens, now, key))
+                connection.execute("COMMIT")
+            if wait <= 0:
+                return
+            if deadline is not None and time.time() + wait > deadline:
+                raise RateLimitTimeout(f"Timed out waiting for rate limit bucket '{key}'.")
+            time.sleep(min(wait, 1.0))
+
+    def update_from_response(self, key : str, headers : Mapping[str, str], status_code : int = 200) -> None:
+        """Adapts a bucket to the provider's view of the rate limit
+
+        Args:
+            key (str): bucket key the request was made under
+            headers (Mapping[str, str]): response headers
+            status_code (int): response status, 429 blocks the bucket until the provider's reset time
+        """
+        headers = {k.lower() : v for k, v in headers.items()}
+        limit = headers.get("x-ratelimit-limit-requests")
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        reset = parse_reset_duration(headers.get("x-ratelimit-reset-requests", ""))
+        retry_after = parse_reset_duration(headers.get("retry-after", ""))
+
+        with closing(self.connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            tokens, capacity, refill, blocked_until = self.load_bucket(connection, key, now)
+            if limit is not None and float(limit) > 0:
+                # the provider's limit is per minute for OpenAI style headers
+                capacity = float(limit)
+                refill = capacity / 60
+            if remaining is not None:
+                tokens = min(tokens, float(remaining))
+            if status_code == 429:
+                tokens = 0.0
+                backoff = retry_after or reset or RATE_LIMIT_BACKOFF_SECONDS
+                blocked_until = max(blocked_until, now + backoff)
+            connection.execute(
+                "UPDATE buckets SET tokens = ?, capacity = ?, refill_per_second = ?, updated_at = ?, blocked_until = ? WHERE key = ?",
+                (tokens, capacity, refill, now, blocked_until, key))
+            connection.execute("COMMIT")
+
+
+_rate_limiter : RateLimiter | None = None
+
+def get_rate_limiter() -> RateLimiter:
+    """Returns this process's RateLimiter on the shared database."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+    return _rate_limiter
@@ -0,0 +1,168 @@
+import ast
+import json
+import re
+
+
+class ScriptParseError(Exception):
+    """
+    Raised when a model response cannot be repaired into the expected script structure.
+    """
+
+    def __init__(self, message: str):
+        """
+        :param message: A human-readable error message describing the issue.
+        """
+        super().__init__(message)
+
+
+# quotes models use as string delimiters, straight or typographic, and the quotes that close them
+STRING_QUOTES = {'"': '"', "'": "'", "“": "”“", "„": "”“", "‘": "’"}
+PYTHON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+
+
+def strip_code_fences(text: str) -> str:
+    """Removes a surrounding ```json ... ``` (or bare ```) fence."""
+    match = re.search(r"```(?:[a-zA-Z]+)?\s*\n?(.*?)```", text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+def extract_json_object(text: str) -> str:
+    """Returns the outermost {...} in text, skipping any prose around it."""
+    start = text.find("{")
+    if start < 0:
+        raise ScriptParseError("No JSON object found in the response.")
+    depth, in_string, escaped, quote = 0, False, False, ""
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == quote:
+                in_string = False
+        elif c in "\"'":
+            in_string, quote = True, c
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    # unbalanced (e.g. truncated) response, leave it to the parsers
+    return text[start:]
+
+
+def fix_json_syntax(text: str, python_literals: bool = True) -> str:
+    """Repairs the usual near-JSON mistakes: trailing commas, typographic or single quoted strings,
+    Python literals
+
+    Only the text between string literals is repaired, strings are re-quoted with straight double
+    quotes but their contents are kept as written.
+
+    Args:
+        text (str): the near-JSON text
+        python_literals (bool): rewrite None / True / False as their JSON counterparts
+    """
+    out = []
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c in STRING_QUOTES:
+            closing = STRING_QUOTES[c]
+            chars = []
+            i += 1
+            while i < n and text[i] not in closing:
+                if text[i] == "\\" and i + 1 < n:
+                    # \' is only an escape in single quoted strings, JSON wants the bare quote
+                    chars.append("'" if text[i + 1] == "'" else text[i:i + 2])
+                    i += 2
+                    continue
+                # a straight double quote inside a differently quoted string is part of the text
+                chars.append('\\"' if text[i] == '"' else text[i])
+                i += 1
+            out.append('"' + "".join(chars) + '"')
+            i += 1
+            continue
+        if c == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j < n and text[j] in "]}":
+                i += 1
+                continue
+        word = re.compile(r"[A-Za-z_]\w*").match(text, i)
+        if word:
+            out.append(PYTHON_LITERALS.get(word.group(), word.group()) if python_literals else word.group())
+            i = word.end()
+            continue
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def parse_json_object(text: str) -> dict:
+    """Parses a model response into a dict, trying progressively more lenient repairs
+
+    Plain JSON is tried first, then the outermost object with fences and prose removed, then that
+    object with its syntax repaired, and finally as a Python literal (e.g. a dict's str()).
+
+    Raises:
+        ScriptParseError: if no repair yields a dict
+    """
+    candidates = [text]
+    body = strip_code_fences(text).strip()
+    try:
+        candidates.append(extract_json_object(body))
+    except ScriptParseError:
+        # the fields without their enclosing braces, as in the prompt's example
+        candidates.append("{" + body + "}")
+    for candidate in candidates:
+        for attempt in (candidate, fix_json_syntax(candidate)):
+            try:
+                data = json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(data, dict):
+                return data
+    for candidate in candidates:
+        try:
+            data = ast.literal_eval(fix_json_syntax(candidate, python_literals=False))
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(data, dict):
+            return data
+    raise ScriptParseError("Response is not a JSON object and could not be repaired.")
+
+
+def normalize_key(key: str) -> str:
+    """'Image Prompts' / 'image-prompts' / 'imagePrompts' -> 'image_prompts'."""
+    key = re.sub(r"([a-z])([A-Z])", r"\1_\2", str(key).strip())
+    return re.sub(r"[\s\-]+", "_", key).lower()
+
+
+def string_list(value) -> list[str]:
+    """Coerces a field to a list of non empty strings, accepting a single string as a one item list."""
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        raise ScriptParseError(f"Expected a list of strings, got {type(value).__name__}.")
+    items = []
+    for item in value:
+        if isinstance(item, dict) and len(item) == 1:
+            # [{"narration": "..."}] style lists
+            item = next(iter(item.values()))
+        text = str(item).strip()
+        if text:
+            items.append(text)
+    return items
+
+
+def reconcile_lengths(primary: list[str], secondary: list[str]) -> tuple[list[str], list[str]]:
+    """Pairs two lists one to one. Surplus primary items are merged into the last paired one so
+    no narration text is lost, surplus secondary items are dropped."""
+    if not primary or not secondary:
+        raise ScriptParseError("Script has an empty list.")
+    n = min(len(primary), len(secondary))
+    primary = primary[:n - 1] + [" ".join(primary[n - 1:])]
+    return primary, secondary[:n]
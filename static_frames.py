@@ -0,0 +1,205 @@
+from typing import List
+from moviepy.editor import VideoClip
+from PIL import Image, ImageDraw, ImageFont
+from captions import TranscriptionWord, CaptionPlacement, layout_captions, load_font
+from constants import CAPTION_FONT_FILEPATH, CAPTION_FONT_SIZE, CAPTION_STROKE_WIDTH, CAPTION_MARGIN_BOTTOM, CAPTION_PADDING
+from FrameStore import FrameStore
+import numpy as np
+
+
+class CaptionSprite:
+    """
+    A caption word (background box and stroked text) rendered once to premultiplied
+    RGB and alpha arrays, with the rectangle and time span it occupies.
+    """
+
+    def __init__(self, placement : CaptionPlacement, rgb : np.ndarray, alpha : np.ndarray):
+        self.x = placement["x"]
+        self.y = placement["y"]
+        self.start = placement["start"]
+        self.end = placement["start"] + placement["duration"]
+        self.rgb = rgb
+        self.alpha = alpha
+
+    @property
+    def rect(self) -> tuple[int, int, int, int]:
+        height, width = self.alpha.shape[:2]
+        return self.x, self.y, self.x + width, self.y + height
+
+
+def draw_caption_sprite(
+    word : str,
+    size : tuple[int, int],
+    font : ImageFont.FreeTypeFont,
+    font_color : str = "white",
+    stroke_color : str = "black",
+    stroke_width : int = CAPTION_STROKE_WIDTH,
+    background_color : tuple = (0, 0, 0),
+    background_opacity : float = 0.6,
+) -> np.ndarray:
+    """Draws one caption word the way add_captions_helper composites it, a translucent box with the text at its top left corner
+
+    Returns:
+        np.ndarray: (height, width, 4) float32, premultiplied RGB in 0-255 then alpha in 0-1
+    """
+    box = Image.new("RGBA", size, (*background_color[:3], int(round(background_opacity * 255))))
+    text = Image.new("RGBA", size, (0, 0, 0, 0))
+    ImageDraw.Draw(text).text((0, 0), word, font=font, fill=font_color,
+                              stroke_width=stroke_width, stroke_fill=stroke_color)
+    rgba = np.asarray(Image.alpha_composite(box, text), dtype=np.float32) / 255
+    alpha = rgba[:, :, 3:]
+    return np.concatenate([rgba[:, :, :3] * alpha * 255, alpha], axis=2)
+
+
+def render_caption_sprite(
+    placement : CaptionPlacement,
+    font : ImageFont.FreeTypeFont,
+    font_color : str = "white",
+    stroke_color : str = "black",
+    stroke_width : int = CAPTION_STROKE_WIDTH,
+    background_color : tuple = (0, 0, 0),
+    background_opacity : float = 0.6,
+    frame_store : FrameStore | None = None,
+) -> CaptionSprite:
+    """Renders a placed caption word, drawing it once per frame store when one is given so worker processes share it."""
+    size = (placement["box_width"], placement["box_height"])
+    style = (font_color, stroke_color, stroke_width, background_color, background_opacity)
+    draw = lambda: draw_caption_sprite(placement["word"], size, font, *style)
+    if frame_store is None:
+        pixels = draw()
+    else:
+        key = frame_store.content_key("caption", placement["word"], repr(size), font.path, str(font.size), repr(style))
+        pixels = frame_store.get_or_create(key, draw)
+    return CaptionSprite(placement, pixels[:, :, :3], pixels[:, :, 3:])
+
+
+def intersect(a : tuple[int, int, int, int], b : tuple[int, int, int, int]) -> tuple[int, int, int, int] | None:
+    x0, y0, x1, y1 = max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])
+    return (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else None
+
+
+class StaticCaptionedClip(VideoClip):
+    """
+    Captions a video whose picture is still within known segments, such as a montage where every
+    scene is one image. The base frame of each segment is fetched once and kept, caption words are
+    pre-rendered as sprites, and a frame is only patched where captions appeared or disappeared
+    since the previous frame. When nothing changed the previous frame is returned as is.
+    Outside the static segments the base video is read every frame and all captions are drawn.
+    """
+
+    def __init__(
+        self,
+        video : VideoClip,
+        transcription_words : List[TranscriptionWord],
+        static_segments : list[tuple[float, float]] | None = None,
+        font_path : str = CAPTION_FONT_FILEPATH,
+        font_size : int = CAPTION_FONT_SIZE,
+        font_color : str = "white",
+        stroke_color : str = "black",
+        stroke_width : int = CAPTION_STROKE_WIDTH,
+        margin_bottom : int = CAPTION_MARGIN_BOTTOM,
+        background_color : tuple = (0, 0, 0),
+        background_opacity : float = 0.6,
+        padding : int = CAPTION_PADDING,
+        frame_store : FrameStore | None = None,
+    ):
+        """
+        :param video: The uncaptioned video.
+        :param transcription_words: Timed words to caption, laid out as by add_captions_helper.
+        :param static_segments: (start, end) times during which the video's picture does not change.
+        :param frame_store: Store the caption sprites are shared through when several processes render this video.
+        The remaining parameters are the caption style, as for add_captions_helper.
+        """
+        super().__init__(duration=video.duration)
+        self.video = video
+        self.size = video.size
+        self.audio = video.audio
+        self.static_segments = static_segments or []
+        self.segment_ends = np.array([end for _, end in self.static_segments])
+
+        font = load_font(font_path, font_size)
+        self.sprites = [
+            render_caption_sprite(placement, font, font_color, stroke_color, stroke_width, background_color, background_opacity, frame_store)
+            for placement in layout_captions(transcription_words, video.size, font, margin_bottom, padding)
+        ]
+        self.sprite_starts = np.array([sprite.start for sprite in self.sprites])
+        self.sprite_ends = np.array([sprite.end for sprite in self.sprites])
+
+        # only the current segment's base frame is kept, segments play in order when encoding
+        self.base_segment : int | None = None
+        self.base_frame : np.ndarray | None = None
+        self.last_state : tuple[int | None, frozenset[int]] | None = None
+        self.last_frame : np.ndarray | None = None
+        self.make_frame = self.render_frame
+
+    def segment_at(self, t : float) -> int | None:
+        index = int(np.searchsorted(self.segment_ends, t, side="right"))
+        if index < len(self.static_segments) and self.static_segments[index][0] <= t:
+            return index
+        return None
+
+    def get_base_frame(self, segment : int) -> np.ndarray:
+        if self.base_segment != segment:
+            start, end = self.static_segments[segment]
+            # the middle of the segment avoids sampling a neighbouring scene at the cut
+            self.base_frame = self.video.get_frame((start + min(end, self.video.duration)) / 2)
+            self.base_segment = segment
+        return self.base_frame #type: ignore
+
+    def change_times(self) -> list[float]:
+        """Every time the picture may change inside the static segments: the segments' starts and ends
+        and caption words appearing or disappearing. Outside them any frame may differ."""
+        times = {0.0, *self.sprite_starts.tolist(), *self.sprite_ends.tolist()}
+        for start, end in self.static_segments:
+            times |= {start, end}
+        return sorted(t for t in times if t < self.duration)
+
+    def active_sprites(self, t : float) -> frozenset[int]:
+        return frozenset(np.flatnonzero((self.sprite_starts <= t) & (t < self.sprite_ends)).tolist())
+
+    def blend(self, frame : np.ndarray, sprite : CaptionSprite, region : tuple[int, int, int, int]) -> None:
+        """Alpha blends the part of a sprite inside region onto frame in place."""
+        x0, y0, x1, y1 = region
+        sx, sy = x0 - sprite.x, y0 - sprite.y
+        rgb = sprite.rgb[sy:sy + y1 - y0, sx:sx + x1 - x0]
+        alpha = sprite.alpha[sy:sy + y1 - y0, sx:sx + x1 - x0]
+        target = frame[y0:y1, x0:x1]
+        target[...] = (target * (1 - alpha) + rgb + .5).astype(np.uint8)
+
+    def draw(self, frame : np.ndarray, sprites : frozenset[int], dirty : tuple[int, int, int, int]) -> None:
+        """Draws every active sprite overlapping the dirty rectangle, clipped to it."""
+        for index in sorted(sprites):
+            region = intersect(self.sprites[index].rect, dirty)
+            if region:
+                self.blend(frame, self.sprites[index], region)
+
+    def render_frame(self, t : float) -> np.ndarray:
+        segment = self.segment_at(t)
+        active = self.active_sprites(t)
+        state = (segment, active)
+        if segment is not None and state == self.last_state:
+            return self.last_frame #type: ignore
+
+        height, width = self.size[1], self.size[0]
+        bounds = (0, 0, width, height)
+        if segment is None:
+            frame = np.array(self.video.get_frame(t), dtype=np.uint8)
+            self.draw(frame, active, bounds)
+        elif self.last_state is not None and self.last_state[0] == segment:
+            # same base picture, restore and redraw only where the captions changed
+            base = self.get_base_frame(segment)
+            frame = self.last_frame.copy() #type: ignore
+            for index in active ^ self.last_state[1]:
+                dirty = intersect(self.sprites[index].rect, bounds)
+                if dirty:
+                    x0, y0, x1, y1 = dirty
+                    frame[y0:y1, x0:x1] = base[y0:y1, x0:x1]
+                    self.draw(frame, active, dirty)
+        else:
+            frame = np.array(self.get_base_frame(segment), dtype=np.uint8)
+            self.draw(frame, active, bounds)
+
+        # the returned frame may still be held by the encoder, later frames are patched on a copy
+        self.last_state = state
+        self.last_frame = frame
+        return frame
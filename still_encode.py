@@ -0,0 +1,97 @@
+from constants import *
+from static_frames import StaticCaptionedClip
+from parallel_render import TimelineSpec, build_timeline
+from ffmpeg_tools import run_ffmpeg
+from progress import get_progress_reporter
+from PIL import Image
+import numpy as np
+import shutil
+import uuid
+import os
+
+
+def change_frames(video : StaticCaptionedClip, n_frames : int, fps : int) -> list[int]:
+    """Indices of the frames whose picture may differ from the frame before: the first frame, the first
+    frame at or after each change time, and every frame outside the static segments."""
+    times = np.arange(n_frames) / fps
+    frames = set(np.searchsorted(times, video.change_times(), side="left").tolist())
+    if len(video.static_segments):
+        starts = np.array([start for start, _ in video.static_segments])
+        index = np.searchsorted(video.segment_ends, times, side="right")
+        static = (index < len(starts)) & (starts[np.minimum(index, len(starts) - 1)] <= times)
+        frames |= set(np.flatnonzero(~static).tolist())
+    else:
+        frames = set(range(n_frames))
+    return sorted(frame for frame in frames | {0} if frame < n_frames)
+
+
+def write_ffconcat(paths : list[str], starts : list[int], n_frames : int, fps : int, list_path : str) -> str:
+    """An ffconcat script showing each image from its start frame until the next one's. Times are
+    rounded to the microsecond from the frame grid rather than summed, so they never drift, and each
+    image is read at fps so its timestamp is not snapped to the image demuxer's default of 25."""
+    lines = ["ffconcat version 1.0"]
+    for path, start, end in zip(paths, starts, [*starts[1:], n_frames]):
+        escaped = os.path.abspath(path).replace("'", "'\\''")
+        lines += [f"file '{escaped}'", f"option framerate {fps}", f"duration {round(end / fps, 6) - round(start / fps, 6):.6f}"]
+    # the last duration is only honoured when another entry follows it
+    lines += lines[-3:-1]
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return list_path
+
+
+def render_timeline_changes(spec : TimelineSpec, n_frames : int, output_path : str, work_dir : str,
+                            fps_mode : str = STILL_ENCODE_FPS_MODE, progress_stage : str = "rendering") -> str:
+    """Renders a timeline of still scenes by generating only the frames where its picture changes,
+    scene cuts and caption words appearing or disappearing, and letting ffmpeg hold each one for its
+    duration. With fps_mode "cfr" the held frames are duplicated to spec["fps"] before encoding, so the
+    result plays like one rendered frame by frame; with "vfr" each distinct frame is encoded once.
+    Frames outside the timeline's static segments, such as motion, are all generated.
+
+    Args:
+        spec (TimelineSpec): the timeline to render, captioned with CAPTION_BACKENDS.sprites
+        n_frames (int): length of the timeline in frames
+        output_path (str): where to write the silent video
+        work_dir (str): directory for the distinct frames, which are removed once encoded
+        fps_mode (str): "cfr" or "vfr"
+        progress_stage (str): name the distinct frames generated are reported under
+
+    Returns:
+        str: output_path
+    """
+    if spec["caption_backend"] != CAPTION_BACKENDS.sprites:
+        raise ValueError(f"encoding only changed frames needs {CAPTION_BACKENDS.sprites.value} captions")
+    video = build_timeline(spec)
+    fps = spec["fps"]
+    frames = change_frames(video, n_frames, fps) #type: ignore
+    print(f"rendering {len(frames)} distinct frames of {n_frames}...")
+
+    frame_dir = os.path.join(work_dir, f"frames_{uuid.uuid4()}")
+    os.makedirs(frame_dir)
+    try:
+        paths = []
+        with get_progress_reporter().stage(progress_stage, total=len(frames), unit="frames") as progress:
+            for frame in frames:
+                path = os.path.join(frame_dir, f"{frame:08d}.png")
+                Image.fromarray(video.get_frame(frame / fps)).save(path, compress_level=STILL_ENCODE_PNG_COMPRESSION)
+                paths.append(path)
+                progress.advance()
+        if fps_mode != "cfr" and frames[-1] != n_frames - 1:
+            # a vfr stream ends one frame after its last timestamp, so the last picture is shown
+            # again on the last frame to hold it to the end of the timeline
+            paths.append(paths[-1])
+            frames.append(n_frames - 1)
+        list_path = write_ffconcat(paths, frames, n_frames, fps, os.path.join(frame_dir, "frames.ffconcat"))
+        if fps_mode == "cfr":
+            # the fps filter rounds each timestamp to the nearest frame, -fps_mode cfr alone can land a
+            # change one frame early
+            rate = ["-vf", f"fps={fps}"]
+        else:
+            # with B-frames x264 shifts the decode timestamps back by a few of the sparse vfr frames, and
+            # the container's duration, taken from them, ends well before the last frame
+            rate = ["-fps_mode", "vfr", "-video_track_timescale", str(fps * 1000), "-bf", "0"]
+        run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, *rate, "-t", f"{n_frames / fps:.6f}",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart", output_path])
+    finally:
+        shutil.rmtree(frame_dir, ignore_errors=True)
+    return output_path
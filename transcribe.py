@@ -1,11 +1,13 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 from moviepy.editor import AudioFileClip
 from constants import *
 from typing import TypedDict
+from rate_limits import rate_limit_key
+from clients import get_openai_client, send_rate_limited
+from RunStore import record_api_call
+import time
 
 load_dotenv()
-client = OpenAI()
 
 class TranscriptionWord(TypedDict):
     start : float
@@ -28,13 +30,21 @@ def get_timestamped_transcriptions(path_to_audio_file : str)-> tuple[list[Transc
     audio_file = open(path_to_audio_file, "rb")
     audio = AudioFileClip(path_to_audio_file)
     duration_in_seconds = audio.duration
-    transcription = client.audio.transcriptions.create(
-        file=audio_file,
-        model=model.value,
-        response_format="verbose_json",
-        timestamp_granularities=["word"]
-    )
+    key = rate_limit_key(TEXT_MODEL_COMPANY.openai.value, "whisper")
+    def request():
+        # rewound so a retry uploads the whole file again
+        audio_file.seek(0)
+        return get_openai_client().audio.transcriptions.with_raw_response.create(
+            file=audio_file,
+            model=model.value,
+            response_format="verbose_json",
+            timestamp_granularities=["word"]
+        )
+    started = time.perf_counter()
+    raw_response = send_rate_limited(key, request)
+    transcription = raw_response.parse()
     cost = duration_in_seconds * OPENAI_PRICING_MAP[model]["input"] / 60
+    record_api_call(TEXT_MODEL_COMPANY.openai.value, "whisper", model.value, time.perf_counter() - started, cost)
     if transcription.words:
         out : list[TranscriptionWord] = [w.to_dict() for w in transcription.words] #type: ignore
         return out, cost
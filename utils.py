@@ -1,5 +1,8 @@
 import base64
 import json
+import io
+import numpy as np
+from PIL import Image
 from constants import *
 
 def save_string_as_text(file_path: str, data: str) -> None:
@@ -40,6 +43,13 @@ def encode_png_to_base64(file_path: str) -> str:
     encoded_str = base64.b64encode(file_data).decode("utf-8")
     return encoded_str
 
+def decode_image_bytes(data: bytes) -> np.ndarray:
+    """
+    Decodes an encoded image (e.g. PNG bytes) into an RGB uint8 array.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        return np.array(image.convert("RGB"))
+
 def save_list_as_json(file_path: str, data_list: list) -> None:
     """
     Saves a Python list as a JSON file at the given file_path.